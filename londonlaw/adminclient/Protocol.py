@@ -19,8 +19,8 @@
 from twisted.internet import reactor, threads
 from twisted.protocols import basic
 from twisted.python import log
-import shlex, sys
-from londonlaw.common import util
+import sys
+from londonlaw.common import dispatch, util
 from londonlaw.common.protocol import *
 
 
@@ -40,6 +40,8 @@ class AdminClientProtocol(basic.LineOnlyReceiver):
       self._tagIndex   = 0
       self._waitTag    = ""
       self._state      = "init"
+      # whether a "slowest" request got an answer
+      self._slowest    = False
 
 
    def connectionLost(self, reason):
@@ -58,21 +60,18 @@ class AdminClientProtocol(basic.LineOnlyReceiver):
 
    def lineReceived(self, line):
       try:
-         tokens    = shlex.split(line)
+         tokens    = util.split_tokens(line)
          if len(tokens) > 1:
             tag       = tokens[0]
             response  = tokens[1].lower()
             data      = tokens[2:]
 
-            f = getattr(self, "".join(("response_", response, "_", self._state)), None)
-            if f is None:
-               # Try a catch-all method for the command
-               f = getattr(self, "".join(("response_", response, "_default")), None)
+            f = dispatch.getTable(self.__class__, "response_").lookup(self._state, response)
             if f is None:
                log.msg("Received unhandled server message (tried default): \"" + line + "\" state = \"" + self._state + "\"")
                return
             
-            f(tag, data)
+            f(self, tag, data)
          else:
             log.msg("Received unhandled server message (too few args): \"" + line + "\" state = \"" + self._state + "\"")
 
@@ -96,10 +95,10 @@ class AdminClientProtocol(basic.LineOnlyReceiver):
 
 
    def handleCommand(self, command_str):
-      commands = shlex.split(command_str)
+      commands = util.split_tokens(command_str)
       if commands[0] == 'commands':
          print "Command list: allplayers ban commands deletegame deleteplayer disconnect eject help"
-         print "              listgames listplayers password profile quit"
+         print "              listgames listplayers password profile quit slowest"
          print "Enter \"help <command>\" to see usage information."
          d = threads.deferToThread(self.getCommand)
          d.addCallback(self.handleCommand)
@@ -147,6 +146,9 @@ class AdminClientProtocol(basic.LineOnlyReceiver):
          elif commands[1] == 'quit':
             print "Usage: quit"
             print "Disconnect from the server and exit the admin client."
+         elif commands[1] == 'slowest':
+            print "Usage: slowest"
+            print "Shows the connection that the server is holding back the most output for, if any."
          else:
             print "Unable to provide help for unrecognized command \"" + commands[1] + "\"."
          d = threads.deferToThread(self.getCommand)
@@ -223,6 +225,10 @@ class AdminClientProtocol(basic.LineOnlyReceiver):
             d.addCallback(self.handleCommand)
       elif commands[0] == 'quit':
          self.transport.loseConnection()
+      elif commands[0] == 'slowest':
+         self._state   = "tryslowest"
+         self._slowest = False
+         self.sendTokens("slowest")
       else:
          print "Unrecognized command."
          d = threads.deferToThread(self.getCommand)
@@ -352,6 +358,14 @@ class AdminClientProtocol(basic.LineOnlyReceiver):
       d.addCallback(self.handleCommand)
 
 
+   def response_ok_tryslowest(self, tag, data):
+      self._state = "loggedin"
+      if not self._slowest:
+         print "No output is being held back."
+      d = threads.deferToThread(self.getCommand)
+      d.addCallback(self.handleCommand)
+
+
    def response_ok_trypassword(self, tag, data):
       self._state = "loggedin"
       print "User's password has been set."
@@ -372,6 +386,12 @@ class AdminClientProtocol(basic.LineOnlyReceiver):
       print "* \"" + makePrint(data[0]) + "\""
 
 
+   def response_slowest_tryslowest(self, tag, data):
+      self._slowest = True
+      print "* \"" + makePrint(data[0]) + "\""
+      print "     held back: " + data[1] + " bytes   stalled: " + data[2] + " s"
+
+
    def response_profile_tryprofile(self, tag, data):
       if tag == self._waitTag:
          print "password: \"" + makePrint(data[0]) + "\"   last_ip: " + data[1]
@@ -23,6 +23,12 @@ X_ALGORITHMS         = (("Rather Dumb Mr. X", "x_simple_launcher.py"),)
 
 DETECTIVE_ALGORITHMS = (("Rather Dumb Detectives", "detective_simple_launcher.py"),)
 
+# The same algorithms for the simulator and tournament runner, which play
+# the clients above in-process (see headless.py).  Keys are algorithm names
+# from the lists above, values are policy names from policies.py.
+ALGORITHM_POLICIES   = {"Rather Dumb Mr. X"      : "simple",
+                        "Rather Dumb Detectives" : "simple"}
+
 
 
 
@@ -19,10 +19,14 @@
 from twisted.internet import protocol, reactor
 from twisted.protocols import basic
 from twisted.python import log
-import re, shlex, sys, sets
+import re, sys, sets
 from londonlaw.common.protocol import *
 from londonlaw.common.Pawn import *
-from londonlaw.common import util, path, map
+from londonlaw.common import dispatch, frames, util, path, map, distances
+from londonlaw.common.GameState import GameState, PAWN_NAMES, TICKET_INDEX
+from londonlaw.common.graph import TICKET_NAMES
+from londonlaw.common.transposition import TranspositionTable
+from londonlaw.common.gamelist import GameList
 
 
 class BaseAIProtocolError(Exception):
@@ -32,7 +36,7 @@ class BaseAIProtocolError(Exception):
 # Base class for AI players.  Knows how to communicate with the server,
 # keeps track of pawn information and game history, has some basic
 # pathfinding/distance algorithms.
-class BaseAIProtocol(basic.LineOnlyReceiver):
+class BaseAIProtocol(basic.LineReceiver):
 
    def __init__(self):
       self._state              = "init"
@@ -44,7 +48,11 @@ class BaseAIProtocol(basic.LineOnlyReceiver):
       self._lastMover          = None
       self._lastXSurfacingTurn = None
       self._players            = sets.Set()
-      self._gameStatus         = None
+      # kept for the whole game, so searches can reuse earlier turns' work
+      self._transpositions     = TranspositionTable()
+      # protocol version 3: frames rather than lines (see frames.py)
+      self._protocolVersion    = BINARY_PROTOCOL_VERSION
+      self._frameReader        = None
 
 
    def connectionLost(self, reason):
@@ -58,7 +66,7 @@ class BaseAIProtocol(basic.LineOnlyReceiver):
       self._gameroom = self.factory.gameroom
       self._team     = self.factory.team
       self._state    = "protocol"
-      self.sendTokens(self.genTag(), "protocol", PROTOCOL_VERSION)
+      self.sendTokens(self.genTag(), "protocol", self._protocolVersion)
 
 
    # called when this AI needs to make a move
@@ -66,6 +74,38 @@ class BaseAIProtocol(basic.LineOnlyReceiver):
       raise NotImplementedError("doTurn must be implemented in derived classes.")
 
 
+   # Build a GameState from the current pawn information, with 'pawnName'
+   # (default Mr. X) to move.
+   def gameState(self, pawnName="X"):
+      state = GameState(turnNum=self._turnNum, current=PAWN_NAMES.index(pawnName))
+      for i in range(len(PAWN_NAMES)):
+         pawn = self._pawns[PAWN_NAMES[i]]
+         state.setLocation(i, pawn.getLocation())
+         for ticket, code in TICKET_INDEX.items():
+            state.setTicketAmount(i, code, pawn.getTicketAmount(ticket))
+      return state
+
+
+   # All legal moves for the named pawn, as lists ready for makeMove()
+   # (the same move generator the server validates against).
+   def legalMoves(self, pawnName, doubles=False):
+      index = PAWN_NAMES.index(pawnName)
+      moves = []
+      for move in self.gameState(pawnName).legalMoves(index, doubles):
+         m = [pawnName.lower(), str(move[1]), TICKET_NAMES[move[2]]]
+         if len(move) > 3:
+            m.extend([str(move[3]), TICKET_NAMES[move[4]]])
+         moves.append(m)
+      return moves
+
+
+   # The transposition table for search-based AIs, keyed by GameState.hash.
+   # It lives as long as this connection, and newSearch() is called on it at
+   # the start of every turn.
+   def transpositionTable(self):
+      return self._transpositions
+
+
    # Find sets of locations where Mr. X safely move on the next turn.
    # Returns a list of Sets: the first Set is locations at least distance
    # 1 from all detectives, the second Set is locations at least distance
@@ -79,20 +119,23 @@ class BaseAIProtocol(basic.LineOnlyReceiver):
        
       dets      = ['Red', 'Yellow', 'Green', 'Blue', 'Black']
       detLocs   = [self._pawns[d].getLocation() for d in dets]
-      allMoves  = path.possible_destinations(loc, 1, eliminate=[sets.Set(detLocs)])
-      distances = [path.distance(self._pawns[d].getLocation(),
+      state     = self.gameState()
+      state.setLocation(0, loc)
+      allMoves  = sets.Set([move[1] for move in state.legalMoves(0, doubles=False)
+            if move[1] not in detLocs])
+      detDistances = [path.distance(self._pawns[d].getLocation(),
             tickets=self._pawns[d]._tickets) for d in dets]
 
       def findSafe(threshold):
          safe = allMoves.copy()
          for dest in allMoves:
-            for dist in distances:
+            for dist in detDistances:
                if dist[dest] < threshold:
                   safe.remove(dest)
                   break
          return safe
 
-      return [findSafe(threshold) for threshold in range(1, map.MAX_DISTANCE + 1)]
+      return [findSafe(threshold) for threshold in range(1, distances.MAX_DISTANCE + 1)]
 
 
    def genTag(self):
@@ -105,29 +148,37 @@ class BaseAIProtocol(basic.LineOnlyReceiver):
 
    
    def lineReceived(self, line):
+      self.tokensReceived(util.split_tokens(line))
+
+
+   # frames, in protocol version 3
+   def rawDataReceived(self, data):
+      for opcode, payload in self._frameReader.feed(data):
+         if self.transport.disconnecting:
+            return
+         self.tokensReceived(frames.decode(opcode, payload))
+
+
+   def tokensReceived(self, tokens):
       try:
-         tokens = shlex.split(line)
          if len(tokens) > 1:
             tag       = tokens[0]
             response  = tokens[1].lower()
             data      = tokens[2:]
 
-            f = getattr(self, "".join(("response_", response, "_", self._state)), None)
-            if f is None:
-               # Try a catch-all method for the command
-               f = getattr(self, "".join(("response_", response, "_default")), None)
+            f = dispatch.getTable(self.__class__, "response_").lookup(self._state, response)
             if f is None:
-               log.msg("Received unhandled server message (tried default): \"" + line + "\" state = \"" + self._state + "\"")
+               log.msg("Received unhandled server message (tried default): \"" + util.join_tokens(*tokens) + "\" state = \"" + self._state + "\"")
                return
             
-            f(tag, data)
+            f(self, tag, data)
          else:
-            log.msg("Received unhandled server message (too few args): \"" + line + "\" state = \"" + self._state + "\"")
+            log.msg("Received unhandled server message (too few args): \"" + util.join_tokens(*tokens) + "\" state = \"" + self._state + "\"")
 
       except AttributeError, e:
          log.msg(str(e))
          log.msg("tokens = " + str(tokens))
-         log.msg("Received unhandled server message: \"" + line + "\" state = \"" + self._state + "\"")
+         log.msg("Received unhandled server message: \"" + util.join_tokens(*tokens) + "\" state = \"" + self._state + "\"")
 
 
    def makeMove(self, data):
@@ -167,10 +218,15 @@ class BaseAIProtocol(basic.LineOnlyReceiver):
    def response_gameinfo_default(self, tag, args):
       if len(args) >= 2:
          try:
-            name   = args[0].decode("utf-8")
-            status = args[1]
-            if name == self._gameroom:
-               self._gameStatus = status
+            self.factory.gameList.gameInfo([args[0].decode("utf-8")] + args[1:])
+         except:
+            pass
+
+
+   def response_gameremoved_default(self, tag, args):
+      if len(args) >= 1:
+         try:
+            self.factory.gameList.gameRemoved(args[0].decode("utf-8"))
          except:
             pass
 
@@ -207,7 +263,16 @@ class BaseAIProtocol(basic.LineOnlyReceiver):
 
 
    def response_no_protocol(self, tag, args):
-      self.transport.loseConnection()
+      if self._protocolVersion == BINARY_PROTOCOL_VERSION:
+         # an older server; fall back on the text protocol
+         self._protocolVersion = PROTOCOL_VERSION
+         self.sendTokens(self.genTag(), "protocol", self._protocolVersion)
+      else:
+         self.transport.loseConnection()
+
+
+   def response_bad_protocol(self, tag, args):
+      self.response_no_protocol(tag, args)
 
 
    def response_no_trysetteam(self, tag, args):
@@ -218,13 +283,15 @@ class BaseAIProtocol(basic.LineOnlyReceiver):
 
 
    def response_ok_trylistgames(self, tag, args):
-      if self._gameStatus == GAMESTATUS_NEW:
+      self.factory.gameList.endListing(args)
+      gameStatus = self.factory.gameList.getStatus(self._gameroom)
+      if gameStatus == GAMESTATUS_NEW:
          self._state = "tryjoin"
          self.sendTokens(self.genTag(), "join", self._gameroom.encode("utf-8"))
-      elif self._gameStatus == GAMESTATUS_INPROGRESS:
+      elif gameStatus == GAMESTATUS_INPROGRESS:
          self._state = "tryrejoin"
          self.sendTokens(self.genTag(), "join", self._gameroom.encode("utf-8"))
-      elif self._gameStatus == None:
+      elif gameStatus == None:
          log.msg("Specified game not found; exiting.")
          self.transport.loseConnection()
       else:
@@ -234,7 +301,8 @@ class BaseAIProtocol(basic.LineOnlyReceiver):
 
    def response_ok_login(self, tag, args):
       self._state = "trylistgames"
-      self.sendTokens(self.genTag(), "listgames")
+      self.factory.gameList.startListing()
+      self.sendTokens(self.genTag(), *self.factory.gameList.listTokens())
 
 
    def response_ok_playing(self, tag, args):
@@ -242,6 +310,9 @@ class BaseAIProtocol(basic.LineOnlyReceiver):
 
 
    def response_ok_protocol(self, tag, args):
+      if self._protocolVersion == BINARY_PROTOCOL_VERSION:
+         self._frameReader = frames.FrameReader()
+         self.setRawMode()
       self._state = "login"
       self.sendTokens(self.genTag(), "login", self._username, self._password)
 
@@ -298,6 +369,7 @@ class BaseAIProtocol(basic.LineOnlyReceiver):
 
    def response_turn_playing(self, tag, args):
       if args[0] in self._myPawns.keys():
+         self._transpositions.newSearch()
          self.doTurn(args[0])
 
 
@@ -341,6 +413,12 @@ class BaseAIProtocol(basic.LineOnlyReceiver):
          self.sendTokens(self.genTag(), "chatteam", text.encode("utf-8"))
 
 
+   def sendLine(self, line):
+      if self._frameReader is not None:
+         self.transport.write(frames.encodeText(line))
+      else:
+         basic.LineReceiver.sendLine(self, line)
+
    def sendTokens(self, *tokens):
       s = util.join_tokens(*tokens)
       self.sendLine(str(s))
@@ -355,6 +433,9 @@ class BaseAIFactory(protocol.ClientFactory):
       self.password = password
       self.gameroom = gameroom
       self.team     = team
+      # kept across connections, so that a reconnecting bot only
+      # fetches the changes to the game list
+      self.gameList = GameList()
 
    def clientConnectionFailed(self, connector, reason):
       log.msg("Failed to connect to specified server.")
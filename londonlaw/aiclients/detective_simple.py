@@ -114,10 +114,7 @@ class DetectiveSimpleAIProtocol(base.BaseAIProtocol):
          else:
             # if we can't find anything good, make a random move
             log.msg("moving randomly")
-            availableMoves = list(path.possible_destinations(pawn.getLocation(), 1,
-               tickets=pawn._tickets, eliminate = [sets.Set(detective_locs)]))
-            move = random.choice(availableMoves)
-            self.makeMove([pawnName.lower(), str(all_paths[move][0][0]), all_paths[move][0][1]])
+            self.makeMove(random.choice(self.legalMoves(pawnName)))
 
 
 
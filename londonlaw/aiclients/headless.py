@@ -0,0 +1,195 @@
+#  London Law -- a networked manhunting board game
+#  Copyright (C) 2003-2004, 2005 Paul Pelzl
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License, Version 2, as
+#  published by the Free Software Foundation.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# headless.py
+#
+# Run the network AI clients in-process, as policies (see policies.py) for
+# the simulator and tournament runner.
+#
+# A ClientPolicy plays one side of a game with an unmodified BaseAIProtocol
+# subclass.  It listens to the game the way a connected player's listener
+# does, and hands the bot the same messages the server would send that
+# player: pawn information, the (masked) history and the turn number when it
+# first sees the game, as on a rejoin, and then every move, turn and stuck
+# pawn.  The messages are queued and delivered when the policy is asked for
+# a move; the bot's "move" or "doublemove" command is read back from what it
+# writes to its transport, and answered with "ok".
+#
+# The bots draw on the global 'random' module.  It is seeded from the game's
+# random number generator for each decision (and its previous state restored
+# afterwards), so seeded games stay reproducible.
+
+import random
+
+from londonlaw.common.protocol import *
+from londonlaw.common import util
+from londonlaw.aiclients.x_simple import XSimpleAIProtocol
+from londonlaw.aiclients.detective_simple import DetectiveSimpleAIProtocol
+
+
+class ClientPolicyError(Exception):
+   pass
+
+
+
+# Stands in for the bot's connection, keeping whatever it writes.
+class _Transport(object):
+   def __init__(self):
+      self.disconnecting = False
+      self.lines         = []
+
+   def write(self, data):
+      self.lines.extend([line for line in data.split("\r\n") if line != ""])
+
+   def writeSequence(self, seq):
+      self.write("".join(seq))
+
+   def loseConnection(self):
+      self.disconnecting = True
+
+
+
+# Game listener that turns game events into the messages the server would
+# send to 'player', queued for the bot.
+class _ClientListener:
+   def __init__(self, game, player):
+      self._game   = game
+      self._player = player
+      self.queue   = []
+
+   def _hideX(self):
+      return self._player != self._game.getPawnByName("X").getPlayer()
+
+   # everything a rejoining player is sent (see Game.syncPlayer)
+   def sync(self):
+      game = self._game
+      for pawn in game.getPawns():
+         if pawn.getName() == "X" and self._hideX() and not game.isSurfacingTurn():
+            loc = -1
+         else:
+            loc = pawn.getLocation()
+         self.queue.append(["*", "pawninfo", pawn.getName(),
+               pawn.getPlayer().encode("utf-8"), repr(loc)] +
+               [repr(pawn.getTicketAmount(ticket))
+                for ticket in ("taxi", "bus", "underground", "black", "double")])
+      history = game.getHistory()
+      for turn in range(len(history)):
+         lines = []
+         for move in history[turn]:
+            if move[0] == "X" and turn not in SURFACING_TURNS and self._hideX():
+               move = move[:1] + ("-1",) + move[2:]
+            lines.append(" ".join(move))
+         if lines != []:
+            self.queue.append(["*", "history", repr(turn)] + lines)
+      self.queue.append(["*", "history", "end"])
+      self.announceTurnNum(game.getTurnNum())
+      self.announceTurn(game.getCurrentPawn())
+
+   def announceHistory(self, history, since=None):
+      pass
+
+   def announcePawnInfo(self):
+      pass
+
+   def announceTurnNum(self, num):
+      self.queue.append(["*", "turnnum", repr(num)])
+
+   def announceTurn(self, pawn):
+      self.queue.append(["*", "turn", pawn.getName()])
+
+   def gameOverEvade(self, winningTeam):
+      pass
+
+   def gameOverStuck(self, winningTeam):
+      pass
+
+   def gameOverCaught(self, winningTeam, detective):
+      pass
+
+   def pawnMove(self, game, pawn, *moves):
+      for dest, transport in moves:
+         self.queue.append(["*", "move", pawn.getName(), repr(dest), transport])
+
+   def pawnStuck(self, pawn):
+      self.queue.append(["*", "stuck", pawn.getName()])
+
+
+
+# Policy that asks an instance of 'protocolClass' for every move.  One bot
+# is started for each game, playing as the player of the pawns it is asked
+# to move.
+class ClientPolicy(object):
+   protocolClass = None
+
+   def __init__(self, protocolClass=None):
+      if protocolClass is not None:
+         self.protocolClass = protocolClass
+      self._game     = None
+      self._bot      = None
+      self._listener = None
+
+   def _startGame(self, game, pawn):
+      player = pawn.getPlayer()
+      if player is None:
+         raise ClientPolicyError("pawn %s has no player for the bot to play as" % pawn.getName())
+      self._game     = game
+      self._listener = _ClientListener(game, player)
+      self._bot      = self.protocolClass()
+      self._bot._username = player
+      self._bot._state    = "playing"
+      self._bot.transport = _Transport()
+      game.addListener(self._listener, player)
+      self._listener.sync()
+
+   def chooseMove(self, game, pawn, rng):
+      if game is not self._game:
+         self._startGame(game, pawn)
+      bot       = self._bot
+      transport = bot.transport
+      queue     = self._listener.queue
+      self._listener.queue = []
+
+      saved = random.getstate()
+      random.seed(rng.getrandbits(64))
+      try:
+         for tokens in queue:
+            bot.tokensReceived(tokens)
+      finally:
+         random.setstate(saved)
+
+      lines = transport.lines
+      transport.lines = []
+      for line in lines:
+         tokens = util.split_tokens(line)
+         if len(tokens) >= 2 and tokens[1] in ("move", "doublemove"):
+            if len(tokens) < 5 or tokens[2] != pawn.getName().lower():
+               break
+            bot.tokensReceived([tokens[0], "ok"])
+            if tokens[1] == "move":
+               return (int(tokens[3]), tokens[4])
+            elif len(tokens) >= 7:
+               return (int(tokens[3]), tokens[4], int(tokens[5]), tokens[6])
+            break
+      raise ClientPolicyError("%s made no move for %s; it sent %r" %
+            (self.protocolClass.__name__, pawn.getName(), lines))
+
+
+class XSimplePolicy(ClientPolicy):
+   protocolClass = XSimpleAIProtocol
+
+
+class DetectiveSimplePolicy(ClientPolicy):
+   protocolClass = DetectiveSimpleAIProtocol
@@ -0,0 +1,143 @@
+#  London Law -- a networked manhunting board game
+#  Copyright (C) 2003-2004, 2005 Paul Pelzl
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License, Version 2, as
+#  published by the Free Software Foundation.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# policies.py
+#
+# Move-selection policies for in-process play (see server/Simulator.py).
+#
+# A policy is any object with a method chooseMove(game, pawn, rng), where
+# 'game' is a server.Game.Game and 'pawn' is the pawn to move.  It returns
+# either (dest, ticket) or (dest1, ticket1, dest2, ticket2), which must be a
+# legal move.  All randomness must come from 'rng' (a random.Random), so that
+# a seeded game always plays out the same way.
+#
+# Policies may look at the whole Game object, but detective policies should
+# only use what a detective player would see: the pawn locations, and Mr. X's
+# location on surfacing turns.
+
+from londonlaw.common.protocol import *
+from londonlaw.common import bitsets, distances, path
+from londonlaw.aiclients import headless
+
+
+# Mr. X's preference among tickets, lowest first: taxis give away the least,
+# and black tickets are in short supply.
+_X_TICKET_COST = {"taxi" : 0, "bus" : 1, "underground" : 2, "black" : 3}
+
+
+# List all legal moves for 'pawn': (dest, ticket) pairs and, if 'doubles' is
+# true and the pawn holds a double-move ticket, (dest1, ticket1, dest2,
+# ticket2) double moves.
+def legalMoves(game, pawn, doubles=True):
+   moves = game.legalMoves(pawn, doubles)
+   moves.sort()
+   return moves
+
+
+# Return the moves with the highest score, given a list of (score, move).
+def _bestMoves(scored):
+   best      = []
+   bestScore = None
+   for score, move in scored:
+      if bestScore is None or score > bestScore:
+         best      = [move]
+         bestScore = score
+      elif score == bestScore:
+         best.append(move)
+   return (bestScore, best)
+
+
+# Compute the locations where Mr. X might be, as a detective would see it:
+# start from his location on the most recent surfacing turn and follow the
+# tickets he has used since.  Returns an empty list if he has not surfaced.
+def possibleXLocations(game):
+   history = game.getHistory()
+   lastLoc = None
+   tickets = []
+   for turn in range(1, len(history)):
+      for move in history[turn]:
+         if move[0] == "X":
+            if turn in SURFACING_TURNS:
+               lastLoc = int(move[1])
+               tickets = []
+            elif lastLoc is not None:
+               tickets.append(move[2])
+   if lastLoc is None:
+      return []
+   return bitsets.to_locations(path.possible_locations_mask(lastLoc, tickets))
+
+
+
+# Pick any legal move (double moves included), uniformly at random.
+class RandomPolicy(object):
+   def chooseMove(self, game, pawn, rng):
+      return rng.choice(legalMoves(game, pawn))
+
+
+# Mr. X policy: move where the nearest detective is as far away as possible,
+# preferring cheap tickets and breaking remaining ties at random.  When every
+# single move leaves a detective within one move of him, he plays a double
+# move instead if one gets him further away.
+class EvasiveXPolicy(object):
+   def chooseMove(self, game, pawn, rng):
+      tables  = distances.get_tables()
+      detLocs = [p.getLocation() for p in game.getPawns() if p != pawn]
+      # the map is undirected, so distances from dest are distances to it
+      nearest = lambda dest: tables.nearest(dest, detLocs, distances.NO_BLACK)
+
+      score, best = _bestMoves([((nearest(dest), -_X_TICKET_COST[ticket]), (dest, ticket))
+            for dest, ticket in legalMoves(game, pawn, False)])
+      if score[0] <= 1 and pawn.hasTicket("double"):
+         doubleScore, doubles = _bestMoves([((nearest(move[2]),
+               -_X_TICKET_COST[move[1]] - _X_TICKET_COST[move[3]]), move)
+               for move in legalMoves(game, pawn) if len(move) == 4])
+         if doubles != [] and doubleScore[0] > score[0]:
+            best = doubles
+      return rng.choice(best)
+
+
+# Detective policy: once Mr. X has surfaced, close in on the nearest of his
+# possible locations; before that, move at random.
+class ChaserDetectivePolicy(object):
+   def __init__(self):
+      # Mr. X's possible locations only change when he moves, which he does
+      # before any detective in a turn, so they are worked out once per turn
+      self._targetsKey = None
+      self._targets    = None
+
+   def chooseMove(self, game, pawn, rng):
+      moves = legalMoves(game, pawn)
+      key   = (game, game.getTurnNum())
+      if key != self._targetsKey:
+         self._targetsKey = key
+         self._targets    = possibleXLocations(game)
+      targets = self._targets
+      if targets == []:
+         return rng.choice(moves)
+      tables = distances.get_tables()
+      score, best = _bestMoves([(-tables.nearest(dest, targets, distances.NO_BLACK), (dest, ticket))
+            for dest, ticket in moves])
+      return rng.choice(best)
+
+
+
+# "simple" plays the network AI clients themselves (see headless.py)
+X_POLICIES         = {"random" : RandomPolicy, "evasive" : EvasiveXPolicy,
+                      "simple" : headless.XSimplePolicy}
+DETECTIVE_POLICIES = {"random" : RandomPolicy, "chaser" : ChaserDetectivePolicy,
+                      "simple" : headless.DetectiveSimplePolicy}
+
+
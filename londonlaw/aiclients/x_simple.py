@@ -20,7 +20,6 @@ import random
 from twisted.internet import protocol
 from twisted.python import log
 from londonlaw.aiclients import base
-from londonlaw.common import path
 
 
 # A very simple but complete AI client for Mr. X.
@@ -43,9 +42,14 @@ class XSimpleAIProtocol(base.BaseAIProtocol):
          elif ticket == 'black':
             return 5
 
-      all_paths = path.cheapest_path(self._pawns['X'].getLocation(), 
-                                     tickets=self._pawns['X']._tickets,
-                                     cost=cost)
+      # the cheapest ticket for each location Mr. X can move to directly
+      # (the safe moves are all such locations)
+      direct = {}
+      for m in self.legalMoves('X'):
+         dest, ticket = int(m[1]), m[2]
+         if dest not in direct or cost(self._pawns['X']._tickets, ticket) < \
+               cost(self._pawns['X']._tickets, direct[dest]):
+            direct[dest] = ticket
 
       # look at the available moves in order from most safe to least safe
       safe = self.safeMoves()
@@ -57,8 +61,7 @@ class XSimpleAIProtocol(base.BaseAIProtocol):
          moves_list = list(moves)
          random.shuffle(moves_list)
          for move in moves_list:
-            p = all_paths[move]
-            dest, transport = p[0]
+            transport = direct[move]
             if cost(self._pawns['X']._tickets, transport) < bestCost:
                bestMove = move
                bestTransport = transport
@@ -72,10 +75,8 @@ class XSimpleAIProtocol(base.BaseAIProtocol):
       # if no safe moves can be found, then move randomly
       if bestMove == None:
          log.msg("detectives have me trapped--moving randomly")
-         moves = path.possible_destinations(self._pawns['X'].getLocation, 1,
-                 tickets=self._pawns['X']._tickets)[0]
-         selected_move = random.choice(list(moves))
-         bestMove, bestTransport = all_paths[selected_move]
+         self.makeMove(random.choice(self.legalMoves('X')))
+         return
 
       log.msg("making a move")    
       self.makeMove(['x', str(bestMove), str(bestTransport)])
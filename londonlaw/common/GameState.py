@@ -0,0 +1,302 @@
+#  London Law -- a networked manhunting board game
+#  Copyright (C) 2003-2004, 2005 Paul Pelzl
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License, Version 2, as
+#  published by the Free Software Foundation.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# GameState.py
+#
+# The position of a game in a compact form: the locations of the six pawns
+# and their ticket counts, held in two fixed-size integer arrays.  Pawns are
+# identified by index (X_INDEX for Mr. X, then the detectives in turn order)
+# and tickets by the integer codes of common/graph.py, plus DOUBLE_CODE for
+# Mr. X's double-move tickets.  A ticket count of -1 means unlimited.
+#
+# The state also records the turn number and the pawn to move, and keeps a
+# Zobrist hash of all of the above up to date as it changes (see zobrist.py),
+# so positions can be looked up in a transposition table.
+#
+# Search code can either copy() a state, or apply() moves to it and undo()
+# them again.  A move is a tuple
+#
+#   (pawn, dest, ticket)                         a single move
+#   (pawn, dest1, ticket1, dest2, ticket2)       a double move
+#
+# apply() passes the turn to the next pawn in order (it does not skip stuck
+# detectives).  The state knows nothing about players or listeners, and the
+# full turn rules are left to server/Game.py (or to the search code).
+
+import array
+
+from londonlaw.common import zobrist
+from londonlaw.common.graph import graph, MASK_CODES, TICKET_NAMES, TICKET_CODES
+
+
+class GameStateError(Exception):
+   pass
+
+
+PAWN_NAMES   = ("X", "Red", "Yellow", "Green", "Blue", "Black")
+NUM_PAWNS    = len(PAWN_NAMES)
+X_INDEX      = 0
+DETECTIVES   = tuple(range(1, NUM_PAWNS))
+
+DOUBLE_CODE  = len(TICKET_NAMES)
+NUM_TICKETS  = DOUBLE_CODE + 1
+
+# ticket code <-> ticket name, including double-move tickets
+ALL_TICKET_NAMES = TICKET_NAMES + ("double",)
+TICKET_INDEX = TICKET_CODES.copy()
+TICKET_INDEX["double"] = DOUBLE_CODE
+
+UNLIMITED    = -1
+
+# the Zobrist key tables, for the inline hash updates in apply()
+_LOCATION_KEYS = zobrist.LOCATION
+_TICKET_KEYS   = zobrist.TICKETS
+_TURN_KEYS     = zobrist.TURN
+_TO_MOVE_KEYS  = zobrist.TO_MOVE
+_NUM_LOCATIONS = zobrist.NUM_LOCATIONS
+_AMOUNT_KEYS   = zobrist.AMOUNT_KEYS
+_NUM_TURN_KEYS = zobrist.TURN_KEYS
+
+
+class GameState(object):
+   __slots__ = ("locations", "tickets", "turnNum", "current", "hash", "_undo")
+
+   def __init__(self, locations=None, tickets=None, turnNum=1, current=X_INDEX):
+      if locations is None:
+         locations = [0] * NUM_PAWNS
+      if tickets is None:
+         tickets = [0] * (NUM_PAWNS * NUM_TICKETS)
+      if len(locations) != NUM_PAWNS or len(tickets) != NUM_PAWNS * NUM_TICKETS:
+         raise GameStateError("wrong number of locations or tickets")
+      self.locations = array.array("i", locations)
+      self.tickets   = array.array("i", tickets)
+      self.turnNum   = turnNum
+      self.current   = current
+      self.hash      = zobrist.hashPosition(self.locations, self.tickets, turnNum, current)
+      self._undo     = []
+
+   # __slots__ classes need explicit pickle support (games are shelved)
+   def __getstate__(self):
+      return (self.locations.tolist(), self.tickets.tolist(), self.turnNum, self.current,
+              list(self._undo))
+
+   def __setstate__(self, state):
+      locations, tickets, turnNum, current, undo = state
+      self.locations = array.array("i", locations)
+      self.tickets   = array.array("i", tickets)
+      self.turnNum   = turnNum
+      self.current   = current
+      self.hash      = zobrist.hashPosition(self.locations, self.tickets, turnNum, current)
+      self._undo     = list(undo)
+
+   # Return an independent copy of the position (without any undo history).
+   def copy(self):
+      other = GameState.__new__(GameState)
+      other.locations = self.locations[:]
+      other.tickets   = self.tickets[:]
+      other.turnNum   = self.turnNum
+      other.current   = self.current
+      other.hash      = self.hash
+      other._undo     = []
+      return other
+
+   def key(self):
+      return (self.locations.tostring(), self.tickets.tostring(), self.turnNum, self.current)
+
+   def getLocation(self, pawn):
+      return self.locations[pawn]
+
+   def setLocation(self, pawn, loc):
+      self.hash ^= zobrist.locationKey(pawn, self.locations[pawn]) ^ zobrist.locationKey(pawn, loc)
+      self.locations[pawn] = loc
+
+   def getTicketAmount(self, pawn, ticket):
+      return self.tickets[pawn * NUM_TICKETS + ticket]
+
+   def setTicketAmount(self, pawn, ticket, amount):
+      i = pawn * NUM_TICKETS + ticket
+      self.hash ^= zobrist.ticketKey(i, self.tickets[i]) ^ zobrist.ticketKey(i, amount)
+      self.tickets[i] = amount
+
+   def hasTicket(self, pawn, ticket):
+      return self.tickets[pawn * NUM_TICKETS + ticket] != 0
+
+   def setTurn(self, turnNum):
+      self.hash ^= zobrist.turnKey(self.turnNum) ^ zobrist.turnKey(turnNum)
+      self.turnNum = turnNum
+
+   def setCurrent(self, pawn):
+      self.hash ^= zobrist.toMoveKey(self.current) ^ zobrist.toMoveKey(pawn)
+      self.current = pawn
+
+   # Spend one ticket.  Unlimited tickets (-1) are left alone.
+   def spendTicket(self, pawn, ticket):
+      i = pawn * NUM_TICKETS + ticket
+      amount = self.tickets[i]
+      if amount == 0:
+         raise GameStateError("tried to remove non-existant ticket " + ALL_TICKET_NAMES[ticket])
+      if amount != UNLIMITED:
+         self.hash ^= zobrist.ticketKey(i, amount) ^ zobrist.ticketKey(i, amount - 1)
+         self.tickets[i] = amount - 1
+
+   # Move a pawn one step with 'ticket', without any checks and without
+   # recording an undo entry or changing the turn.
+   def moveLeg(self, pawn, dest, ticket):
+      self.spendTicket(pawn, ticket)
+      self.setLocation(pawn, dest)
+
+
+   # Is moving 'pawn' along this route legal?  Checks map connectivity, the
+   # ticket supply (for double moves, after the first ticket is spent, and
+   # including a double-move ticket) and, for detectives, collisions with the
+   # other detectives.  Agrees with legalMoves().
+   def isLegalMove(self, pawn, dest1, ticket1, dest2=None, ticket2=None):
+      locations = self.locations
+      if pawn != X_INDEX:
+         for det in DETECTIVES:
+            if det != pawn and (locations[det] == dest1 or locations[det] == dest2):
+               return False
+      base = pawn * NUM_TICKETS
+      if ticket1 is None or not graph.hasRoute(locations[pawn], dest1, ticket1) \
+      or self.tickets[base + ticket1] == 0:
+         return False
+      if dest2 is not None:
+         if ticket2 is None or not graph.hasRoute(dest1, dest2, ticket2) \
+         or self.tickets[base + DOUBLE_CODE] == 0:
+            return False
+         amount = self.tickets[base + ticket2]
+         if ticket2 == ticket1 and amount != UNLIMITED:
+            amount -= 1
+         return amount != 0
+      return True
+
+   # Generate every legal move for 'pawn', as move tuples (see above), in one
+   # pass over the compiled map.  Single moves come first, ordered by
+   # destination as in graph.routes() and then by ticket code.  Double moves
+   # are included when 'doubles' is true and the pawn holds a double-move
+   # ticket.
+   def legalMoves(self, pawn, doubles=True):
+      locations = self.locations
+      tickets   = self.tickets
+      base      = pawn * NUM_TICKETS
+      routes    = graph.routes
+
+      usable = 0
+      for code in range(DOUBLE_CODE):
+         if tickets[base + code] != 0:
+            usable |= 1 << code
+      if pawn == X_INDEX:
+         blocked = ()
+      else:
+         blocked = [locations[det] for det in DETECTIVES if det != pawn]
+
+      moves = []
+      for dest, mask in routes(locations[pawn]):
+         if dest not in blocked:
+            for code in MASK_CODES[mask & usable]:
+               moves.append((pawn, dest, code))
+
+      if doubles and tickets[base + DOUBLE_CODE] != 0:
+         singles = moves[:]
+         for pawn, dest1, code1 in singles:
+            usable2 = usable
+            if tickets[base + code1] == 1:
+               usable2 &= ~(1 << code1)
+            for dest2, mask in routes(dest1):
+               if dest2 not in blocked:
+                  for code2 in MASK_CODES[mask & usable2]:
+                     moves.append((pawn, dest1, code1, dest2, code2))
+      return moves
+
+   # A detective is stuck if no ticket it holds leads anywhere that is not
+   # occupied by another detective.
+   def isDetectiveStuck(self, pawn):
+      locations = self.locations
+      occupied  = [locations[det] for det in DETECTIVES if det != pawn]
+      base      = pawn * NUM_TICKETS
+      for code in range(DOUBLE_CODE):
+         if self.tickets[base + code] != 0:
+            for dest in graph.neighbours(locations[pawn], code):
+               if dest not in occupied:
+                  return False
+      return True
+
+   def isXCaught(self):
+      x = self.locations[X_INDEX]
+      for det in DETECTIVES:
+         if self.locations[det] == x:
+            return True
+      return False
+
+
+   # Make a move (see above) and pass the turn on, remembering enough to
+   # undo() it.  A double move uses up a turn of its own, as in Game.  The
+   # move is not checked; validate it with isLegalMove() first.  This is the
+   # inner loop of any search, so the hash updates of moveLeg(), setTurn()
+   # and setCurrent() are made inline here.
+   def apply(self, move):
+      pawn      = move[0]
+      locations = self.locations
+      tickets   = self.tickets
+      base      = pawn * NUM_TICKETS
+      h         = self.hash
+      self._undo.append((pawn, locations[pawn], tickets[base:base + NUM_TICKETS],
+            self.turnNum, self.current, h))
+      turnNum = self.turnNum
+      dest    = move[1]
+      spent   = [base + move[2]]
+      if len(move) > 3 and move[3] is not None:
+         dest = move[3]
+         spent.append(base + move[4])
+         spent.append(base + DOUBLE_CODE)
+         turnNum += 1
+      for i in spent:
+         amount = tickets[i]
+         if amount == 0:
+            self.undo()
+            raise GameStateError("tried to remove non-existant ticket " +
+                  ALL_TICKET_NAMES[i - base])
+         if amount != UNLIMITED:
+            keys = _TICKET_KEYS[i]
+            h ^= keys[(amount + 1) % _AMOUNT_KEYS] ^ keys[amount % _AMOUNT_KEYS]
+            tickets[i] = amount - 1
+      # the keys of the intermediate location of a double move cancel out
+      locKeys = _LOCATION_KEYS[pawn]
+      h ^= locKeys[locations[pawn] % _NUM_LOCATIONS] ^ locKeys[dest % _NUM_LOCATIONS]
+      locations[pawn] = dest
+      nextPawn = (pawn + 1) % NUM_PAWNS
+      if nextPawn == X_INDEX:
+         turnNum += 1
+      h ^= _TURN_KEYS[self.turnNum % _NUM_TURN_KEYS] ^ _TURN_KEYS[turnNum % _NUM_TURN_KEYS]
+      h ^= _TO_MOVE_KEYS[self.current] ^ _TO_MOVE_KEYS[nextPawn]
+      self.turnNum = turnNum
+      self.current = nextPawn
+      self.hash    = h
+
+   # Take back the most recent apply().
+   def undo(self):
+      if not self._undo:
+         raise GameStateError("nothing to undo")
+      pawn, loc, tickets, turnNum, current, h = self._undo.pop()
+      base = pawn * NUM_TICKETS
+      self.locations[pawn] = loc
+      self.tickets[base:base + NUM_TICKETS] = tickets
+      self.turnNum = turnNum
+      self.current = current
+      self.hash    = h
+
+
+
@@ -0,0 +1,126 @@
+#  London Law -- a networked manhunting board game
+#  Copyright (C) 2003-2004, 2005 Paul Pelzl
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License, Version 2, as
+#  published by the Free Software Foundation.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# bitsets.py
+#
+# Location sets represented as integer bitmasks: bit n is set if location n
+# is in the set.  Set operations become integer operations (| for union,
+# & for intersection, & ~ for difference), and moving every pawn in a set one
+# step along a given transport is a handful of table lookups and ORs.
+#
+# For each ticket type, the neighbour masks are also grouped into 8-bit
+# chunks: chunk table [k][b] holds the union of the neighbour masks of the
+# locations 8*k + i for every bit i set in b.  expand() therefore costs one
+# lookup per byte of the mask, no matter how many locations it contains.
+
+from londonlaw.common import graph, map
+
+
+TICKETS       = (map.TAXI, map.BUS, map.UNDERGROUND, map.BLACK)
+NUM_LOCATIONS = len(map.locToRoutes)
+
+# every real location (location 0 does not exist)
+ALL_LOCATIONS = (1L << NUM_LOCATIONS) - 2
+
+_CHUNK_BITS   = 8
+_NUM_CHUNKS   = (NUM_LOCATIONS + _CHUNK_BITS - 1) // _CHUNK_BITS
+
+
+def _build_neighbour_masks():
+   masks = {}
+   for ticket in TICKETS:
+      code = graph.TICKET_CODES[ticket]
+      masks[ticket] = [0L] * NUM_LOCATIONS
+      for loc in range(1, NUM_LOCATIONS):
+         for dest in graph.graph.neighbours(loc, code):
+            masks[ticket][loc] |= 1L << dest
+   return masks
+
+
+def _build_chunk_tables(masks):
+   tables = {}
+   for ticket in TICKETS:
+      chunks = []
+      for k in range(_NUM_CHUNKS):
+         table = [0L] * (1 << _CHUNK_BITS)
+         for b in range(1, 1 << _CHUNK_BITS):
+            # split off the lowest set bit and reuse the entry for the rest
+            low = b & -b
+            loc = _CHUNK_BITS * k + low.bit_length() - 1
+            if loc < NUM_LOCATIONS:
+               table[b] = table[b ^ low] | masks[ticket][loc]
+            else:
+               table[b] = table[b ^ low]
+         chunks.append(table)
+      tables[ticket] = chunks
+   return tables
+
+
+_neighbours = _build_neighbour_masks()
+_chunks     = _build_chunk_tables(_neighbours)
+
+
+
+# Return the mask of locations reachable from 'loc' in one move with 'ticket'.
+def neighbour_mask(loc, ticket):
+   return _neighbours[ticket][loc]
+
+
+# Convert an iterable of location numbers to a mask.
+def from_locations(locations):
+   mask = 0L
+   for loc in locations:
+      mask |= 1L << loc
+   return mask
+
+
+# Convert a mask to a list of location numbers, in increasing order.
+def to_locations(mask):
+   locations = []
+   while mask:
+      low = mask & -mask
+      locations.append(low.bit_length() - 1)
+      mask ^= low
+   return locations
+
+
+# Number of locations in a mask.
+def count(mask):
+   return bin(mask).count("1")
+
+
+# Return the mask of locations reachable in one move from any location in
+# 'mask', using 'ticket'.
+def expand(mask, ticket):
+   chunks = _chunks[ticket]
+   result = 0L
+   k = 0
+   while mask:
+      result |= chunks[k][mask & 0xff]
+      mask >>= _CHUNK_BITS
+      k += 1
+   return result
+
+
+# Same as expand(), allowing any of the tickets in 'tickets'.
+def expand_any(mask, tickets):
+   result = 0L
+   for ticket in tickets:
+      result |= expand(mask, ticket)
+   return result
+
+
+
@@ -0,0 +1,105 @@
+#  London Law -- a networked manhunting board game
+#  Copyright (C) 2003-2004, 2005 Paul Pelzl
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License, Version 2, as
+#  published by the Free Software Foundation.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# codec.py
+#
+# Splitting protocol lines into tokens, and joining tokens into lines.
+#
+# split_tokens() follows the rules of shlex.split() (POSIX mode, no
+# comments), which the protocol handlers used to call: tokens are separated
+# by spaces, tabs, CRs and LFs; a backslash outside quotes escapes any
+# character; nothing is escaped within single quotes; within double quotes
+# a backslash escapes only a double quote or a backslash; quoted and
+# unquoted parts of a token run together.  Unlike shlex, it does it with a
+# precompiled regex rather than a character at a time, and a line with no
+# quotes or backslashes (most of them) is simply split.
+#
+# join_tokens() quotes and escapes tokens so that split_tokens() gives them
+# back.
+
+import re
+
+
+# characters that split_tokens() can not leave to str.split(), which
+# also splits on vertical tabs and form feeds
+_SPECIAL = re.compile(r"""["'\\\x0b\x0c]""").search
+
+# one part of a line: whitespace, unquoted characters, an escaped
+# character, a double quoted string, a single quoted string, or else the
+# start of an unclosed quote or a trailing backslash
+_PART = re.compile(r"""([ \t\r\n]+)|([^ \t\r\n"'\\]+)|\\([\s\S])|"((?:[^"\\]|\\[\s\S])*)"|'([^']*)'|([\s\S])""")
+
+_UNESCAPE = re.compile(r"""\\(["\\])""").sub
+
+# characters that make join_tokens() escape and/or quote a token
+_MUST_QUOTE = re.compile(r"""[\s"'\\]""").search
+_SPACE      = re.compile(r"\s").search
+_ESCAPE     = re.compile(r"""(["\\])""").sub
+
+
+
+# Split 'line' into a list of tokens.  Raises ValueError for an unclosed
+# quote or a trailing backslash, as shlex.split() does.
+def split_tokens(line):
+   if _SPECIAL(line) is None:
+      return line.split()
+   tokens = []
+   token  = None
+   for m in _PART.finditer(line):
+      kind = m.lastindex
+      if kind == 1:
+         if token is not None:
+            tokens.append(token)
+            token = None
+      elif kind == 4:
+         token = (token or "") + _UNESCAPE(r"\1", m.group(4))
+      elif kind != 6:
+         token = (token or "") + m.group(kind)
+      elif m.group(6) == "\\" or (m.group(6) == '"' and _oddBackslashes(line)):
+         raise ValueError("No escaped character")
+      else:
+         raise ValueError("No closing quotation")
+   if token is not None:
+      tokens.append(token)
+   return tokens
+
+
+# whether 'line' ends in an odd number of backslashes, the last escaping
+# nothing
+def _oddBackslashes(line):
+   return (len(line) - len(line.rstrip("\\"))) % 2 == 1
+
+
+# Join 'tokens' (converted with str()) into a line.  Tokens holding
+# whitespace or a single quote, and empty tokens, are double quoted;
+# backslashes and double quotes are escaped.
+def join_tokens(*tokens):
+   out = []
+   for token in tokens:
+      token = str(token)
+      if not token:
+         out.append('""')
+      elif _MUST_QUOTE(token) is None:
+         out.append(token)
+      else:
+         token = _ESCAPE(r"\\\1", token)
+         if _SPACE(token) is not None or "'" in token:
+            token = '"' + token + '"'
+         out.append(token)
+   return " ".join(out)
+
+
+
@@ -0,0 +1,84 @@
+#  London Law -- a networked manhunting board game
+#  Copyright (C) 2003-2004, 2005 Paul Pelzl
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License, Version 2, as
+#  published by the Free Software Foundation.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# dispatch.py
+#
+# The protocol classes handle a message VERB received in state STATE with a
+# method named PREFIX + VERB + "_" + STATE (e.g. cmd_move_playing or
+# response_ok_login), falling back on PREFIX + VERB + "_default".  Rather
+# than building those names and looking them up for every line, a
+# DispatchTable maps (state, verb) to the method once for each class, and
+# counts the messages handled for each verb.
+#
+#   f = dispatch.getTable(self.__class__, "cmd_").lookup(self._state, verb)
+#   if f is not None:
+#      f(self, tag, args)
+
+
+
+class DispatchTable:
+   def __init__(self, cls, prefix):
+      self._prefix   = prefix
+      # verb -> number of messages handled
+      self.counts    = {}
+      self._table    = {}
+      self._defaults = {}
+      for name in dir(cls):
+         if not name.startswith(prefix):
+            continue
+         parts = name[len(prefix):].split("_", 1)
+         if len(parts) != 2:
+            continue
+         verb, state = parts
+         if state == "default":
+            self._defaults[verb] = getattr(cls, name)
+         else:
+            self._table[(state, verb)] = getattr(cls, name)
+      for state in set([state for state, verb in self._table]):
+         for verb, f in self._defaults.iteritems():
+            self._table.setdefault((state, verb), f)
+
+   def getPrefix(self):
+      return self._prefix
+
+   # The (unbound) method handling 'verb' in 'state', or None.
+   def lookup(self, state, verb):
+      f = self._table.get((state, verb))
+      if f is None:
+         f = self._defaults.get(verb)
+         if f is None:
+            return None
+      self.counts[verb] = self.counts.get(verb, 0) + 1
+      return f
+
+   # (verb, count) pairs, busiest first
+   def getCounts(self):
+      counts = self.counts.items()
+      counts.sort(key=lambda item: (-item[1], item[0]))
+      return counts
+
+
+# The DispatchTable for the methods of 'cls' named with 'prefix', built on
+# first use.  Subclasses get tables of their own.
+def getTable(cls, prefix):
+   table = cls.__dict__.get("_dispatchTable")
+   if table is None or table.getPrefix() != prefix:
+      table = DispatchTable(cls, prefix)
+      cls._dispatchTable = table
+   return table
+
+
+
@@ -0,0 +1,237 @@
+#  London Law -- a networked manhunting board game
+#  Copyright (C) 2003-2004, 2005 Paul Pelzl
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License, Version 2, as
+#  published by the Free Software Foundation.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# distances.py
+#
+# Precomputed all-pairs distance tables for the London map.
+#
+# One table is kept for each set of transports a pawn may be limited to:
+# taxi only, taxi and bus, everything except black tickets, and everything.
+# Each table is a len(locToRoutes) x len(locToRoutes) matrix of unsigned bytes,
+# where entry [source][dest] is the number of moves on the shortest path from
+# source to dest, or UNREACHABLE if there is no such path.
+#
+# The tables are built with a breadth-first search the first time they are
+# needed and cached on disk, so later processes can simply memory-map the
+# cache file.  The cache header carries a checksum of the map, so a stale
+# cache is rebuilt automatically.
+
+from londonlaw.common import map
+import mmap, operator, os, struct, zlib
+
+
+TAXI_ONLY    = (map.TAXI,)
+TAXI_BUS     = (map.TAXI, map.BUS)
+NO_BLACK     = (map.TAXI, map.BUS, map.UNDERGROUND)
+ALL_TICKETS  = (map.TAXI, map.BUS, map.UNDERGROUND, map.BLACK)
+
+# table order within the cache file
+TICKET_SETS  = (TAXI_ONLY, TAXI_BUS, NO_BLACK, ALL_TICKETS)
+
+UNREACHABLE  = 255
+
+SIZE         = len(map.locToRoutes)
+
+# maximum distance for this map using any non-black transport, as detectives
+# do (checked against the tables by tests/test_distances.py)
+MAX_DISTANCE = 10
+DEFAULT_CACHE_FILE = os.path.expanduser(os.path.join("~", ".londonlaw", "distances.cache"))
+
+_MAGIC       = "LLAWDIST"
+_HEADER      = struct.Struct("!8sIHH")
+
+
+
+# A checksum of the map, stored in the cache header so that edits to
+# map.locToRoutes invalidate the cache.
+def map_checksum():
+   return zlib.crc32(repr(map.locToRoutes)) & 0xffffffff
+
+
+# Breadth-first distances from 'source' to every location, using only the
+# transports in 'allowed'.  Returns a list of length SIZE.
+def _bfs(source, allowed):
+   dist = [UNREACHABLE] * SIZE
+   dist[source] = 0
+   frontier = [source]
+   d = 0
+   while frontier:
+      d += 1
+      next_frontier = []
+      for u in frontier:
+         for v, transports in map.locToRoutes[u]:
+            if dist[v] == UNREACHABLE:
+               for transport in transports:
+                  if transport in allowed:
+                     dist[v] = d
+                     next_frontier.append(v)
+                     break
+      frontier = next_frontier
+   return dist
+
+
+# Build the raw table data for every entry in TICKET_SETS, as one string of
+# len(TICKET_SETS) * SIZE * SIZE bytes.
+def build_tables():
+   rows = []
+   for allowed in TICKET_SETS:
+      # location 0 does not exist; nothing can reach it or leave it
+      rows.append(chr(UNREACHABLE) * SIZE)
+      for source in range(1, SIZE):
+         rows.append("".join([chr(d) for d in _bfs(source, allowed)]))
+   return "".join(rows)
+
+
+# Write freshly built tables to 'filename'.  The file is written under a
+# temporary name and then renamed, so readers never see a partial cache.
+def save_tables(filename, data):
+   directory = os.path.dirname(filename)
+   if directory and not os.path.isdir(directory):
+      os.makedirs(directory)
+   tmpname = "%s.%d" % (filename, os.getpid())
+   f = open(tmpname, "wb")
+   try:
+      f.write(_HEADER.pack(_MAGIC, map_checksum(), SIZE, len(TICKET_SETS)))
+      f.write(data)
+   finally:
+      f.close()
+   if os.name != "posix" and os.path.exists(filename):
+      os.remove(filename)
+   os.rename(tmpname, filename)
+
+
+# Memory-map the tables in 'filename'.  Returns None if the file is missing,
+# unreadable, or was built from a different map.
+def load_tables(filename):
+   try:
+      f = open(filename, "rb")
+   except IOError:
+      return None
+   try:
+      header = f.read(_HEADER.size)
+      if len(header) != _HEADER.size:
+         return None
+      magic, checksum, size, count = _HEADER.unpack(header)
+      if (magic != _MAGIC or checksum != map_checksum() or size != SIZE
+            or count != len(TICKET_SETS)):
+         return None
+      if os.fstat(f.fileno()).st_size != _HEADER.size + count * size * size:
+         return None
+      try:
+         return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+      except (EnvironmentError, ValueError):
+         return None
+   finally:
+      # the mapping stays valid after the file object is closed
+      f.close()
+
+
+
+class DistanceTables(object):
+   def __init__(self, data, offset=0):
+      self._data   = data
+      self._base   = {}
+      for i in range(len(TICKET_SETS)):
+         self._base[TICKET_SETS[i]] = offset + i * SIZE * SIZE
+
+   # Return the distance from source to dest using only the transports in
+   # 'ticket_set' (one of TICKET_SETS), or None if dest cannot be reached.
+   def distance(self, source, dest, ticket_set=ALL_TICKETS):
+      d = ord(self._data[self._base[ticket_set] + source * SIZE + dest])
+      if d == UNREACHABLE:
+         return None
+      return d
+
+   # Return a list of distances from source to every location, in the same
+   # form as path.distance(source, None).
+   def row(self, source, ticket_set=ALL_TICKETS):
+      start = self._base[ticket_set] + source * SIZE
+      row = []
+      for c in self._data[start:start + SIZE]:
+         d = ord(c)
+         if d == UNREACHABLE:
+            row.append(None)
+         else:
+            row.append(d)
+      return row
+
+   # Return the distance from source to the nearest of 'targets' (a
+   # non-empty sequence), or None if none of them can be reached.  The bytes
+   # of a row compare in the same order as the distances they hold.
+   def nearest(self, source, targets, ticket_set=ALL_TICKETS):
+      start = self._base[ticket_set] + source * SIZE
+      d = ord(min(operator.itemgetter(*targets)(self._data[start:start + SIZE])))
+      if d == UNREACHABLE:
+         return None
+      return d
+
+   # Return the largest finite distance in the table for 'ticket_set'.
+   def max_distance(self, ticket_set=ALL_TICKETS):
+      start = self._base[ticket_set]
+      table = self._data[start:start + SIZE * SIZE]
+      return max([ord(c) for c in table if ord(c) != UNREACHABLE])
+
+
+
+# Map a path-style ticket dict onto one of TICKET_SETS.  Returns a tuple
+# (ticket_set, limit), where 'limit' is the smallest finite ticket amount
+# among the usable transports (or None if all are unlimited).  A table
+# distance d is exact for these tickets whenever limit is None or d <= limit,
+# because no ticket type can run out before the pawn arrives.  Returns
+# (None, None) if no table matches.
+def classify_tickets(tickets):
+   usable = []
+   limit  = None
+   for ticket in ALL_TICKETS:
+      if ticket not in tickets:
+         return (None, None)
+      amount = tickets[ticket]
+      if amount != 0:
+         usable.append(ticket)
+         if amount > 0 and (limit is None or amount < limit):
+            limit = amount
+   if map.BLACK in usable:
+      # black tickets are valid on every route
+      return (ALL_TICKETS, limit)
+   usable = tuple(usable)
+   if usable in TICKET_SETS:
+      return (usable, limit)
+   return (None, None)
+
+
+
+_tables = None
+
+# Get the shared distance tables, loading them from the cache file or
+# building (and caching) them as necessary.  If the cache cannot be written,
+# the tables are simply kept in memory.
+def get_tables(filename=DEFAULT_CACHE_FILE):
+   global _tables
+
+   if _tables == None:
+      data = load_tables(filename)
+      if data != None:
+         _tables = DistanceTables(data, _HEADER.size)
+      else:
+         data = build_tables()
+         try:
+            save_tables(filename, data)
+         except EnvironmentError:
+            pass
+         _tables = DistanceTables(data)
+   return _tables
+
+
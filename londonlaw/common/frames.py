@@ -0,0 +1,212 @@
+#  London Law -- a networked manhunting board game
+#  Copyright (C) 2003-2004, 2005 Paul Pelzl
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License, Version 2, as
+#  published by the Free Software Foundation.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# frames.py
+#
+# The framing of protocol version 3 (see readme.protocol).  Once version 3
+# has been agreed on, both sides send frames rather than lines:
+#
+#   length (2 bytes) | opcode (1 byte) | payload (length - 1 bytes)
+#
+# with big-endian integers.  Opcode OP_TEXT carries an ordinary protocol
+# line; the others carry the untagged messages sent most often, with their
+# fields packed: pawns and tickets as small ints (their indexes in
+# PAWN_NAMES and TICKET_NAMES), locations, turn numbers and ticket amounts
+# as 16-bit ints.
+#
+# encodeTokens() turns the tokens of a message into a frame, packing it if
+# it can; decode() turns a frame back into the tokens the message would
+# have had as a line, so the protocol handlers need not care how it came.
+
+import struct
+from londonlaw.common import codec
+from londonlaw.common.GameState import PAWN_NAMES
+from londonlaw.common.graph import TICKET_NAMES
+
+
+class FrameError(ValueError):
+   pass
+
+
+OP_TEXT       = 0
+OP_MOVE       = 1
+OP_DOUBLEMOVE = 2
+OP_TURN       = 3
+OP_TURNNUM    = 4
+OP_PAWNINFO   = 5
+OP_HISTORY    = 6
+OP_HISTORYEND = 7
+
+MAX_PAYLOAD   = 0xffff - 1
+
+_LENGTH       = struct.Struct("!H")
+_MOVE         = struct.Struct("!BhB")
+_DOUBLEMOVE   = struct.Struct("!BhBhB")
+_TURN         = struct.Struct("!B")
+_TURNNUM      = struct.Struct("!H")
+# pawn, location, taxi, bus, underground, black and double tickets; the
+# player name follows
+_PAWNINFO     = struct.Struct("!Bhhhhhh")
+# turn number, number of moves; the moves follow
+_HISTORY      = struct.Struct("!BB")
+# pawn, location, ticket (NO_TICKET for the starting locations)
+_HISTORYMOVE  = struct.Struct("!BhB")
+NO_TICKET     = 0xff
+
+_PAWN_CODES   = dict([(name, i) for i, name in enumerate(PAWN_NAMES)])
+_TICKET_CODES = dict([(name, i) for i, name in enumerate(TICKET_NAMES)])
+
+
+
+def frame(opcode, payload):
+   if len(payload) > MAX_PAYLOAD:
+      raise FrameError("frame too long")
+   return _LENGTH.pack(len(payload) + 1) + chr(opcode) + payload
+
+def encodeText(line):
+   return frame(OP_TEXT, line)
+
+
+def _encodeMove(args):
+   pawn, loc, ticket = args
+   return frame(OP_MOVE, _MOVE.pack(_PAWN_CODES[pawn], int(loc), _TICKET_CODES[ticket]))
+
+def _encodeDoubleMove(args):
+   pawn, loc1, ticket1, loc2, ticket2 = args
+   return frame(OP_DOUBLEMOVE, _DOUBLEMOVE.pack(_PAWN_CODES[pawn],
+         int(loc1), _TICKET_CODES[ticket1], int(loc2), _TICKET_CODES[ticket2]))
+
+def _encodeTurn(args):
+   pawn, = args
+   return frame(OP_TURN, _TURN.pack(_PAWN_CODES[pawn]))
+
+def _encodeTurnNum(args):
+   num, = args
+   return frame(OP_TURNNUM, _TURNNUM.pack(int(num)))
+
+def _encodePawnInfo(args):
+   pawn, player, loc, taxi, bus, underground, black, double = args
+   return frame(OP_PAWNINFO, _PAWNINFO.pack(_PAWN_CODES[pawn], int(loc), int(taxi),
+         int(bus), int(underground), int(black), int(double)) + str(player))
+
+def _encodeHistory(args):
+   if args == ["end"]:
+      return frame(OP_HISTORYEND, "")
+   payload = [_HISTORY.pack(int(args[0]), len(args) - 1)]
+   for move in args[1:]:
+      fields = move.split()
+      if len(fields) == 2:
+         ticket = NO_TICKET
+      else:
+         ticket = _TICKET_CODES[fields[2]]
+      payload.append(_HISTORYMOVE.pack(_PAWN_CODES[fields[0]], int(fields[1]), ticket))
+   return frame(OP_HISTORY, "".join(payload))
+
+_ENCODERS = {
+   "move"       : _encodeMove,
+   "doublemove" : _encodeDoubleMove,
+   "turn"       : _encodeTurn,
+   "turnnum"    : _encodeTurnNum,
+   "pawninfo"   : _encodePawnInfo,
+   "history"    : _encodeHistory}
+
+
+# The frame for the message with 'tokens' (str, as for codec.join_tokens()).
+# Untagged messages with an opcode of their own are packed, unless their
+# fields don't fit; everything else is sent as text.
+def encodeTokens(tokens):
+   if len(tokens) > 1 and tokens[0] == "*":
+      encoder = _ENCODERS.get(tokens[1])
+      if encoder is not None:
+         try:
+            return encoder(list(tokens[2:]))
+         except (KeyError, ValueError, IndexError, struct.error):
+            pass
+   return encodeText(codec.join_tokens(*tokens))
+
+
+# The tokens of the message in a frame.  Raises FrameError if the frame
+# can not be decoded (and ValueError for badly quoted text).
+def decode(opcode, payload):
+   try:
+      if opcode == OP_TEXT:
+         return codec.split_tokens(payload)
+      elif opcode == OP_MOVE:
+         pawn, loc, ticket = _MOVE.unpack(payload)
+         return ["*", "move", PAWN_NAMES[pawn], str(loc), TICKET_NAMES[ticket]]
+      elif opcode == OP_DOUBLEMOVE:
+         pawn, loc1, ticket1, loc2, ticket2 = _DOUBLEMOVE.unpack(payload)
+         return ["*", "doublemove", PAWN_NAMES[pawn], str(loc1), TICKET_NAMES[ticket1],
+               str(loc2), TICKET_NAMES[ticket2]]
+      elif opcode == OP_TURN:
+         pawn, = _TURN.unpack(payload)
+         return ["*", "turn", PAWN_NAMES[pawn]]
+      elif opcode == OP_TURNNUM:
+         num, = _TURNNUM.unpack(payload)
+         return ["*", "turnnum", str(num)]
+      elif opcode == OP_PAWNINFO:
+         fields = _PAWNINFO.unpack_from(payload)
+         return ["*", "pawninfo", PAWN_NAMES[fields[0]], payload[_PAWNINFO.size:]] + \
+               [str(field) for field in fields[1:]]
+      elif opcode == OP_HISTORY:
+         turn, count = _HISTORY.unpack_from(payload)
+         if len(payload) != _HISTORY.size + count * _HISTORYMOVE.size:
+            raise FrameError("bad history frame")
+         tokens = ["*", "history", str(turn)]
+         for i in range(count):
+            pawn, loc, ticket = _HISTORYMOVE.unpack_from(payload,
+                  _HISTORY.size + i * _HISTORYMOVE.size)
+            if ticket == NO_TICKET:
+               tokens.append("%s %d" % (PAWN_NAMES[pawn], loc))
+            else:
+               tokens.append("%s %d %s" % (PAWN_NAMES[pawn], loc, TICKET_NAMES[ticket]))
+         return tokens
+      elif opcode == OP_HISTORYEND:
+         return ["*", "history", "end"]
+   except (IndexError, struct.error):
+      raise FrameError("bad frame (opcode %d)" % opcode)
+   raise FrameError("unknown opcode %d" % opcode)
+
+
+
+# Collects the data received into frames.  A frame whose payload is longer
+# than 'maxPayload' is an error, raised as soon as its length is read.
+class FrameReader:
+   def __init__(self, maxPayload=MAX_PAYLOAD):
+      self._buffer     = ""
+      self._maxPayload = maxPayload
+
+   # Add 'data', and return the (opcode, payload) of every frame completed.
+   def feed(self, data):
+      buf    = self._buffer + data
+      frames = []
+      pos    = 0
+      while len(buf) - pos >= _LENGTH.size:
+         length, = _LENGTH.unpack_from(buf, pos)
+         if length == 0:
+            raise FrameError("empty frame")
+         if length - 1 > self._maxPayload:
+            raise FrameError("frame too long")
+         end = pos + _LENGTH.size + length
+         if end > len(buf):
+            break
+         frames.append((ord(buf[pos + _LENGTH.size]), buf[pos + _LENGTH.size + 1:end]))
+         pos = end
+      self._buffer = buf[pos:]
+      return frames
+
+
+
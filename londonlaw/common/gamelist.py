@@ -0,0 +1,92 @@
+#  London Law -- a networked manhunting board game
+#  Copyright (C) 2003-2004, 2005 Paul Pelzl
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License, Version 2, as
+#  published by the Free Software Foundation.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# gamelist.py
+#
+# A client's copy of the server's game list, kept up to date with versioned
+# "listgames" requests (see readme.protocol): the client sends the version
+# it was last given, and the server sends only the games that changed since
+# then.  A GameList outlives the connection, so a client that reconnects to
+# the same server only has to fetch what changed while it was away.
+#
+#   gameList.startListing()
+#   sendTokens(tag, *gameList.listTokens())
+#   ... gameList.gameInfo(data) for each "gameinfo" reply,
+#       gameList.gameRemoved(name) for each "gameremoved" reply
+#   removed = gameList.endListing(okData)
+
+
+
+class GameList:
+   def __init__(self):
+      self._version = None
+      # game name -> gameinfo data [name, status, type, numPlayers]
+      self._games   = {}
+      self._listed  = None
+
+   def getVersion(self):
+      return self._version
+
+   # gameinfo data for every known game
+   def getGames(self):
+      return self._games.values()
+
+   def getStatus(self, name):
+      try:
+         return self._games[name][1]
+      except KeyError:
+         return None
+
+   def hasGame(self, name):
+      return name in self._games
+
+   # the command (and arguments) to send to request the list
+   def listTokens(self):
+      return ("listgames", self._version or "0")
+
+   def startListing(self):
+      self._listed = set()
+
+   # 'data' is the gameinfo data, with the game name decoded as the
+   # client prefers
+   def gameInfo(self, data):
+      self._games[data[0]] = list(data)
+      if self._listed is not None:
+         self._listed.add(data[0])
+
+   def gameRemoved(self, name):
+      self._games.pop(name, None)
+
+   # Finish a listing, given the data of the server's "ok" reply.  Returns
+   # the names of the games that turned out to be gone: if the server sent
+   # the full list (or is too old to know about versions), every game that
+   # it did not mention.
+   def endListing(self, data):
+      listed, self._listed = self._listed, None
+      if len(data) >= 2 and data[1] == "delta":
+         self._version = data[0]
+         return []
+      if len(data) >= 2:
+         self._version = data[0]
+      else:
+         self._version = None
+      removed = [name for name in self._games if listed is None or name not in listed]
+      for name in removed:
+         del self._games[name]
+      return removed
+
+
+
@@ -0,0 +1,130 @@
+#  London Law -- a networked manhunting board game
+#  Copyright (C) 2003-2004, 2005 Paul Pelzl
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License, Version 2, as
+#  published by the Free Software Foundation.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# graph.py
+#
+# A compiled form of map.locToRoutes, built once at import time.
+#
+# Tickets are identified by small integer codes (TAXI_CODE, etc.) instead of
+# strings, and a set of tickets is an integer with bit (1 << code) set for
+# each member.  For every ticket type, the neighbours of all locations are
+# stored in compressed-sparse-row form: the neighbours of 'loc' using
+# ticket 'c' are targets[c][offsets[c][loc]:offsets[c][loc + 1]].
+#
+# The accessors return tuples that are built once from those arrays, so
+# walking the map does not allocate anything:
+#
+#   for dest in graph.neighbours(loc, BUS_CODE):
+#      ...
+#   for dest, tickets in graph.routes(loc):
+#      if tickets & usable:
+#         ...
+
+from londonlaw.common import map
+import array
+
+
+TAXI_CODE        = 0
+BUS_CODE         = 1
+UNDERGROUND_CODE = 2
+BLACK_CODE       = 3
+
+TICKET_NAMES = (map.TAXI, map.BUS, map.UNDERGROUND, map.BLACK)
+TICKET_CODES = {map.TAXI : TAXI_CODE, map.BUS : BUS_CODE,
+                map.UNDERGROUND : UNDERGROUND_CODE, map.BLACK : BLACK_CODE}
+ALL_CODES    = (TAXI_CODE, BUS_CODE, UNDERGROUND_CODE, BLACK_CODE)
+
+# MASK_CODES[mask] / MASK_NAMES[mask] are the ticket codes / names in a ticket
+# bitmask, in code order
+MASK_CODES   = tuple([tuple([code for code in ALL_CODES if mask & (1 << code)])
+                      for mask in range(1 << len(ALL_CODES))])
+MASK_NAMES   = tuple([tuple([TICKET_NAMES[code] for code in codes]) for codes in MASK_CODES])
+
+
+# Convert a sequence of ticket names to a ticket bitmask.
+def ticket_mask(names):
+   mask = 0
+   for name in names:
+      mask |= 1 << TICKET_CODES[name]
+   return mask
+
+
+
+class CompiledMap(object):
+   def __init__(self, locToRoutes):
+      self._numLocations = len(locToRoutes)
+      n = self._numLocations
+
+      self.offsets = []
+      self.targets = []
+      self._neighbours = []
+      for code in ALL_CODES:
+         name    = TICKET_NAMES[code]
+         offsets = array.array("H", [0])
+         targets = array.array("H")
+         for loc in range(n):
+            if locToRoutes[loc] is not None:
+               for dest, transports in locToRoutes[loc]:
+                  if name in transports:
+                     targets.append(dest)
+            offsets.append(len(targets))
+         self.offsets.append(offsets)
+         self.targets.append(targets)
+         self._neighbours.append(tuple([tuple(targets[offsets[loc]:offsets[loc + 1]])
+               for loc in range(n)]))
+      self._neighbours = tuple(self._neighbours)
+
+      routes   = [()]
+      edgeMask = array.array("B", [0] * (n * n))
+      for loc in range(1, n):
+         r = []
+         for dest, transports in locToRoutes[loc]:
+            mask = ticket_mask(transports)
+            r.append((dest, mask))
+            edgeMask[loc * n + dest] = mask
+         routes.append(tuple(r))
+      self._routes   = tuple(routes)
+      self._edgeMask = edgeMask
+
+   def getNumLocations(self):
+      return self._numLocations
+
+   # the locations reachable from 'loc' with the ticket 'code'
+   def neighbours(self, loc, code):
+      return self._neighbours[code][loc]
+
+   # (dest, ticket bitmask) for every route leaving 'loc'
+   def routes(self, loc):
+      return self._routes[loc]
+
+   # ticket bitmask for the route from 'loc' to 'dest' (0 if there is none,
+   # or if either location is not on the map)
+   def routeTickets(self, loc, dest):
+      n = self._numLocations
+      if 0 < loc < n and 0 < dest < n:
+         return self._edgeMask[loc * n + dest]
+      return 0
+
+   def hasRoute(self, loc, dest, code):
+      n = self._numLocations
+      if 0 < loc < n and 0 < dest < n:
+         return (self._edgeMask[loc * n + dest] >> code) & 1 == 1
+      return False
+
+
+graph = CompiledMap(map.locToRoutes)
+
+
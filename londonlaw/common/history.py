@@ -0,0 +1,91 @@
+#  London Law -- a networked manhunting board game
+#  Copyright (C) 2003-2004, 2005 Paul Pelzl
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License, Version 2, as
+#  published by the Free Software Foundation.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# history.py
+#
+# A client's copy of the history of the game it is playing, kept up to date
+# from "history" replies and from the "turnnum" and "move" messages of the
+# game in progress.  A GameHistory outlives the connection, so a client that
+# rejoins the game after losing its connection can tell the server how far
+# it got (see "join" and "history" in readme.protocol) and be sent only the
+# moves that it missed.
+#
+#   gameHistory.reset(gameName)
+#   sendTokens(tag, "join", gameName, *gameHistory.positionTokens(gameName))
+#   ... gameHistory.since(turn, move) for a "history since" reply,
+#       gameHistory.addMoves(turn, moves) for the other "history" replies,
+#       gameHistory.setTurnNum(num) and gameHistory.addMove(move) as the
+#       game goes on
+
+
+
+class GameHistory:
+   def __init__(self):
+      self._game  = None
+      # turn -> list of move strings ("PAWN LOCATION [TICKET]"), as in
+      # the history replies
+      self._turns = []
+
+   def getGame(self):
+      return self._game
+
+   # Forget the history, and start on the one of game 'name'.
+   def reset(self, name=None):
+      self._game  = name
+      self._turns = []
+
+   # The turn and the number of moves in that turn seen so far, or None.
+   def getPosition(self):
+      if self._turns == []:
+         return None
+      return (len(self._turns) - 1, len(self._turns[-1]))
+
+   # the arguments telling the server how far the history of game 'name'
+   # is known, if it is
+   def positionTokens(self, name):
+      position = self.getPosition()
+      if name != self._game or position is None:
+         return ()
+      return (repr(position[0]), repr(position[1]))
+
+   def _extendTo(self, turn):
+      while len(self._turns) <= turn:
+         self._turns.append([])
+
+   # The server is resending the history from move 'move' of 'turn' on;
+   # drop whatever follows that.
+   def since(self, turn, move):
+      self._extendTo(turn)
+      del self._turns[turn + 1:]
+      del self._turns[turn][move:]
+
+   def addMoves(self, turn, moves):
+      self._extendTo(turn)
+      self._turns[turn].extend(moves)
+
+   def setTurnNum(self, num):
+      self._extendTo(num)
+
+   def addMove(self, move):
+      self._extendTo(0)
+      self._turns[-1].append(move)
+
+   # the moves of every turn with any, each split into fields
+   def getTurns(self):
+      return [[move.split() for move in moves] for moves in self._turns if moves != []]
+
+
+
@@ -321,9 +321,6 @@ _locToRoutesPartial = \
       )
 
 
-# precomputed maximum distance for this map
-MAX_DISTANCE = 10
-
 locToRoutes = (None,)
 for i in range(1, len(_locToRoutesPartial)):
    routes = ()
@@ -24,8 +24,8 @@
 # quickly as possible without regard for the tickets spent.  The rest of the
 # time, cheapest_path is probably a better choice.
 
-from londonlaw.common import map
-import sets
+from londonlaw.common import bitsets, distances, graph, map
+import heapq, sets
 
 
 
@@ -102,37 +102,43 @@ def _compute_path(source, dest, previous):
 # The path(s) are provided as a list of (destination, transportation) tuples.  When
 # no path can be found for a given destination, provides the value None.
 #
-# Note: since the graph is sparse, this could be done in a more efficient
-#       manner... but it seems plenty fast for N=200.
+# Vertices are extracted from a binary heap keyed on (path cost, vertex), so
+# ties are broken toward the lowest-numbered vertex just as a linear scan over
+# the unvisited set would.  Stale heap entries are skipped when popped.  When
+# dest is given, the search stops as soon as dest is extracted, since its path
+# cannot improve after that point.
 def cheapest_path(source, dest=None, tickets=unlimited_tickets, cost=equal_cost):
-   # U is unvisited vertices
-   U = sets.Set()
-   for u in range(1, len(map.locToRoutes)):
-      U.add(u)
    path_cost         = [1e100] * len(map.locToRoutes)
    path_cost[source] = 0
    previous          = [None] * len(map.locToRoutes)
    t                 = [None] * len(map.locToRoutes)
    t[source]         = tickets.copy()
+   visited           = [False] * len(map.locToRoutes)
+   heap              = [(0, source)]
+   neighbours        = graph.graph.neighbours
    
-   while len(U) > 0:
+   while heap:
       # extract vertex with minimum path
-      min_cost = 1e200
-      for u in U:
-         if path_cost[u] < min_cost:
-            min_cost = path_cost[u]
-            min_u    = u
-      U.remove(min_u)
-      if t[min_u] != None:
-         for (v, transports) in map.locToRoutes[min_u]:
-            for transport in transports:
-               if (path_cost[v] > path_cost[min_u] + cost(t[min_u], transport) and 
-               t[min_u][transport] != 0):
-                  t[v] = t[min_u].copy()
+      min_cost, min_u = heapq.heappop(heap)
+      if visited[min_u]:
+         continue
+      visited[min_u] = True
+      if min_u == dest:
+         break
+      t_u = t[min_u]
+      for code in graph.ALL_CODES:
+         transport = graph.TICKET_NAMES[code]
+         if t_u[transport] != 0:
+            step_cost = cost(t_u, transport)
+            for v in neighbours(min_u, code):
+               new_cost = min_cost + step_cost
+               if path_cost[v] > new_cost:
+                  t[v] = t_u.copy()
                   if t[v][transport] > 0:
                      t[v][transport] -= 1
-                  path_cost[v] = path_cost[min_u] + cost(t[min_u], transport)
-                  previous[v] = (min_u, transport)
+                  path_cost[v] = new_cost
+                  previous[v]  = (min_u, transport)
+                  heapq.heappush(heap, (new_cost, v))
 
    if dest == None:
       return ([None] + 
@@ -173,31 +179,43 @@ def shortest_path(source, dest=None, tickets=unlimited_tickets, cost=equal_cost)
    previous  = [ None ] * len(map.locToRoutes)
    t         = [ None ] * len(map.locToRoutes)
    t[source] = tickets.copy()
+   # usable[v] is the bitmask of ticket types with a nonzero amount in t[v]
+   usable    = [ 0 ] * len(map.locToRoutes)
+   for code in graph.ALL_CODES:
+      if tickets[graph.TICKET_NAMES[code]] != 0:
+         usable[source] |= 1 << code
+
+   routes     = graph.graph.routes
+   mask_names = graph.MASK_NAMES
 
    search_vertices = V.copy()
    while (dest == None or dest in U) and len(search_vertices) > 0:
       next_search_vertices = sets.Set()
       for visited in search_vertices:
-         for d, transports in map.locToRoutes[visited]:
+         if previous[visited] == None:
+            old_cost = 0
+         else:
+            old_cost = previous[visited][2]
+         # (routes are walked in map order, since that decides which of two
+         # equally good paths is kept)
+         for d, route_tickets in routes(visited):
             if d not in V:
-               for transport in transports:
-                  if t[visited][transport] != 0:
-                     if previous[visited] == None:
-                        old_cost = 0
-                     else:
-                        old_cost = previous[visited][2]
-                     # If this destination is in next_search_vertices, then we
-                     # are considering the case of choosing between two paths
-                     # of the same length.  In that situation we must use the
-                     # cost function to decide whether to replace the existing path.
-                     if (d not in next_search_vertices or cost(t[visited], transport) + 
-                     old_cost < previous[d][2]):
-                        t[d] = t[visited].copy()
-                        if t[d][transport] > 0:
-                           t[d][transport] -= 1
-                        previous[d] = (visited, transport, 
-                              cost(t[visited], transport) + old_cost)
-                        next_search_vertices.add(d)
+               for transport in mask_names[route_tickets & usable[visited]]:
+                  # If this destination is in next_search_vertices, then we
+                  # are considering the case of choosing between two paths
+                  # of the same length.  In that situation we must use the
+                  # cost function to decide whether to replace the existing path.
+                  if (d not in next_search_vertices or cost(t[visited], transport) + 
+                  old_cost < previous[d][2]):
+                     t[d] = t[visited].copy()
+                     usable[d] = usable[visited]
+                     if t[d][transport] > 0:
+                        t[d][transport] -= 1
+                        if t[d][transport] == 0:
+                           usable[d] &= ~(1 << graph.TICKET_CODES[transport])
+                     previous[d] = (visited, transport, 
+                           cost(t[visited], transport) + old_cost)
+                     next_search_vertices.add(d)
       V.union_update(next_search_vertices)
       U.difference_update(next_search_vertices)
       search_vertices = next_search_vertices
@@ -216,8 +234,25 @@ def shortest_path(source, dest=None, tickets=unlimited_tickets, cost=equal_cost)
 # If dest=None, returns an array of distances, one for each destination.
 # The distance value 'None' is provided when no path can be found which
 # satisfies the constraint.
+#
+# With the default pathfinder, the answer is read from the precomputed tables
+# in the 'distances' module whenever the ticket supply cannot run out along the
+# way (e.g. unlimited tickets); otherwise it falls back to a search.
 def distance(source, dest=None, pathfinder=shortest_path, 
       cost=equal_cost, tickets=unlimited_tickets):
+   if pathfinder == shortest_path:
+      ticket_set, limit = distances.classify_tickets(tickets)
+      if ticket_set != None:
+         tables = distances.get_tables()
+         if dest == None:
+            row = tables.row(source, ticket_set)
+            if limit == None or max(row) <= limit:
+               return row
+         else:
+            d = tables.distance(source, dest, ticket_set)
+            if limit == None or d <= limit:
+               return d
+
    def compute_distance(p):
       if p == None:
          return None
@@ -233,8 +268,7 @@ def distance(source, dest=None, pathfinder=shortest_path,
 
 
 # Given a starting location, number of turns, and optional ticket supply,
-# compute the possible locations where a pawn could move.  (This will be slow
-# for 'turns' bigger than about 4.)  Returns a Set.
+# compute the possible locations where a pawn could move.  Returns a Set.
 #
 # The optional 'eliminate' argument is a list of length 'turns'.  Each element
 # of the list is a Set of locations where the pawn cannot move on that turn.
@@ -248,67 +282,81 @@ def distance(source, dest=None, pathfinder=shortest_path,
 # possible destinations).
 def possible_destinations(source, turns, tickets=unlimited_tickets, eliminate=None,
       force_move=True):
-   if eliminate == None:
-      eliminate = [sets.Set()] * turns
+   return sets.Set(bitsets.to_locations(
+      possible_destinations_mask(source, turns, tickets, eliminate, force_move)))
 
-   # have to convert 'tickets' to a tuple, because otherwise we can't
-   # store it in a Set ("dict objects are unhashable")
-   tickets_assoc = ()
-   for key in tickets:
-      tickets_assoc = tickets_assoc + ((key, tickets[key]),)
 
-   loc_sets  = [sets.Set([(source, tickets_assoc)])]
+# Same as possible_destinations(), but returns the locations as a bitmask
+# (see the 'bitsets' module).
+#
+# Locations are grouped by the ticket supply left after reaching them, and each
+# group is a single bitmask, so one turn of lookahead costs a few table lookups
+# per group.  With unlimited tickets there is only ever one group, and even a
+# detective's finite supply yields few groups, so looking 8 or more turns ahead
+# is practical.
+def possible_destinations_mask(source, turns, tickets=unlimited_tickets, eliminate=None,
+      force_move=True):
+   transports = bitsets.TICKETS
+   states = {tuple([tickets.get(ticket, 0) for ticket in transports]) : 1L << source}
    for turn in range(turns):
-      loc_sets.append(sets.Set())
-      for loc, t in loc_sets[turn]:
-         is_stuck = 1
-         for dest, transports in map.locToRoutes[loc]:
-            if dest not in eliminate[turn]:
-               for transport in transports:
-                  for i in range(len(t)):
-                     ticket, amount = t[i]
-                     if transport == ticket:
-                        if amount != 0:
-                           is_stuck = 0
-                           if amount > 0:
-                              t2 = t[:i] + ((ticket, amount - 1),) + t[i+1:]
-                           else:
-                              t2 = t
-                           loc_sets[turn + 1].add((dest, t2))
-         if not force_move and is_stuck:
+      if eliminate == None:
+         allowed = bitsets.ALL_LOCATIONS
+      else:
+         allowed = bitsets.ALL_LOCATIONS & ~bitsets.from_locations(eliminate[turn])
+      next_states = {}
+      for t, mask in states.items():
+         usable = []
+         for i in range(len(transports)):
+            amount = t[i]
+            if amount != 0:
+               usable.append(transports[i])
+               dests = bitsets.expand(mask, transports[i]) & allowed
+               if dests:
+                  if amount > 0:
+                     t2 = t[:i] + (amount - 1,) + t[i+1:]
+                  else:
+                     t2 = t
+                  next_states[t2] = next_states.get(t2, 0L) | dests
+         if not force_move:
             # if the pawn is stuck, he just waits in the same location until
             # the next turn
-            loc_sets[turn + 1].add((loc, t))
+            stuck = 0L
+            for loc in bitsets.to_locations(mask):
+               for ticket in usable:
+                  if bitsets.neighbour_mask(loc, ticket) & allowed:
+                     break
+               else:
+                  stuck |= 1L << loc
+            if stuck:
+               next_states[t] = next_states.get(t, 0L) | stuck
+      states = next_states
 
-   ret_val = sets.Set()
-   for loc, t in loc_sets[turns]:
-      ret_val.add(loc)
-   return ret_val
+   result = 0L
+   for mask in states.values():
+      result |= mask
+   return result
 
 
 
 
 # Given a starting location and list of tickets spent, compute the possible
-# locations where a pawn could have moved.  (This will be slow for a lengthy
-# list of tickets.)  Returns a Set.
+# locations where a pawn could have moved.  Returns a Set.
 #
 # The optional 'eliminate' argument is a list of the same length as
 # 'tickets_spent'.  Each element of the list is a Set of locations where the
 # pawn could not have moved on that turn.  Thus 'eliminate' could be used to
 # rule out Mr. X capture scenarios.
 def possible_locations(source, tickets_spent, eliminate=None):
-   if eliminate == None:
-      eliminate = [sets.Set()] * len(tickets_spent)
-
-   loc_sets = [sets.Set([source])]
-   for turn in range(len(tickets_spent)):
-      loc_sets.append(sets.Set())
-      for loc in loc_sets[turn]:
-         for dest, transports in map.locToRoutes[loc]:
-            if tickets_spent[turn] in transports and dest not in eliminate[turn]:
-               loc_sets[turn + 1].add(dest)
-
-   return loc_sets[len(tickets_spent)]
-
+   return sets.Set(bitsets.to_locations(
+      possible_locations_mask(source, tickets_spent, eliminate)))
 
 
+# Same as possible_locations(), but returns the locations as a bitmask (see
+# the 'bitsets' module).
+def possible_locations_mask(source, tickets_spent, eliminate=None):
+   mask = 1L << source
+   for turn in range(len(tickets_spent)):
+      mask = bitsets.expand(mask, tickets_spent[turn])
+      if eliminate != None:
+         mask &= ~bitsets.from_locations(eliminate[turn])
+   return mask
@@ -18,6 +18,8 @@
 LLAW_VERSION          = "0.3.0pre2"
 
 PROTOCOL_VERSION      = "2.1"
+# the framed protocol (see frames.py), which clients ask for first
+BINARY_PROTOCOL_VERSION = "3"
 LLAW_PORT             = 7921
 
 GAMESTATUS_NEW        = "new"
@@ -26,5 +28,8 @@ GAMESTATUS_COMPLETE   = "complete"
 
 GAMETYPE_STANDARD     = "standard"
 
+# turns on which Mr. X's location is revealed to the detectives
+SURFACING_TURNS       = (3, 8, 13, 18, 24)
+
 
 
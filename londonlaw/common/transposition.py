@@ -0,0 +1,146 @@
+#  London Law -- a networked manhunting board game
+#  Copyright (C) 2003-2004, 2005 Paul Pelzl
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License, Version 2, as
+#  published by the Free Software Foundation.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# transposition.py
+#
+# A fixed-size transposition table for game-tree search, keyed by the Zobrist
+# hash of a GameState (state.hash).  The table never grows: each position
+# maps to one bucket (hash modulo the number of buckets), and when a bucket
+# is full the replacement policy decides which entry to give up.
+#
+#   REPLACE_ALWAYS   the newest entry always wins
+#   REPLACE_DEPTH    keep the entry searched more deeply, unless it is left
+#                    over from an earlier search
+#   REPLACE_TWO_TIER two entries per bucket: one kept by depth, one that is
+#                    always replaced
+#
+# Call newSearch() before each move's search.  Entries from earlier searches
+# stay usable (the same positions come up again on later turns), but they
+# are the first to be replaced.
+#
+# Typical use in a negamax search:
+#
+#   entry = table.probe(state.hash)
+#   if entry is not None and entry[0] >= depth:
+#      ...use entry[1] according to entry[2]...
+#   ...search...
+#   table.store(state.hash, depth, value, flag, bestMove)
+
+REPLACE_ALWAYS   = "always"
+REPLACE_DEPTH    = "depth"
+REPLACE_TWO_TIER = "two-tier"
+
+# what a stored value means
+EXACT       = 0
+LOWER_BOUND = 1
+UPPER_BOUND = 2
+
+DEFAULT_SIZE = 1 << 16
+
+
+class TranspositionError(Exception):
+   pass
+
+
+
+class TranspositionTable(object):
+   # 'size' is the number of entries the table can hold
+   def __init__(self, size=DEFAULT_SIZE, policy=REPLACE_DEPTH):
+      if policy not in (REPLACE_ALWAYS, REPLACE_DEPTH, REPLACE_TWO_TIER):
+         raise TranspositionError("unknown replacement policy \"%s\"" % policy)
+      if size < 2:
+         raise TranspositionError("transposition table too small")
+      self._policy = policy
+      if policy == REPLACE_TWO_TIER:
+         self._ways = 2
+      else:
+         self._ways = 1
+      self._numBuckets = size // self._ways
+      self.clear()
+
+   def clear(self):
+      # entries are (hash, depth, value, flag, move, generation), or None
+      self._entries    = [None] * (self._numBuckets * self._ways)
+      self._generation = 0
+      self.hits        = 0
+      self.misses      = 0
+      self.stores      = 0
+      self.overwrites  = 0
+
+   def getPolicy(self):
+      return self._policy
+
+   def getSize(self):
+      return len(self._entries)
+
+   def __len__(self):
+      return len(self._entries) - self._entries.count(None)
+
+   # Start a new search; older entries become preferred for replacement.
+   def newSearch(self):
+      self._generation += 1
+
+   # Look up a position.  Returns (depth, value, flag, move), or None.
+   def probe(self, h):
+      slot = (h % self._numBuckets) * self._ways
+      for i in range(slot, slot + self._ways):
+         entry = self._entries[i]
+         if entry is not None and entry[0] == h:
+            self.hits += 1
+            return entry[1:5]
+      self.misses += 1
+      return None
+
+   # Record a search result for a position, subject to the replacement policy.
+   # Returns True if the entry was stored.
+   def store(self, h, depth, value, flag=EXACT, move=None):
+      slot    = (h % self._numBuckets) * self._ways
+      entries = self._entries
+      new     = (h, depth, value, flag, move, self._generation)
+
+      if self._policy == REPLACE_ALWAYS:
+         target = slot
+      elif self._policy == REPLACE_DEPTH:
+         old = entries[slot]
+         if old is not None and old[0] != h and old[5] == self._generation \
+         and old[1] > depth:
+            return False
+         target = slot
+      else:
+         # the first way keeps the deepest result of this search; anything
+         # it turns away goes to the second way
+         old    = entries[slot]
+         second = entries[slot + 1]
+         if old is None or old[0] == h or old[5] != self._generation or old[1] <= depth:
+            if old is not None and old[0] != h:
+               # demote the displaced entry rather than losing it
+               if second is not None and second[0] != h:
+                  self.overwrites += 1
+               entries[slot + 1] = old
+            elif second is not None and second[0] == h:
+               entries[slot + 1] = None
+            entries[slot] = new
+            self.stores += 1
+            return True
+         target = slot + 1
+
+      if entries[target] is not None and entries[target][0] != h:
+         self.overwrites += 1
+      entries[target] = new
+      self.stores += 1
+      return True
+
+
@@ -1,19 +1,5 @@
 import re, sys
-
-def escape_chars(token):
-   return re.sub(r"""("|\\)""", r"\\\1", token)
-
-def add_quotes(token):
-   if re.search(r"\s", token):
-      return "".join(('"', token, '"'))
-   else:
-      return token
-
-def join_tokens(*tokens):
-   tokens = [str(token) for token in tokens]
-   tokens = [escape_chars(token) for token in tokens]
-   tokens = [add_quotes(token) for token in tokens]
-   return " ".join(tokens)
+from londonlaw.common.codec import join_tokens, split_tokens
 
 def parse_bool(str):
    str = str.lower()
@@ -0,0 +1,88 @@
+#  London Law -- a networked manhunting board game
+#  Copyright (C) 2003-2004, 2005 Paul Pelzl
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License, Version 2, as
+#  published by the Free Software Foundation.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# zobrist.py
+#
+# Zobrist keys for game positions.  Every feature of a position (pawn p on
+# location l, pawn p holding n tickets of type t, the turn number, the pawn
+# to move) has a fixed random key, and the hash of a position is the XOR of
+# the keys of its features.  Changing one feature changes the hash by XORing
+# out the old key and XORing in the new one, so GameState keeps its hash up
+# to date in constant time per change.
+#
+# The keys are 62-bit, so hashes stay plain ints on 64-bit platforms, and are
+# generated from a fixed seed so that hashes agree between processes (and
+# between a client and the server).
+
+import random
+
+from londonlaw.common import map
+
+
+NUM_PAWNS     = 6
+NUM_TICKETS   = 5
+NUM_LOCATIONS = len(map.locToRoutes)
+
+# ticket amounts from -1 (unlimited) up to MAX_AMOUNT get distinct keys;
+# larger amounts wrap around, which can only cause extra collisions
+MAX_AMOUNT    = 30
+AMOUNT_KEYS   = MAX_AMOUNT + 2
+TURN_KEYS     = 32
+
+_SEED         = 0x4c4c4157
+_BITS         = 62
+
+
+def _makeKeys(rng, count):
+   return [rng.getrandbits(_BITS) for i in range(count)]
+
+_rng = random.Random(_SEED)
+
+# LOCATION[pawn][loc]
+LOCATION = [_makeKeys(_rng, NUM_LOCATIONS) for p in range(NUM_PAWNS)]
+# TICKETS[pawn * NUM_TICKETS + ticket][amount + 1]
+TICKETS  = [_makeKeys(_rng, AMOUNT_KEYS) for i in range(NUM_PAWNS * NUM_TICKETS)]
+# TURN[turnNum % TURN_KEYS]
+TURN     = _makeKeys(_rng, TURN_KEYS)
+# TO_MOVE[pawn]
+TO_MOVE  = _makeKeys(_rng, NUM_PAWNS)
+
+del _rng
+
+
+def locationKey(pawn, loc):
+   return LOCATION[pawn][loc % NUM_LOCATIONS]
+
+def ticketKey(slot, amount):
+   return TICKETS[slot][(amount + 1) % AMOUNT_KEYS]
+
+def turnKey(turnNum):
+   return TURN[turnNum % TURN_KEYS]
+
+def toMoveKey(pawn):
+   return TO_MOVE[pawn]
+
+
+# Compute the hash of a position from scratch.
+def hashPosition(locations, tickets, turnNum, current):
+   h = turnKey(turnNum) ^ toMoveKey(current)
+   for pawn in range(NUM_PAWNS):
+      h ^= locationKey(pawn, locations[pawn])
+   for slot in range(NUM_PAWNS * NUM_TICKETS):
+      h ^= ticketKey(slot, tickets[slot])
+   return h
+
+
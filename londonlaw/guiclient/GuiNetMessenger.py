@@ -14,12 +14,28 @@
 #  along with this program; if not, write to the Free Software
 #  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 
+from londonlaw.common.gamelist import GameList
+from londonlaw.common.history import GameHistory
 
 
 # messenger class that sends communications between
 # protocol and gui
 class GuiNetMessenger:
 
+   def __init__(self):
+      # the game list is kept across connections, so that reconnecting
+      # only fetches the changes (see londonlaw.common.gamelist)
+      self._gameList = GameList()
+      # likewise the history of the game being played, so that rejoining
+      # it only fetches the moves missed (see londonlaw.common.history)
+      self._gameHistory = GameHistory()
+
+   def getGameList(self):
+      return self._gameList
+
+   def getGameHistory(self):
+      return self._gameHistory
+
    def getUsername(self):
       return self._username
 
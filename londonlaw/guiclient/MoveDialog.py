@@ -29,7 +29,9 @@
 #        can be factored better into functions.
 
 import gettext, wx
-from londonlaw.common.map import *
+from londonlaw.common.graph import TICKET_NAMES, TAXI_CODE, BUS_CODE, \
+      UNDERGROUND_CODE, BLACK_CODE
+from londonlaw.common.GameState import GameState
 
 
 
@@ -404,41 +406,11 @@ class MoveDialog(wx.Dialog):
    # Returns a tuple.  The first element is a list of integer available
    # moves, the second is the same list converted to strings.
    def getAvailMoves(self, pos, playerList, playerIdx):
-      tokenList = playerList[playerIdx][2]
-
-      # These are the positions that the player could get to using his current tokens,
-      # if no detectives were in the way.
-      movesFromMap = []
-      for routes in locToRoutes[pos]:
-         if playerIdx == 0: 
-            # Mr. X can always take a route with standard transports (infinite tickets)
-            if (TAXI in routes[1]) or (BUS in routes[1]) or \
-            (UNDERGROUND in routes[1]):
-               movesFromMap.append(routes[0])
-            # Mr. X also has the option of black ticket moves
-            elif tokenList[3] > 0: 
-               movesFromMap.append(routes[0])
-         else:
-            # Detectives have to pay for everything
-            if ((TAXI in routes[1] and tokenList[0] > 0) or
-                (BUS in routes[1] and tokenList[1] > 0) or
-                (UNDERGROUND in routes[1] and tokenList[2] > 0)):
-               movesFromMap.append(routes[0])
-
-      # Remove positions that a detective is on.
-      detPositions = []
-      for det in playerList[1:]:
-         detPositions.append(det[1])
-
+      state = makeMoveState(pos, playerList[playerIdx][2], playerIdx, playerList)
       availMoves = []
-      for move in movesFromMap:
-         if (move not in detPositions) or (playerIdx == 0):
-            # this is to check that the player has at least one ticket type
-            # that will get him to this destination; otherwise it is
-            # effectively an illegal move
-            transports, transportsStr = self.getAvailTransports(pos, move, tokenList, playerIdx)
-            if transports != []:
-               availMoves.append(move)
+      for move in state.legalMoves(playerIdx, doubles=False):
+         if move[1] not in availMoves:
+            availMoves.append(move[1])
 
       availMoves.sort()
       availMovesStr = []
@@ -449,37 +421,43 @@ class MoveDialog(wx.Dialog):
 
 
 
-   # Returns a tuple.  The first element is a list of integer available
-   # transports (TAXI, BUS, etc.), the second is a more pleasant
-   # string version.
+   # Returns a tuple.  The first element is a list of available transports
+   # (TAXI, BUS, etc.), the second is a more pleasant string version.
    def getAvailTransports(self, pos, destPos, tokenList, playerIdx):
-      routes = locToRoutes[pos]
-      for route in routes:
-         if route[0] == destPos:
-            transports = route[1]
-            break
-
-      # Mr. X has another option
-      if playerIdx == 0:
-         if BLACK not in transports and tokenList[3] > 0:
-            transports = transports + (BLACK,)
-
+      state = makeMoveState(pos, tokenList, playerIdx)
+      transports    = []
       transportsStr = []
-      for trans in transports:
-         if trans == TAXI and (tokenList[0] > 0 or tokenList[0] == -1):
-            # TRANSLATORS: this is used for choosing ticket type in the move dialog
-            transportsStr.append(_("taxi"))
-         elif trans == BUS and (tokenList[1] > 0 or tokenList[1] == -1):
-            # TRANSLATORS: this is used for choosing ticket type in the move dialog
-            transportsStr.append(_("bus"))
-         elif trans == UNDERGROUND and (tokenList[2] > 0 or tokenList[2] == -1):
-            # TRANSLATORS: this is used for choosing ticket type in the move dialog
-            transportsStr.append(_("underground"))
-         elif trans == BLACK and (tokenList[3] > 0):
-            # TRANSLATORS: this is used for choosing ticket type in the move dialog
-            transportsStr.append(_("black ticket"))
+      for move in state.legalMoves(playerIdx, doubles=False):
+         if move[1] == destPos:
+            transports.append(TICKET_NAMES[move[2]])
+            if move[2] == TAXI_CODE:
+               # TRANSLATORS: this is used for choosing ticket type in the move dialog
+               transportsStr.append(_("taxi"))
+            elif move[2] == BUS_CODE:
+               # TRANSLATORS: this is used for choosing ticket type in the move dialog
+               transportsStr.append(_("bus"))
+            elif move[2] == UNDERGROUND_CODE:
+               # TRANSLATORS: this is used for choosing ticket type in the move dialog
+               transportsStr.append(_("underground"))
+            elif move[2] == BLACK_CODE:
+               # TRANSLATORS: this is used for choosing ticket type in the move dialog
+               transportsStr.append(_("black ticket"))
 
       return transports, transportsStr
 
 
 
+# Build a GameState for computing the moves of the pawn 'playerIdx', standing
+# at 'pos' with tickets 'tokenList'.  If 'playerList' is given, the other
+# pawns are placed too, so detective collisions are taken into account.
+def makeMoveState(pos, tokenList, playerIdx, playerList=None):
+   state = GameState()
+   if playerList is not None:
+      for i in range(len(playerList)):
+         state.setLocation(i, playerList[i][1])
+   state.setLocation(playerIdx, pos)
+   for code in range(len(tokenList)):
+      state.setTicketAmount(playerIdx, code, tokenList[code])
+   return state
+
+
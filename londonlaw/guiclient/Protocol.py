@@ -16,10 +16,10 @@
 
 
 
-import shlex, sys, gettext, locale
+import sys, gettext, locale
 from twisted.protocols import basic
 from twisted.python import log
-from londonlaw.common import util
+from londonlaw.common import dispatch, frames, util
 from londonlaw.common.protocol import *
 import wx
 
@@ -29,7 +29,7 @@ class ProtocolError(Exception):
    
 
 
-class LLawClientProtocol(basic.LineOnlyReceiver):
+class LLawClientProtocol(basic.LineReceiver):
 
    def __init__(self):
       self._tagIndex   = 0
@@ -38,8 +38,11 @@ class LLawClientProtocol(basic.LineOnlyReceiver):
       self._pawn2Index = {"X" : 0, "Red" : 1, "Yellow" : 2,
             "Green" : 3, "Blue" : 4, "Black" : 5}
       self._game2Status = {}
+      self._listTag    = None
+      # protocol version 3: frames rather than lines (see frames.py)
+      self._protocolVersion = BINARY_PROTOCOL_VERSION
+      self._frameReader     = None
       self._gameJoined = None
-      self._history    = []
 
 
    def _setPreviousState(self):
@@ -68,7 +71,7 @@ class LLawClientProtocol(basic.LineOnlyReceiver):
 
    def connectionMade(self):
       self.factory.registerProtocol(self)
-      self.sendTokens(self.genTag(), "protocol", PROTOCOL_VERSION)
+      self.sendTokens(self.genTag(), "protocol", self._protocolVersion)
       self._state = "protocol"
 
 
@@ -78,7 +81,11 @@ class LLawClientProtocol(basic.LineOnlyReceiver):
 
    def join(self, name):
       log.msg("called Protocol.join()")
-      self.sendTokens(self.genTag(), "join", name.encode("utf-8"))
+      history = self._messenger.getGameHistory()
+      if history.getGame() != name:
+         history.reset(name)
+      self.sendTokens(self.genTag(), "join", name.encode("utf-8"),
+            *history.positionTokens(name))
       self._state      = "tryjoin"
       self._gameJoined = name
 
@@ -91,29 +98,49 @@ class LLawClientProtocol(basic.LineOnlyReceiver):
 
    def lineReceived(self, line):
       #print "received line \"%s\"" % line.encode("string_escape")
+      self.tokensReceived(util.split_tokens(line))
+
+
+   # frames, in protocol version 3
+   def rawDataReceived(self, data):
+      for opcode, payload in self._frameReader.feed(data):
+         if self.transport.disconnecting:
+            return
+         self.tokensReceived(frames.decode(opcode, payload))
+
+
+   def tokensReceived(self, tokens):
       try:
-         tokens    = shlex.split(line)
          if len(tokens) > 1:
             tag       = tokens[0]
             response  = tokens[1].lower()
             data      = tokens[2:]
 
-            f = getattr(self, "".join(("response_", response, "_", self._state)), None)
+            f = dispatch.getTable(self.__class__, "response_").lookup(self._state, response)
             if f is None:
-               # Try a catch-all method for the command
-               f = getattr(self, "".join(("response_", response, "_default")), None)
-            if f is None:
-               log.msg("Received unhandled server message (tried default): \"" + line + "\" state = \"" + self._state + "\"")
+               log.msg("Received unhandled server message (tried default): \"" + util.join_tokens(*tokens) + "\" state = \"" + self._state + "\"")
                return
             
-            f(tag, data)
+            f(self, tag, data)
          else:
-            log.msg("Received unhandled server message (too few args): \"" + line + "\" state = \"" + self._state + "\"")
+            log.msg("Received unhandled server message (too few args): \"" + util.join_tokens(*tokens) + "\" state = \"" + self._state + "\"")
 
       except AttributeError, e:
          log.msg(str(e))
          print "tokens = " + str(tokens)
-         log.msg("Received unhandled server message: \"" + line + "\" state = \"" + self._state + "\"")
+         log.msg("Received unhandled server message: \"" + util.join_tokens(*tokens) + "\" state = \"" + self._state + "\"")
+
+
+   # Show the game list as last seen, and ask the server what has changed
+   # since then.
+   def listGames(self):
+      gameList = self._messenger.getGameList()
+      for data in gameList.getGames():
+         self._game2Status[data[0]] = data[1]
+         self._messenger.guiAddGame(data)
+      gameList.startListing()
+      self._listTag = self.genTag()
+      self.sendTokens(self._listTag, *gameList.listTokens())
 
 
    def makeMove(self, data):
@@ -128,7 +155,8 @@ class LLawClientProtocol(basic.LineOnlyReceiver):
 
 
    def newgame(self, data):
-      self._state = "trynewgame"
+      self._state      = "trynewgame"
+      self._gameJoined = data[0]
       self.sendTokens(self.genTag(), "newgame", data[0].encode("utf-8"), data[1])
 
 
@@ -141,6 +169,13 @@ class LLawClientProtocol(basic.LineOnlyReceiver):
       return self._waitTag
       
 
+   def sendLine(self, line):
+      if self._frameReader is not None:
+         self.transport.write(frames.encodeText(line))
+      else:
+         basic.LineReceiver.sendLine(self, line)
+
+
    def sendTokens(self, *tokens):
       s = util.join_tokens(*tokens)
       # convert from unicode to 8-bit ascii
@@ -195,8 +230,8 @@ class LLawClientProtocol(basic.LineOnlyReceiver):
    def response_ejected_default(self, tag, data):
       self._messenger.guiAlert(data[0])
       self._state = "loggedin"
-      self.sendTokens(self.genTag(), "listgames")
       self._messenger.guiLaunchGameListWindow()
+      self.listGames()
    
 
    def response_no_login(self, tag, data):
@@ -204,6 +239,21 @@ class LLawClientProtocol(basic.LineOnlyReceiver):
       self.transport.loseConnection()
 
 
+   def response_no_protocol(self, tag, data):
+      if self._protocolVersion == BINARY_PROTOCOL_VERSION:
+         # an older server; fall back on the text protocol
+         self._protocolVersion = PROTOCOL_VERSION
+         self.sendTokens(self.genTag(), "protocol", self._protocolVersion)
+      else:
+         if data:
+            self._messenger.guiAlert(data[0])
+         self.transport.loseConnection()
+
+
+   def response_bad_protocol(self, tag, data):
+      self.response_no_protocol(tag, data)
+
+
    def response_no_language(self, tag, data):
       self.response_ok_language(tag, data)
 
@@ -229,14 +279,18 @@ class LLawClientProtocol(basic.LineOnlyReceiver):
    def response_ok_login(self, tag, data):
       if tag == self._waitTag:
          self._state = "loggedin"
-         self.sendTokens(self.genTag(), "listgames")
          self._messenger.guiLaunchGameListWindow()
+         self.listGames()
       else:
          self.logUnmatched(tag, "ok", data)
 
 
    def response_ok_loggedin(self, tag, data):
-      pass
+      if tag == self._listTag:
+         self._listTag = None
+         for name in self._messenger.getGameList().endListing(data):
+            self._game2Status.pop(name, None)
+            self._messenger.guiRemoveGame([name])
 
 
    def response_ok_playing(self, tag, data):
@@ -245,6 +299,9 @@ class LLawClientProtocol(basic.LineOnlyReceiver):
 
    def response_ok_protocol(self, tag, data):
       if tag == self._waitTag:
+         if self._protocolVersion == BINARY_PROTOCOL_VERSION:
+            self._frameReader = frames.FrameReader()
+            self.setRawMode()
          lang = locale.getdefaultlocale()[0]
          if lang != None:
             self._state = "language"
@@ -277,7 +334,7 @@ class LLawClientProtocol(basic.LineOnlyReceiver):
       if tag == self._waitTag:
          self._state = "loggedin"
          self._messenger.guiLaunchGameListWindow()
-         self.sendTokens(self.genTag(), "listgames")
+         self.listGames()
       else:
          self.logUnmatched(tag, "ok", data)
 
@@ -335,6 +392,7 @@ class LLawClientProtocol(basic.LineOnlyReceiver):
       log.msg("received gameinfo " + str(data))
       decoded = [data[0].decode("utf-8")] + data[1:]
       self._game2Status[decoded[0]] = decoded[1]
+      self._messenger.getGameList().gameInfo(decoded)
       self._messenger.guiAddGame(decoded)
 
 
@@ -346,31 +404,38 @@ class LLawClientProtocol(basic.LineOnlyReceiver):
       log.msg("received gameover " + str(data))
       self._state = "endgame"
       self._messenger.guiAlert(data[1])
-      self._history = []
+      history = self._messenger.getGameHistory()
+      history.reset(history.getGame())
       self.sendTokens(self.genTag(), "history")
 
 
    def response_gameremoved_loggedin(self, tag, data):
       log.msg("received gameremoved info " + str(data))
       decoded = [el.decode("utf-8") for el in data]
+      self._game2Status.pop(decoded[0], None)
+      self._messenger.getGameList().gameRemoved(decoded[0])
       self._messenger.guiRemoveGame(decoded)
 
 
    def response_gamestart_default(self, tag, data):
       log.msg("received gamestart " + str(data))
       self._state = "playing"
+      # The starting locations are only sent as history.  Asking for it
+      # "since 0 0" makes the reply replace any moves already received.
+      self._messenger.getGameHistory().reset(self._gameJoined)
+      self.sendTokens(self.genTag(), "history", "0", "0")
       self._messenger.guiUpdateStatusBar(_("Preparing to start the game..."))
 
 
    def response_history_endgame(self, tag, data):
       log.msg("received history + " + str(data))
+      history = self._messenger.getGameHistory()
       if data[0] == "end":
-         self._messenger.guiUpdateHistory(self._history)
+         self._messenger.guiUpdateHistory(history.getTurns())
+      elif data[0] == "since":
+         history.since(int(data[1]), int(data[2]))
       else:
-         turnData = []
-         for moveStr in data[1:]:
-            turnData.append(moveStr.split())
-         self._history.append(turnData)
+         history.addMoves(int(data[0]), data[1:])
          
 
    def response_history_playing(self, tag, data):
@@ -379,6 +444,7 @@ class LLawClientProtocol(basic.LineOnlyReceiver):
 
    def response_move_playing(self, tag, data):
       log.msg("received move " + str(data))
+      self._messenger.getGameHistory().addMove(" ".join(data))
       self._messenger.guiDisplayMove(data)
 
 
@@ -451,6 +517,7 @@ class LLawClientProtocol(basic.LineOnlyReceiver):
 
    def response_turnnum_playing(self, tag, data):
       log.msg("received turnnum " + str(data))
+      self._messenger.getGameHistory().setTurnNum(int(data[0]))
       self._messenger.guiSetTurnNum(data[0])
 
 
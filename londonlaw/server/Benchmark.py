@@ -0,0 +1,643 @@
+#  London Law -- a networked manhunting board game
+#  Copyright (C) 2003-2004, 2005 Paul Pelzl
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License, Version 2, as
+#  published by the Free Software Foundation.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# Benchmark.py
+#
+# Micro-benchmarks for the server, run in-process with no network.  Clients
+# are real LLawServerProtocol instances whose transports just count the
+# bytes written to them, registered with a game registry in a temporary
+# directory.  Usage:
+#
+#   $ python -m londonlaw.server.Benchmark fanout --spectators 200 --moves 2000
+#   $ python -m londonlaw.server.Benchmark journal --moves 20000 --batch 50
+#   $ python -m londonlaw.server.Benchmark recovery --games 10000 --moves 20
+#   $ python -m londonlaw.server.Benchmark memory --games 50000 --moves 20
+#   $ python -m londonlaw.server.Benchmark codec --lines 300000
+#   $ python -m londonlaw.server.Benchmark rules --positions 1000
+#
+# fanout: one game with its six players plus a number of extra listeners
+#    (spectators, each with their own connection), driven by random moves.
+#    Measures the time spent in Game.makeMove() announcing moves to all of
+#    them and writing the announcements out, and the transport writes made,
+#    then makes the same moves with clients that write each line as it is
+#    sent, as before output was buffered, for comparison.  With --stalled,
+#    some of the spectators' transports stop taking output (pausing their
+#    producers), and the output held back for them is reported.
+#
+# journal: random games in the registry, with and without the move journal.
+#    The journal is fsynced every 'batch' moves, standing in for the group
+#    commits the reactor would make.  Measures the cost of journaling.
+#
+# recovery: journal a number of random games, then drop the registry
+#    without closing it, as a crash would, and time reopening it (which
+#    replays the journal).
+#
+# memory: store a number of random games, nobody listening to them, with
+#    and without a limit on the number of games kept loaded, and report the
+#    growth in resident memory.  Each run is made in a fresh process.
+#
+# codec: time splitting and joining typical protocol lines with the codec
+#    against shlex.split() and the regex-per-token join that was used before,
+#    and encoding and decoding them as protocol version 3 frames.  (That the
+#    codec agrees with shlex is checked in tests/test_codec.py.)
+#
+# rules: move legality tests and a two-ply move search on random positions,
+#    with GameState and the compiled map against the Pawn objects and
+#    map.locToRoutes scans that Game used before them.
+
+import gettext, multiprocessing, os, random, re, shlex, shutil, sys, tempfile, time
+from optparse import OptionParser
+
+from londonlaw.common.protocol import *
+from londonlaw.common import codec, frames, map
+from londonlaw.common.Pawn import Pawn as CommonPawn
+from londonlaw.common.GameState import ALL_TICKET_NAMES
+from londonlaw.common.graph import TICKET_NAMES
+from londonlaw.aiclients import policies
+from Game import Game
+from Protocol import LLawServerProtocol, ProtocolGameListener, flushOutput
+import GameRegistry
+
+# the registry logs translated messages
+gettext.install("londonlaw", unicode=True)
+
+
+class BenchmarkError(Exception):
+   pass
+
+
+
+# A transport that throws away what is written, counting writes, lines and
+# bytes.
+class CountingTransport(object):
+   def __init__(self):
+      self.writes        = 0
+      self.lines         = 0
+      self.bytes         = 0
+      self.producer      = None
+      self.aborted       = False
+      self.disconnecting = False
+
+   def registerProducer(self, producer, streaming):
+      self.producer = producer
+
+   def unregisterProducer(self):
+      self.producer = None
+
+   # act like a transport whose write buffer has filled up
+   def stall(self):
+      self.producer.pauseProducing()
+
+   def write(self, data):
+      self.writes += 1
+      self.lines  += data.count("\r\n")
+      self.bytes  += len(data)
+
+   def writeSequence(self, seq):
+      self.write("".join(seq))
+
+   def loseConnection(self):
+      pass
+
+   def abortConnection(self):
+      self.aborted = True
+
+   def pauseProducing(self):
+      pass
+
+   def resumeProducing(self):
+      pass
+
+
+# A client that writes each line as soon as it is sent, as the server did
+# before output was buffered until the end of the reactor turn.
+class UnbufferedProtocol(LLawServerProtocol):
+   def _queue(self, data):
+      LLawServerProtocol._queue(self, data)
+      if data.endswith(self.delimiter):
+         self.flush()
+
+
+# Create a connected, logged-in client for 'username'.
+def makeClient(username, protocolClass=LLawServerProtocol):
+   client = protocolClass()
+   client._username = username
+   client._state    = "playing"
+   client.makeConnection(CountingTransport())
+   GameRegistry.registry.addClient(client)
+   return client
+
+
+# Open a game registry in a temporary directory, with the [server] config
+# options in 'config'.  Returns the directory, which the caller should remove
+# after closing the registry.
+def openRegistry(config={}):
+   dbDir = tempfile.mkdtemp(prefix="llaw-bench-")
+   if config:
+      f = open(os.path.join(dbDir, "config"), "w")
+      f.write("[server]\n")
+      for option, value in config.items():
+         f.write("%s: %s\n" % (option, value))
+      f.close()
+   GameRegistry.getHandle(dbDir)
+   return dbDir
+
+
+def closeRegistry(dbDir):
+   GameRegistry.registry.close()
+   GameRegistry.registry = None
+   shutil.rmtree(dbDir, ignore_errors=True)
+
+
+
+# Play random games with 6 players and 'spectators' extra listeners until
+# 'moves' moves have been made; the transports of the first 'stalled'
+# spectators of each game stop taking output.  With 'buffered' false, the
+# clients write each line as it is sent (UnbufferedProtocol).  Returns a
+# dict of results.
+def fanout(spectators, moves, seed=0, stalled=0, buffered=True):
+   policy  = policies.RandomPolicy()
+   if buffered:
+      protocolClass = LLawServerProtocol
+   else:
+      protocolClass = UnbufferedProtocol
+   clients = []
+   stalls  = []
+   elapsed = 0.0
+   made    = 0
+   games   = 0
+   dbDir   = openRegistry()
+   try:
+      while made < moves:
+         rng  = random.Random(seed + games)
+         game = Game(u"fanout %d" % games, GAMETYPE_STANDARD, rng)
+         games += 1
+         names = []
+         for pawn in game.getPawns():
+            name = u"%s player" % pawn.getName()
+            pawn.setPlayer(name)
+            names.append(name)
+         names.extend([u"spectator %d" % i for i in range(spectators)])
+         for name in names:
+            clients.append(makeClient(name, protocolClass))
+            game.addListener(ProtocolGameListener(name), name)
+         for client in clients[-spectators:][:stalled]:
+            client.transport.stall()
+            stalls.append(client)
+         game.setStatus(GAMESTATUS_INPROGRESS)
+
+         while made < moves and game.getStatus() == GAMESTATUS_INPROGRESS:
+            pawn = game.getCurrentPawn()
+            move = policy.chooseMove(game, pawn, rng)
+            start = time.time()
+            game.makeMove(pawn, *move)
+            # the end of the reactor turn
+            flushOutput()
+            elapsed += time.time() - start
+            made += 1
+   finally:
+      closeRegistry(dbDir)
+
+   writes = 0
+   lines  = 0
+   nbytes = 0
+   for client in clients:
+      writes += client.transport.writes
+      lines  += client.transport.lines
+      nbytes += client.transport.bytes
+   held    = max([0] + [client.getHeldBytes() for client in stalls])
+   aborted = len([client for client in stalls if client.transport.aborted])
+   return {"moves" : made, "listeners" : 6 + spectators, "seconds" : elapsed,
+           "writes" : writes, "lines" : lines, "bytes" : nbytes,
+           "stalled" : len(stalls), "held" : held, "aborted" : aborted}
+
+
+
+# Start a registered random game, with players but no listeners.
+def startGame(name, rng):
+   game = Game(name, GAMETYPE_STANDARD, rng)
+   GameRegistry.registry.addGame(game)
+   for pawn in game.getPawns():
+      pawn.setPlayer(u"%s player" % pawn.getName())
+   game.setStatus(GAMESTATUS_INPROGRESS)
+   return game
+
+
+# Make 'moves' random moves in registered games, with or without the journal,
+# fsyncing it every 'batch' moves.  Returns a dict of results.
+def journaling(moves, journal=True, batch=50, seed=0):
+   policy  = policies.RandomPolicy()
+   elapsed = 0.0
+   made    = 0
+   games   = 0
+   dbDir   = openRegistry({"journal" : str(journal)})
+   try:
+      registry = GameRegistry.registry
+      while made < moves:
+         rng  = random.Random(seed + games)
+         start = time.time()
+         game = startGame(u"journal %d" % games, rng)
+         elapsed += time.time() - start
+         games += 1
+         while made < moves and game.getStatus() == GAMESTATUS_INPROGRESS:
+            pawn = game.getCurrentPawn()
+            move = policy.chooseMove(game, pawn, rng)
+            start = time.time()
+            game.makeMove(pawn, *move)
+            made += 1
+            if made % batch == 0:
+               registry.syncJournal()
+            elapsed += time.time() - start
+      start = time.time()
+      registry.syncJournal()
+      elapsed += time.time() - start
+   finally:
+      closeRegistry(dbDir)
+   return {"moves" : made, "games" : games, "seconds" : elapsed}
+
+
+# Journal 'games' random games of up to 'moves' moves each, crash, and
+# time the recovery.  Returns a dict of results.
+def recovery(games, moves, seed=0):
+   policy  = policies.RandomPolicy()
+   made    = 0
+   dbDir   = openRegistry()
+   try:
+      for i in range(games):
+         rng  = random.Random(seed + i)
+         game = startGame(u"recovery %d" % i, rng)
+         for j in range(moves):
+            if game.getStatus() != GAMESTATUS_INPROGRESS:
+               break
+            pawn = game.getCurrentPawn()
+            game.makeMove(pawn, *policy.chooseMove(game, pawn, rng))
+            made += 1
+      GameRegistry.registry.syncJournal()
+      journalBytes = os.path.getsize(os.path.join(dbDir, GameRegistry.JOURNAL_FILENAME))
+      # the crash: nothing more is written
+      GameRegistry.registry = None
+      game = None
+
+      start = time.time()
+      GameRegistry.getHandle(dbDir)
+      elapsed = time.time() - start
+      recovered = len(GameRegistry.registry.getGameList())
+   finally:
+      closeRegistry(dbDir)
+   return {"games" : games, "moves" : made, "bytes" : journalBytes,
+           "recovered" : recovered, "seconds" : elapsed}
+
+
+
+# resident set size of this process, in bytes
+def residentMemory():
+   f = open("/proc/self/status")
+   try:
+      for line in f:
+         if line.startswith("VmRSS:"):
+            return int(line.split()[1]) * 1024
+   finally:
+      f.close()
+   raise BenchmarkError("unable to read the resident set size")
+
+
+# Store 'games' random games of up to 'moves' moves each, keeping at most
+# 'cacheSize' loaded (0 for no limit), and measure the memory used.
+# Returns a dict of results.
+def memory(games, moves, cacheSize, seed=0):
+   policy = policies.RandomPolicy()
+   dbDir  = openRegistry({"game_cache_size" : cacheSize, "journal" : "no"})
+   try:
+      registry = GameRegistry.registry
+      before   = residentMemory()
+      start    = time.time()
+      for i in range(games):
+         rng  = random.Random(seed + i)
+         game = startGame(u"memory %d" % i, rng)
+         for j in range(moves):
+            if game.getStatus() != GAMESTATUS_INPROGRESS:
+               break
+            pawn = game.getCurrentPawn()
+            game.makeMove(pawn, *policy.chooseMove(game, pawn, rng))
+         if i % 1000 == 999:
+            registry.sync()
+      registry.sync()
+      game     = None
+      elapsed  = time.time() - start
+      after    = residentMemory()
+      loaded   = registry.getNumLoadedGames()
+   finally:
+      closeRegistry(dbDir)
+   return {"games" : games, "loaded" : loaded, "bytes" : after - before, "seconds" : elapsed}
+
+
+# Move legality as Game tested it before GameState and the compiled map:
+# a scan of map.locToRoutes with tickets held in Pawn dicts, and a double
+# move tested by changing the pawn and restoring it.  Kept as the baseline
+# for the rules benchmark, with the double-move ticket check added, which
+# Game used to leave out.
+def _pawnIsLegalMoveAux(pawn, newLoc1, ticket1, newLoc2=None, ticket2=None):
+   for route in map.locToRoutes[pawn.getLocation()]:
+      if route[0] == newLoc1:
+         if ((ticket1 in route[1] and pawn.hasTicket(ticket1)) or
+             (ticket1 == map.BLACK and pawn.hasTicket(map.BLACK))):
+            if newLoc2 is not None:
+               previousLocation = pawn.getLocation()
+               pawn.setLocation(newLoc1)
+               previousTicketNum = pawn.getTicketAmount(ticket1)
+               pawn.removeTicket(ticket1)
+               retVal = _pawnIsLegalMoveAux(pawn, newLoc2, ticket2)
+               pawn.setLocation(previousLocation)
+               pawn.setTicketAmount(ticket1, previousTicketNum)
+            else:
+               retVal = True
+            return retVal
+   return False
+
+def _pawnIsLegalMove(pawns, pawn, newLoc1, ticket1, newLoc2=None, ticket2=None):
+   if newLoc2 is not None and not pawn.hasTicket("double"):
+      return False
+   if pawn != pawns[0]:
+      teammateLocations = [p.getLocation() for p in pawns[1:] if p != pawn]
+      if newLoc1 in teammateLocations or newLoc2 in teammateLocations:
+         return False
+   return _pawnIsLegalMoveAux(pawn, newLoc1, ticket1, newLoc2, ticket2)
+
+# the single moves for 'pawn' in the same scan
+def _pawnMoves(pawns, pawn):
+   moves = []
+   if pawn != pawns[0]:
+      occupied = [p.getLocation() for p in pawns[1:] if p != pawn]
+   else:
+      occupied = ()
+   for dest, tickets in map.locToRoutes[pawn.getLocation()]:
+      if dest not in occupied:
+         for ticket in tickets:
+            if pawn.hasTicket(ticket):
+               moves.append((dest, ticket))
+   return moves
+
+
+# Play 'positions' random games for a few moves each, then time two things
+# on the positions reached, against the Pawn-dict baseline above: testing
+# every legal single and double move of every pawn (plus as many random
+# candidates), and a two-ply search over Mr. X's single moves that makes
+# each move, lists the replies and takes the move back.  The answers of the
+# two are compared first.  Returns a dict of results, in seconds.
+def rules(positions, seed=0):
+   policy  = policies.RandomPolicy()
+   states  = []
+   pawnSets = []
+   queries = []
+   for i in range(positions):
+      rng  = random.Random(seed + i)
+      game = Game(u"rules %d" % i, GAMETYPE_STANDARD, rng)
+      game.setStatus(GAMESTATUS_INPROGRESS)
+      for j in range(rng.randint(0, 40)):
+         if game.getStatus() != GAMESTATUS_INPROGRESS:
+            break
+         pawn = game.getCurrentPawn()
+         game.makeMove(pawn, *policy.chooseMove(game, pawn, rng))
+      state = game.getState().copy()
+      pawns = []
+      for pawn in game.getPawns():
+         copy = CommonPawn(pawn.getName())
+         copy.setLocation(pawn.getLocation())
+         for ticket in ALL_TICKET_NAMES:
+            copy.setTicketAmount(ticket, pawn.getTicketAmount(ticket))
+         pawns.append(copy)
+      for index in range(len(pawns)):
+         moves = state.legalMoves(index)
+         for k in range(len(moves)):
+            moves.append((index, rng.randint(1, 199), rng.randrange(len(TICKET_NAMES)),
+                  rng.choice((None, rng.randint(1, 199))), rng.randrange(len(TICKET_NAMES))))
+         for move in moves:
+            queries.append((len(states), move))
+      states.append(state)
+      pawnSets.append(pawns)
+
+   # the same queries in both forms
+   stateQueries = []
+   pawnQueries  = []
+   for i, move in queries:
+      if len(move) == 3 or move[3] is None:
+         move = move[:3] + (None, None)
+      stateQueries.append((states[i], move))
+      ticket2 = move[4] is not None and TICKET_NAMES[move[4]] or None
+      pawnQueries.append((pawnSets[i], pawnSets[i][move[0]],
+            move[1], TICKET_NAMES[move[2]], move[3], ticket2))
+   for (state, move), (pawns, pawn, a, b, c, d) in zip(stateQueries, pawnQueries):
+      if state.isLegalMove(*move) != _pawnIsLegalMove(pawns, pawn, a, b, c, d):
+         raise BenchmarkError("GameState.isLegalMove%r disagrees with the Pawn rules" % (move,))
+
+   result = {"positions" : positions, "queries" : len(queries)}
+   start = time.time()
+   for state, move in stateQueries:
+      state.isLegalMove(*move)
+   result["legal"] = time.time() - start
+   start = time.time()
+   for pawns, pawn, a, b, c, d in pawnQueries:
+      _pawnIsLegalMove(pawns, pawn, a, b, c, d)
+   result["pawnlegal"] = time.time() - start
+
+   start = time.time()
+   nodes = 0
+   for state in states:
+      for move in state.legalMoves(0, False):
+         state.apply(move)
+         nodes += len(state.legalMoves(state.current, False))
+         state.undo()
+   result["search"] = time.time() - start
+   result["nodes"]  = nodes
+   start = time.time()
+   pawnNodes = 0
+   for pawns in pawnSets:
+      x = pawns[0]
+      for dest, ticket in _pawnMoves(pawns, x):
+         previousLocation  = x.getLocation()
+         previousTicketNum = x.getTicketAmount(ticket)
+         x.setLocation(dest)
+         x.removeTicket(ticket)
+         pawnNodes += len(_pawnMoves(pawns, pawns[1]))
+         x.setLocation(previousLocation)
+         x.setTicketAmount(ticket, previousTicketNum)
+   result["pawnsearch"] = time.time() - start
+   if pawnNodes != nodes:
+      raise BenchmarkError("the searches visit %d and %d nodes" % (nodes, pawnNodes))
+   return result
+
+
+# typical lines, as tokens
+_CODEC_LINES = [
+   ("#00012", "move", "67", "taxi"),
+   ("*", "move", "Red", "67", "taxi"),
+   ("*", "turn", "Yellow"),
+   ("*", "gameinfo", "my game", "in progress", "standard", "3"),
+   ("*", "chatall", "Joe", "Don't go to \"Piccadilly\" now"),
+   ("*", "pawninfo", "Red", "Dan", "133", "8", "8", "4", "0", "0"),
+   ("*", "history", "3", "X -1 taxi", "Red 140 bus"),
+   ("#00013", "ok")]
+
+
+# the token joining used before the codec
+def _regexJoinTokens(*tokens):
+   tokens = [str(token) for token in tokens]
+   tokens = [re.sub(r"""("|\\)""", r"\\\1", token) for token in tokens]
+   tokens = [re.search(r"\s", token) and '"' + token + '"' or token for token in tokens]
+   return " ".join(tokens)
+
+
+# Split and join 'lines' typical lines with the codec and the old way.
+# Returns a dict of results, in seconds.
+def codecSpeed(lines):
+   tokenLists = (_CODEC_LINES * (lines / len(_CODEC_LINES) + 1))[:lines]
+   encoded    = [codec.join_tokens(*tokens) for tokens in tokenLists]
+   result     = {"lines" : lines}
+   for name, f, data in (("split", codec.split_tokens, encoded),
+         ("shlex", shlex.split, encoded)):
+      start = time.time()
+      for line in data:
+         f(line)
+      result[name] = time.time() - start
+   for name, f in (("join", codec.join_tokens), ("regexjoin", _regexJoinTokens)):
+      start = time.time()
+      for tokens in tokenLists:
+         f(*tokens)
+      result[name] = time.time() - start
+   start = time.time()
+   for tokens in tokenLists:
+      frames.encodeTokens(tokens)
+   result["encodeframe"] = time.time() - start
+   encoded = [frames.encodeTokens(tokens) for tokens in tokenLists]
+   start = time.time()
+   for frame in encoded:
+      frames.decode(ord(frame[2]), frame[3:])
+   result["decodeframe"] = time.time() - start
+   return result
+
+
+def main(argv=None):
+   parser = OptionParser(usage="%prog fanout|journal|recovery|memory|codec|rules [options]")
+   parser.add_option("-s", "--spectators", dest="spectators", type="int", default=100,
+         help="number of listeners in addition to the 6 players", metavar="NUM")
+   parser.add_option("-S", "--stalled", dest="stalled", type="int", default=0,
+         help="fanout: number of spectators that stop reading", metavar="NUM")
+   parser.add_option("-m", "--moves", dest="moves", type="int", default=2000,
+         help="number of moves to make (per game, for recovery)", metavar="NUM")
+   parser.add_option("-b", "--batch", dest="batch", type="int", default=50,
+         help="journal: fsync the journal every NUM moves", metavar="NUM")
+   parser.add_option("-g", "--games", dest="games", type="int", default=10000,
+         help="recovery, memory: number of games to store", metavar="NUM")
+   parser.add_option("-c", "--cache-size", dest="cacheSize", type="int", default=1000,
+         help="memory: number of games to keep loaded", metavar="NUM")
+   parser.add_option("-l", "--lines", dest="lines", type="int", default=100000,
+         help="codec: number of lines to split and join", metavar="NUM")
+   parser.add_option("-p", "--positions", dest="positions", type="int", default=1000,
+         help="rules: number of positions to test", metavar="NUM")
+   parser.add_option("-r", "--repeat", dest="repeat", type="int", default=3,
+         help="repeat the benchmark NUM times and report the best run", metavar="NUM")
+   (options, args) = parser.parse_args(argv)
+
+   if args == ["journal"]:
+      for journal in (False, True):
+         best = None
+         for i in range(options.repeat):
+            result = journaling(options.moves, journal, options.batch)
+            if best is None or result["seconds"] < best["seconds"]:
+               best = result
+         seconds = max(best["seconds"], 1e-9)
+         print "journal %-3s: %d moves in %d games in %.3f s, %.0f moves/s" % (
+               journal and "on" or "off", best["moves"], best["games"], seconds,
+               best["moves"] / seconds)
+      return
+   elif args == ["recovery"]:
+      result = recovery(options.games, options.moves)
+      print "recovery: %d games, %d moves, %d journal bytes" % (
+            result["games"], result["moves"], result["bytes"])
+      print "  recovered %d games in %.3f s, %.1f us per record" % (result["recovered"],
+            result["seconds"],
+            1e6 * result["seconds"] / max(2 * result["games"] + result["moves"], 1))
+      return
+   elif args == ["memory"]:
+      for cacheSize in (0, options.cacheSize):
+         pool = multiprocessing.Pool(1)
+         result = pool.apply(memory, (options.games, options.moves, cacheSize))
+         pool.close()
+         pool.join()
+         print "memory, cache %s: %d games stored, %d loaded, %.1f MB resident (%.0f bytes/game), %.1f s" % (
+               cacheSize or "unlimited", result["games"], result["loaded"],
+               result["bytes"] / 1048576.0, float(result["bytes"]) / result["games"],
+               result["seconds"])
+      return
+   elif args == ["codec"]:
+      best = {}
+      for i in range(options.repeat):
+         result = codecSpeed(options.lines)
+         for name in ("split", "shlex", "join", "regexjoin", "encodeframe", "decodeframe"):
+            best[name] = min(best.get(name, result[name]), result[name])
+      for name, label in (("split", "split_tokens"), ("shlex", "shlex.split"),
+            ("join", "join_tokens"), ("regexjoin", "regex join"),
+            ("encodeframe", "v3 encode"), ("decodeframe", "v3 decode")):
+         seconds = max(best[name], 1e-9)
+         print "  %-12s: %.0f lines/s, %.2f us per line" % (label,
+               options.lines / seconds, 1e6 * seconds / options.lines)
+      return
+   elif args == ["rules"]:
+      best = {}
+      for i in range(options.repeat):
+         result = rules(options.positions)
+         for name in ("legal", "pawnlegal", "search", "pawnsearch"):
+            best[name] = min(best.get(name, result[name]), result[name])
+      print "rules: %d positions, %d legality queries, %d search nodes" % (
+            result["positions"], result["queries"], result["nodes"])
+      for name, label, count in (("legal", "isLegalMove", result["queries"]),
+            ("search", "2-ply search", result["nodes"])):
+         seconds     = max(best[name], 1e-9)
+         pawnSeconds = max(best["pawn" + name], 1e-9)
+         print "  %-12s: GameState %.2f us, Pawn dicts %.2f us per %s (%.1fx)" % (label,
+               1e6 * seconds / count, 1e6 * pawnSeconds / count,
+               name == "legal" and "query" or "node", pawnSeconds / seconds)
+      return
+   elif args != ["fanout"]:
+      parser.error("unknown benchmark; available: fanout, journal, recovery, memory, codec, rules")
+
+   best = None
+   for i in range(options.repeat):
+      result = fanout(options.spectators, options.moves, stalled=options.stalled)
+      if best is None or result["seconds"] < best["seconds"]:
+         best = result
+   seconds = max(best["seconds"], 1e-9)
+   print "fanout: %d moves to %d listeners in %.3f s" % (best["moves"], best["listeners"], seconds)
+   print "  %.0f moves/s, %.0f lines/s, %.2f us per delivered line, %d bytes" % (
+         best["moves"] / seconds, best["lines"] / seconds,
+         1e6 * seconds / max(best["lines"], 1), best["bytes"])
+   print "  %.2f writes per move per listener, %.2f lines per write" % (
+         float(best["writes"]) / max(best["moves"] * best["listeners"], 1),
+         float(best["lines"]) / max(best["writes"], 1))
+   unbuffered = fanout(options.spectators, options.moves, stalled=options.stalled,
+         buffered=False)
+   print "  unbuffered: %.2f writes per move per listener (%.1fx as many)" % (
+         float(unbuffered["writes"]) / max(unbuffered["moves"] * unbuffered["listeners"], 1),
+         float(unbuffered["writes"]) / max(best["writes"], 1))
+   if best["stalled"]:
+      print "  %d stalled listeners, at most %d bytes held back for one, %d disconnected" % (
+            best["stalled"], best["held"], best["aborted"])
+
+
+if __name__ == "__main__":
+   main()
+
+
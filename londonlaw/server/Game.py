@@ -22,7 +22,9 @@ from zope import interface
 
 from londonlaw.common.protocol import *
 from londonlaw.common.map import *
-from londonlaw.common.Pawn import *
+from londonlaw.common.graph import TICKET_CODES, TICKET_NAMES
+from londonlaw.common.GameState import GameState, PAWN_NAMES, TICKET_INDEX, DOUBLE_CODE
+from Pawn import Pawn, PawnError
 from Team import *
 import Protocol, GameRegistry
 
@@ -31,13 +33,22 @@ import Protocol, GameRegistry
 def N_(arg):
    return arg
 
+# the two views of the history kept by getHistoryLines(): the one seen by
+# Mr. X's player and by everyone once the game is over, and the one seen by
+# the detectives, with Mr. X hidden but at surfacing turns
+HISTORY_VISIBLE = "visible"
+HISTORY_MASKED  = "masked"
+
+
 class GameError(Exception):
    def ustr(self):
       return self.args[0]
 
 
 class IGameListener(interface.Interface):
-   def announceHistory(self, history):
+   # 'since' is None, or the (turn, move) position up to which the player
+   # already has the history
+   def announceHistory(self, history, since=None):
       pass
 
    def announceTurnNum(self, num):
@@ -96,8 +107,10 @@ class IGameListener(interface.Interface):
 #             Protocol instance associated with that username, if one exists.
 class Game:
 
-   # start a new game with specified name, of desired type
-   def __init__(self, name, gameType):
+   # start a new game with specified name, of desired type.  'rng' supplies
+   # the random starting positions (pass a seeded random.Random instance to
+   # make a game reproducible).
+   def __init__(self, name, gameType, rng=random):
       self._gameStatus  = GAMESTATUS_NEW
       self._maxPlayers  = 0
       self._pawns       = []
@@ -108,20 +121,23 @@ class Game:
       self._authList    = []
       self._listeners   = {}
       self._nextPawn    = {}
+      self._state       = GameState()
       self._turnNum     = 1
       self._startTime   = time.time()
+      self._revision    = 0
+      # view -> turn -> moves, as in the history replies; built on first use
+      self._historyLines   = None
+      # (view, turn, encoder) -> encoded history reply, for complete turns
+      self._historyEncoded = {}
       
       x_team = Team("Mr. X")
       det_team = Team("Detectives")
       self._addTeam(x_team)
       self._addTeam(det_team)
       
-      x_pawn      = Pawn("X")
-      red_pawn    = Pawn("Red")
-      yellow_pawn = Pawn("Yellow")
-      green_pawn  = Pawn("Green")
-      blue_pawn   = Pawn("Blue")
-      black_pawn  = Pawn("Black")
+      # the pawns are views onto the compact game state, in PAWN_NAMES order
+      x_pawn, red_pawn, yellow_pawn, green_pawn, blue_pawn, black_pawn = \
+            [Pawn(PAWN_NAMES[i], self._state, i) for i in range(len(PAWN_NAMES))]
 
       self._addPawn(x_pawn, x_team)
       self._addPawn(red_pawn, det_team)
@@ -133,7 +149,7 @@ class Game:
       # Starting positions for the players (they can't overlap)
       initial_location_pop = [13, 26, 29, 34, 50, 53, 91, 103, 112, 
                               117, 132, 138, 141, 155, 174, 197, 198]
-      initial_locations = random.sample(initial_location_pop, 6)
+      initial_locations = rng.sample(initial_location_pop, 6)
 
       x_pawn.setTicketAmount("taxi", -1)
       x_pawn.setTicketAmount("bus", -1)
@@ -141,7 +157,8 @@ class Game:
       x_pawn.setTicketAmount("black", 5)
       x_pawn.setTicketAmount("double", 2)
       x_pawn.setLocation(initial_locations[0])
-      self._history = [[("X", repr(x_pawn.getLocation()))]]
+      self._history = [[]]
+      self._addHistory(("X", repr(x_pawn.getLocation())))
 
       curr_pawn = 1
       for pawn in det_team.getPawns():
@@ -149,10 +166,10 @@ class Game:
          pawn.setTicketAmount("bus", 8)
          pawn.setTicketAmount("underground", 4)
          pawn.setLocation(initial_locations[curr_pawn])
-         self._history[0].append((pawn.getName(), repr(pawn.getLocation())))
+         self._addHistory((pawn.getName(), repr(pawn.getLocation())))
          curr_pawn += 1
 
-      self._history.append([])
+      self._addHistoryTurn()
 
       self._nextPawn[x_pawn]      = red_pawn
       self._nextPawn[red_pawn]    = yellow_pawn
@@ -181,8 +198,44 @@ class Game:
          raise GameError("unrecognized game type")
 
 
+   # The formatted history is left out, to be built again when needed.
+   def __getstate__(self):
+      d = self.__dict__.copy()
+      d["_historyLines"]   = None
+      d["_historyEncoded"] = {}
+      return d
+
+   # Games pickled before the compact game state existed hold their own
+   # pawn objects with per-pawn locations and ticket dicts; convert them to
+   # views onto a new GameState, keeping the pawn objects themselves (teams
+   # and the turn order refer to them).
+   def __setstate__(self, d):
+      self.__dict__.update(d)
+      if "_revision" not in d:
+         self._revision = 0
+      self._historyLines   = None
+      self._historyEncoded = {}
+      if "_state" not in d:
+         self._state = GameState()
+         for i in range(len(self._pawns)):
+            oldPawn = self._pawns[i]
+            self._state.setLocation(i, oldPawn.__dict__.pop("_loc"))
+            for ticket, amount in oldPawn.__dict__.pop("_tickets").items():
+               self._state.setTicketAmount(i, TICKET_INDEX[ticket], amount)
+            oldPawn.__class__ = Pawn
+            oldPawn._state    = self._state
+            oldPawn._index    = i
+         self._state.setTurn(self._turnNum)
+         self._state.setCurrent(self._currentPawn.getIndex())
+
+
+   # register an IGameListener; 'player' is the username it reports to, if any
+   def addListener(self, listener, player=None):
+      self._listeners[listener] = player
+      self._modified()
+
    def addListenerForPlayer(self, player):
-      self._listeners[Protocol.ProtocolGameListener(player)] = player
+      self.addListener(Protocol.ProtocolGameListener(player), player)
    
    # add a new player to this game
    def addPlayer(self, player):
@@ -193,6 +246,7 @@ class Game:
             for listener in self._listeners:
                listener.playerRejoin(player)
             self.addListenerForPlayer(player)
+            self._journal("rejoin", player)
          else:
             raise GameError(N_("Username not permitted for this in-progress game."))
       elif self._gameStatus == GAMESTATUS_COMPLETE:
@@ -206,19 +260,26 @@ class Game:
          GameRegistry.registry.getClient(player).setGame(self)
          self._setTeamForPlayer(player, team)
          self.addListenerForPlayer(player)
+         self._journal("join", player, team.getName())
    
    def gameOverEvade(self, winningTeam):
       self._gameStatus = GAMESTATUS_COMPLETE
+      self._modified()
+      self._journal("gameover", winningTeam.getName())
       for listener in self._listeners:
          listener.gameOverEvade(winningTeam)
 
    def gameOverStuck(self, winningTeam):
       self._gameStatus = GAMESTATUS_COMPLETE
+      self._modified()
+      self._journal("gameover", winningTeam.getName())
       for listener in self._listeners:
          listener.gameOverStuck(winningTeam)
 
    def gameOverCaught(self, winningTeam, detective):
       self._gameStatus = GAMESTATUS_COMPLETE
+      self._modified()
+      self._journal("gameover", winningTeam.getName())
       for listener in self._listeners:
          listener.gameOverCaught(winningTeam, detective)
 
@@ -228,6 +289,52 @@ class Game:
    def getHistory(self):
       return self._history
 
+   # The moves of each turn in history 'view' (HISTORY_VISIBLE or
+   # HISTORY_MASKED), formatted as in the history replies.  The lists are
+   # the game's own, appended to as moves are made.
+   def getHistoryLines(self, view):
+      if self._historyLines is None:
+         self._historyLines = {HISTORY_VISIBLE : [], HISTORY_MASKED : []}
+         for turn in range(len(self._history)):
+            self._addHistoryLinesTurn()
+            for move in self._history[turn]:
+               self._addHistoryLines(turn, move)
+      return self._historyLines[view]
+
+   # The history reply for 'turn' in history 'view', encoded by calling
+   # 'encode' with its tokens.  Turns that are over never change, so their
+   # replies are encoded once and kept.
+   def getEncodedHistory(self, view, turn, encode):
+      key  = (view, turn, encode)
+      data = self._historyEncoded.get(key)
+      if data is None:
+         data = encode("history", repr(turn), *self.getHistoryLines(view)[turn])
+         if turn < len(self._history) - 1:
+            self._historyEncoded[key] = data
+      return data
+
+   def _addHistory(self, move):
+      turn = len(self._history) - 1
+      self._history[turn].append(move)
+      if self._historyLines is not None:
+         self._addHistoryLines(turn, move)
+
+   def _addHistoryTurn(self):
+      self._history.append([])
+      if self._historyLines is not None:
+         self._addHistoryLinesTurn()
+
+   def _addHistoryLines(self, turn, move):
+      line = " ".join(move)
+      self._historyLines[HISTORY_VISIBLE][turn].append(line)
+      if move[0] == "X" and turn not in SURFACING_TURNS:
+         line = " ".join(move[:1] + ("-1",) + move[2:])
+      self._historyLines[HISTORY_MASKED][turn].append(line)
+
+   def _addHistoryLinesTurn(self):
+      self._historyLines[HISTORY_VISIBLE].append([])
+      self._historyLines[HISTORY_MASKED].append([])
+
    def getListeners(self):
       return self._listeners
 
@@ -254,6 +361,22 @@ class Game:
    def getPlayers(self):
       return self._players
 
+   # the compact position (pawn locations and tickets) underlying the pawns
+   def getState(self):
+      return self._state
+
+   # the revision counts changes to the game, so the registry can tell
+   # whether it needs writing back to disk
+   def getRevision(self):
+      return self._revision
+
+   # Zobrist hash of the current position, for transposition tables
+   def getPositionHash(self):
+      return self._state.hash
+
+   def getStartTime(self):
+      return self._startTime
+
    def getStatus(self):
       return self._gameStatus
 
@@ -266,16 +389,14 @@ class Game:
    def getType(self):
       return self._gameType
 
+   def hasBots(self):
+      for player in self._players:
+         if player[-5:] == '[bot]':
+            return True
+      return False
+
    def isDetectiveStuck(self, pawn):
-      for route in locToRoutes[pawn.getLocation()]:
-         for ticket in route[1]:
-            if pawn.hasTicket(ticket):
-               # ok, this route is available, but does it cause collisions?
-               team = self._getTeamForPawn(pawn)
-               teammateLocations = [p.getLocation() for p in team.getPawns() if p != pawn]
-               if route[0] not in teammateLocations:
-                  return False
-      return True
+      return self._state.isDetectiveStuck(pawn.getIndex())
 
    def isEveryDetectiveStuck(self):
       for pawn in self._getTeamByName("Detectives").getPawns():
@@ -286,69 +407,72 @@ class Game:
    def isFull(self):
       return self.getNumPlayers() == self.getMaxPlayers()
    
+   # tests for detective collision, map connectivity and ticket inventory
    def isLegalMove(self, pawn, newLoc1, ticket1, newLoc2=None, ticket2=None):
-      # test for detective collision
-      team = self._getTeamForPawn(pawn)
-      if team.getName() == "Detectives":
-         teammateLocations = [p.getLocation() for p in team.getPawns() if p != pawn]
-         if newLoc1 in teammateLocations or newLoc2 in teammateLocations:
-            return False
-      # test for map connectivity and ticket inventory
-      return self.isLegalMoveAux(pawn, newLoc1, ticket1, newLoc2, ticket2)
-
-   def isLegalMoveAux(self, pawn, newLoc1, ticket1, newLoc2=None, ticket2=None):
-      routes = locToRoutes[pawn.getLocation()]
-      for route in routes:
-         if route[0] == newLoc1:
-            if ((ticket1 in route[1] and pawn.hasTicket(ticket1)) or
-                (ticket1 == BLACK and pawn.hasTicket(BLACK))):
-               if newLoc2 is not None:
-                  # temporarily change pawn's state to match the first move,
-                  # so the second move can be tested
-                  previousLocation = pawn.getLocation()
-                  pawn.setLocation(newLoc1)
-                  previousTicketNum = pawn.getTicketAmount(ticket1)
-                  pawn.removeTicket(ticket1)
-                  retVal = self.isLegalMoveAux(pawn, newLoc2, ticket2)
-                  # restore pawn's original state
-                  pawn.setLocation(previousLocation)
-                  pawn.setTicketAmount(ticket1, previousTicketNum)
-               else:
-                  retVal = True
-               return retVal
-      return False
+      return self._state.isLegalMove(pawn.getIndex(), newLoc1, TICKET_CODES.get(ticket1, None),
+            newLoc2, TICKET_CODES.get(ticket2, None))
+
+   # all legal moves for 'pawn', as argument tuples for makeMove():
+   # (dest, ticket) or (dest1, ticket1, dest2, ticket2)
+   def legalMoves(self, pawn, doubles=True):
+      moves = []
+      for move in self._state.legalMoves(pawn.getIndex(), doubles):
+         if len(move) == 3:
+            moves.append((move[1], TICKET_NAMES[move[2]]))
+         else:
+            moves.append((move[1], TICKET_NAMES[move[2]], move[3], TICKET_NAMES[move[4]]))
+      return moves
 
    def isSurfacingTurn(self):
-      return (self._turnNum in (3, 8, 13, 18, 24))
+      return (self._turnNum in SURFACING_TURNS)
 
    # not checked; validate with isLegalMove()
    def makeMove(self, pawn, newLoc1, ticket1, newLoc2=None, ticket2=None):
-      pawn.setLocation(newLoc1)
-      pawn.removeTicket(ticket1)
-      self._history[self._turnNum].append((pawn.getName(), repr(newLoc1), ticket1))
-      for listener in self._listeners:
-         if pawn == self.getPawnByName("X") and not self.isSurfacingTurn() \
-         and self._listeners[listener] != self.getPawnByName("X").getPlayer():
-            reportedLoc1 = -1
+      index = pawn.getIndex()
+      self._modified()
+      self._journal("move", pawn.getName(), newLoc1, ticket1, newLoc2, ticket2)
+      # There are only two views of a move: the one seen by Mr. X's player,
+      # and the one seen by everyone else (including listeners with no
+      # player, unless Mr. X has none either).  Split the listeners into
+      # the two audiences once, and announce each view to each audience.
+      xPawn   = self.getPawnByName("X")
+      xPlayer = xPawn.getPlayer()
+      hiding  = (pawn == xPawn)
+      hidden  = []
+      shown   = []
+      for listener, player in self._listeners.items():
+         if player != xPlayer:
+            hidden.append(listener)
          else:
-            reportedLoc1 = newLoc1
-         listener.pawnMove(self, pawn, (reportedLoc1, ticket1))
+            shown.append(listener)
+      hidden = Protocol.Audience(hidden)
+      shown  = Protocol.Audience(shown)
+      self._state.moveLeg(index, newLoc1, TICKET_INDEX[ticket1])
+      self._addHistory((pawn.getName(), repr(newLoc1), ticket1))
+      trueView   = (newLoc1, ticket1)
+      if hiding and not self.isSurfacingTurn():
+         hiddenView = (-1, ticket1)
+      else:
+         hiddenView = trueView
+      hidden.pawnMove(self, pawn, hiddenView)
+      shown.pawnMove(self, pawn, trueView)
       if not self.testMrXCaught():
          if newLoc2 is not None:
             self._turnNum += 1
-            self._history.append([])
-            pawn.setLocation(newLoc2)
-            pawn.removeTicket(ticket2)
-            pawn.removeTicket("double")
-            self._history[self._turnNum].append((pawn.getName(), repr(newLoc2), ticket2))
-            for listener in self._listeners:
-               listener.announceTurnNum(self._turnNum)
-               if pawn == self.getPawnByName("X") and not self.isSurfacingTurn() \
-               and self._listeners[listener] != self.getPawnByName("X").getPlayer():
-                  reportedLoc2 = -1
-               else:
-                  reportedLoc2 = newLoc2
-               listener.pawnMove(self, pawn, (reportedLoc2, ticket2))
+            self._state.setTurn(self._turnNum)
+            self._addHistoryTurn()
+            self._state.moveLeg(index, newLoc2, TICKET_INDEX[ticket2])
+            self._state.spendTicket(index, DOUBLE_CODE)
+            self._addHistory((pawn.getName(), repr(newLoc2), ticket2))
+            trueView   = (newLoc2, ticket2)
+            if hiding and not self.isSurfacingTurn():
+               hiddenView = (-1, ticket2)
+            else:
+               hiddenView = trueView
+            for audience in (hidden, shown):
+               audience.announceTurnNum(self._turnNum)
+            hidden.pawnMove(self, pawn, hiddenView)
+            shown.pawnMove(self, pawn, trueView)
             if not self.testMrXCaught():
                self._updateTurnInfo()
          else:
@@ -358,10 +482,13 @@ class Game:
       for listener in self._listeners:
          if self._listeners[listener] == player:
             del self._listeners[listener]
+            self._modified()
             break
    
    # remove a player from the game
    def removePlayer(self, player, force_remove=False):
+      self._modified()
+      self._journal("leave", player, force_remove)
       if self._gameStatus == GAMESTATUS_NEW:
          team = self._player2team[player]
          team.removePlayer(player)
@@ -387,23 +514,29 @@ class Game:
    def setStatus(self, status):
       if status in (GAMESTATUS_NEW, GAMESTATUS_INPROGRESS, GAMESTATUS_COMPLETE):
          self._gameStatus = status
+         self._modified()
+         self._journal("status", status)
       else:
          raise GameError("unknown game status")
 
    def setTeam(self, player, teamName):
       team = self._getTeamByName(teamName)
       self._setTeamForPlayer(player, team)
+      self._journal("team", player, teamName)
       
-   def syncPlayer(self, username):
+   def syncPlayer(self, username, since=None):
       for listener in self._listeners:
          if self._listeners[listener] == username:
             listener.announcePawnInfo()
-            listener.announceHistory(self._history)
+            listener.announceHistory(self._history, since)
             listener.announceTurnNum(self._turnNum)
             listener.announceTurn(self._currentPawn)
             break
 
    def testMrXCaught(self):
+      # checked after every move, so ask the compact state first
+      if not self._state.isXCaught():
+         return False
       X = self.getPawnByName("X")
       for detective in self._getTeamByName("Detectives").getPawns():
          if X.getLocation() == detective.getLocation():
@@ -417,10 +550,60 @@ class Game:
          for listener in self._listeners:
             self._startTime  = time.time()
             self._gameStatus = GAMESTATUS_INPROGRESS
+            self._modified()
             listener.gameStart(self)
             listener.announcePawnInfo()
             listener.announceTurnNum(self._turnNum)
             listener.announceTurn(self._currentPawn)
+         if self._gameStatus == GAMESTATUS_INPROGRESS:
+            self._journal("start", self._startTime)
+
+   # Everyone listening to this game is gone (the server stopped without
+   # disconnecting them); remove their players as if they had disconnected.
+   def dropListeners(self):
+      if not self._listeners:
+         return
+      players = [p for p in self._listeners.values() if p is not None]
+      self._listeners = {}
+      self._modified()
+      for player in players:
+         self.removePlayer(player)
+
+   # Apply an event read back from the journal (see Journal.py).  Nobody is
+   # connected while the journal is replayed, so listeners are not told, but
+   # the players they belong to are kept track of for dropListeners().
+   def replayEvent(self, kind, args):
+      listeners = self._listeners
+      self._listeners = {}
+      try:
+         if kind == "join":
+            player, teamName = args
+            self._players.append(player)
+            self._setTeamForPlayer(player, self._getTeamByName(teamName))
+         elif kind == "team":
+            self._setTeamForPlayer(args[0], self._getTeamByName(args[1]))
+         elif kind == "leave":
+            self.removePlayer(args[0], args[1])
+         elif kind == "status":
+            self.setStatus(args[0])
+         elif kind == "start":
+            self._startTime  = args[0]
+            self._gameStatus = GAMESTATUS_INPROGRESS
+            self._modified()
+         elif kind == "move":
+            self.makeMove(self.getPawnByName(args[0]), *args[1:])
+         elif kind == "gameover":
+            if self._gameStatus != GAMESTATUS_COMPLETE:
+               self._gameStatus = GAMESTATUS_COMPLETE
+               self._modified()
+         elif kind != "rejoin":
+            raise GameError("unknown journal event \"%s\"" % kind)
+      finally:
+         self._listeners = listeners
+      if kind in ("join", "rejoin"):
+         self.addListenerForPlayer(args[0])
+      elif kind == "leave":
+         self.removeListenerForPlayer(args[0])
 
    def _addPawn(self, pawn, team):
       self._pawns.append(pawn)
@@ -474,20 +657,34 @@ class Game:
       if oldTeam is not None:
          oldTeam.removePlayer(player)
       self._player2team[player] = team
+      self._modified()
       if oldTeam is not None:
          self._sendTeamUpdate(oldTeam)
       if team is not None:
          self._sendTeamUpdate(team)
 
+   # note a change to the game, to be written back by the registry
+   def _modified(self):
+      self._revision += 1
+      if GameRegistry.registry is not None:
+         GameRegistry.registry.gameChanged(self)
+
+   # record an event in the registry's journal
+   def _journal(self, kind, *args):
+      if GameRegistry.registry is not None:
+         GameRegistry.registry.journalEvent(self, kind, args)
+
    def _updateTurnInfo(self):
       self._currentPawn = self._nextPawn[self._currentPawn]
+      self._state.setCurrent(self._currentPawn.getIndex())
       if self._currentPawn == self.getPawnByName("X"):
          self._turnNum += 1
+         self._state.setTurn(self._turnNum)
          if self._turnNum >= 25:
             self.gameOverEvade(self._getTeamByName("Mr. X"))
             return
          else:
-            self._history.append([])
+            self._addHistoryTurn()
             for listener in self._listeners:
                listener.announceTurnNum(self._turnNum)
       else:
@@ -16,9 +16,10 @@
 
 
 from twisted.python import log
-import sets, shelve, os, time, ConfigParser, gettext
+import sets, os, time, cPickle, whichdb, ConfigParser, gettext
 from londonlaw.common.protocol import *
 from londonlaw.common import util
+import Storage, Journal, Lobby, RateLimit
 
 
 # mark translatable strings for xgettext
@@ -37,22 +38,54 @@ class UserError(Exception):
 # Don't instantiate directly, unless you want to also handle
 # the exception.  Use getHandle().
 #
-# The game registry tracks four items:
-#   * self._games is a dict of open games, keyed by game room name
-#   * self._users is a dict that maps username to (password, last IP address)
+# The game registry tracks three items:
+#   * self._store holds the open games, keyed by game room name, and maps
+#     username to (password, last IP address)
 #   * self._clients is a dict that maps username to protocol instance
 #   * self._unjoinedUsers is a Set of player usernames that are not
 #     currently joined to a game
 #
-# self._games and self._users are persistent structures stored via the
-# 'shelve' module.
+# Changes to the list of games are sent to the unjoined users by
+# self._lobby (see Lobby.py), every 'lobby_update_interval' milliseconds.
 #
-# Avoid trying to access the dictionaries directly.  Since module 'shelve'
-# permits only strings as dictionary keys, there is some UTF-8
-# encoding/decoding going on under the hood.
+# Games and users are persistent, kept in self._store (see Storage.py),
+# which writes changed records back to disk in batches every
+# 'commit_interval' milliseconds, and keeps at most 'game_cache_size' idle
+# games loaded.  Games must call gameChanged() whenever
+# they change, so the change gets written.
+#
+# Game events are also appended to a journal (see Journal.py) as they
+# happen, fsynced every 'journal_sync_interval' milliseconds.  If the server
+# stops without closing the registry, the journal is replayed against the
+# database when it next starts.
+#
+# Databases from older versions were stored with module 'shelve'; they are
+# converted the first time the server starts (or with Migrate.py).
 
 registry = None
 
+DB_FILENAME = "registry_db." + LLAW_VERSION + ".sqlite"
+
+# milliseconds between writes to the database
+DEFAULT_COMMIT_INTERVAL = 500
+
+JOURNAL_FILENAME = "journal." + LLAW_VERSION
+
+# milliseconds between fsyncs of the journal
+DEFAULT_JOURNAL_SYNC_INTERVAL = 50
+
+# milliseconds over which changes to the game list are collected before
+# they are sent to the lobby
+DEFAULT_LOBBY_UPDATE_INTERVAL = 50
+
+# bytes of output held back for a client that is not reading it, above which
+# the client is over its limit and below which it is back under it, and
+# seconds it may stay over its limit before it is disconnected (see
+# Protocol.LLawServerProtocol.flush())
+DEFAULT_OUTPUT_HIGH_WATERMARK = 256 * 1024
+DEFAULT_OUTPUT_LOW_WATERMARK  = 64 * 1024
+DEFAULT_OUTPUT_STALL_TIMEOUT  = 30
+
 class GameRegistrySingleton:
    def __init__(self, dbDir):
       dbDir = os.path.normpath(dbDir)
@@ -64,6 +97,17 @@ class GameRegistrySingleton:
       configFilename = os.path.join(dbDir, "config")
       self._adminPassword  = None
       self._expiration     = None
+      commitInterval       = DEFAULT_COMMIT_INTERVAL
+      cacheSize            = Storage.DEFAULT_CACHE_SIZE
+      lobbyInterval        = DEFAULT_LOBBY_UPDATE_INTERVAL
+      useJournal           = True
+      syncInterval         = DEFAULT_JOURNAL_SYNC_INTERVAL
+      self._outputLimits   = (DEFAULT_OUTPUT_HIGH_WATERMARK,
+                              DEFAULT_OUTPUT_LOW_WATERMARK,
+                              DEFAULT_OUTPUT_STALL_TIMEOUT)
+      rate                 = RateLimit.DEFAULT_RATE
+      burst                = RateLimit.DEFAULT_BURST
+      self._commandCosts   = RateLimit.COMMAND_COSTS.copy()
       if os.path.exists(configFilename):
          f = open(configFilename)
          configParser.readfp(f)
@@ -71,23 +115,80 @@ class GameRegistrySingleton:
             self._adminPassword = configParser.get("server", "admin_password")
          if configParser.has_option("server", "game_expiration"):
             self._expiration = configParser.getint("server", "game_expiration")
+         if configParser.has_option("server", "commit_interval"):
+            commitInterval = configParser.getint("server", "commit_interval")
+         if configParser.has_option("server", "game_cache_size"):
+            cacheSize = configParser.getint("server", "game_cache_size")
+            if cacheSize <= 0:
+               cacheSize = None
+         if configParser.has_option("server", "lobby_update_interval"):
+            lobbyInterval = configParser.getint("server", "lobby_update_interval")
+         if configParser.has_option("server", "journal"):
+            useJournal = configParser.getboolean("server", "journal")
+         if configParser.has_option("server", "journal_sync_interval"):
+            syncInterval = configParser.getint("server", "journal_sync_interval")
+         high, low, timeout = self._outputLimits
+         if configParser.has_option("server", "output_high_watermark"):
+            high = configParser.getint("server", "output_high_watermark")
+         if configParser.has_option("server", "output_low_watermark"):
+            low = configParser.getint("server", "output_low_watermark")
+         if configParser.has_option("server", "output_stall_timeout"):
+            timeout = configParser.getint("server", "output_stall_timeout")
+         self._outputLimits = (high, min(low, high), timeout)
+         if configParser.has_option("server", "rate_limit"):
+            rate = configParser.getfloat("server", "rate_limit")
+         if configParser.has_option("server", "rate_burst"):
+            burst = configParser.getfloat("server", "rate_burst")
+         if configParser.has_section("command_costs"):
+            for verb in configParser.options("command_costs"):
+               self._commandCosts[verb] = configParser.getfloat("command_costs", verb)
          f.close()
-
-      # load in the game and user databases
-      self._games = shelve.open(os.path.join(dbDir, "games_db." + LLAW_VERSION), 
-            "c", writeback = True)
-      self._users = shelve.open(os.path.join(dbDir, "users_db." + LLAW_VERSION), 
-            "c", writeback = True)
+      if rate > 0:
+         self._rateLimit = (rate, burst)
+      else:
+         self._rateLimit = None
+
+      # load in the game and user databases, converting old shelve files
+      dbFilename = os.path.join(dbDir, DB_FILENAME)
+      isNew = not os.path.exists(dbFilename)
+      self._store = Storage.RegistryStorage(dbFilename, commitInterval / 1000.0, cacheSize)
+      if isNew:
+         gamesShelf, usersShelf = findShelves(dbDir)
+         if gamesShelf is not None or usersShelf is not None:
+            log.msg(util.printable(_("Converting old game database")))
+            Storage.migrateShelves(gamesShelf, usersShelf, self._store)
       self._clients       = {}
       self._unjoinedUsers = sets.Set()
+      self._lobby         = Lobby.LobbyPublisher(self, lobbyInterval / 1000.0)
+
+      # recover from a crash, then start journaling
+      self._journal   = None
+      journal         = None
+      records         = []
+      journalFilename = os.path.join(dbDir, JOURNAL_FILENAME)
+      if useJournal or os.path.exists(journalFilename):
+         journal = Journal.MoveJournal(journalFilename, syncInterval / 1000.0)
+         records = journal.getRecoveredRecords()
+      if records or self._store.getMeta("running") == u"1":
+         self._recover(records)
+      if useJournal:
+         self._journal = journal
+         self._store.setJournal(journal)
+      self._store.setMeta("running", 1)
+      self._store.flush()
+      if journal is not None and not useJournal:
+         journal.close()
+         os.remove(journalFilename)
 
 
    def addClient(self, client):
       self._clients[client.getUsername()] = client
 
    def addGame(self, game):
-      if not self._games.has_key(game.getName().encode("utf-8")):
-         self._games[game.getName().encode("utf-8")] = game
+      if not self._store.hasGame(game.getName()):
+         self._store.putGame(game)
+         if self._journal is not None:
+            self._journal.append("add", game.getName(), (cPickle.dumps(game, 2),))
       else:
          raise Exception(N_("Game name in use."))
 
@@ -96,65 +197,112 @@ class GameRegistrySingleton:
 
    def close(self):
       log.msg(util.printable(_("Closing game registry")))
-      self._games.close()
-      self._users.close()
+      self._lobby.cancel()
+      self._store.setMeta("running", 0)
+      self._store.close()
+      if self._journal is not None:
+         self._journal.close()
 
    def deleteUser(self, username):
-      del self._users[username.encode("utf-8")]
+      self._store.getUser(username)
+      self._store.deleteUser(username)
+
+   # called by a game whenever it changes
+   def gameChanged(self, game):
+      self._store.gameChanged(game)
 
    def getClient(self, username):
       return self._clients[username]
 
+   # the clients of those of 'usernames' that are connected
+   def getClients(self, usernames):
+      clients = self._clients
+      return [clients[username] for username in usernames if username in clients]
+
    def getConnectedUserList(self):
       return self._clients.keys()
 
    def getGame(self, gameName):
-      return self._games[gameName.encode("utf-8")]
+      return self._store.getGame(gameName)
+
+   def getGameInfo(self, gameName):
+      return self._store.getGameInfo(gameName)
 
    def getGameList(self):
-      return self._games.values()
+      return self._store.getGames()
+
+   # Summaries of every game (see Storage.GameInfo); unlike getGameList(),
+   # this does not need to load the games.
+   def getGameInfoList(self):
+      return self._store.getCatalogue()
+
+   # the current version of the game list (see Storage.getCatalogueChanges())
+   def getGameListVersion(self):
+      return self._store.getCatalogueVersion()
+
+   # (current version, GameInfos, removed names) describing the changes to
+   # the game list since 'version', or None if they are unknown
+   def getGameListChanges(self, version):
+      return self._store.getCatalogueChanges(version)
+
+   # the number of games currently loaded in memory
+   def getNumLoadedGames(self):
+      return self._store.getNumLoaded()
+
+   # (tokens a second, most tokens saved up) for the commands of each
+   # client, or None if they are not limited (see RateLimit.py)
+   def getRateLimit(self):
+      return self._rateLimit
+
+   # verb -> tokens taken by a command; RateLimit.DEFAULT_COST for others
+   def getCommandCosts(self):
+      return self._commandCosts
+
+   # (high watermark, low watermark, stall timeout) for client output
+   def getOutputLimits(self):
+      return self._outputLimits
 
    def getLastAddress(self, username):
-      return self._users[username.encode("utf-8")][1]
+      return self._store.getUser(username)[1]
 
    def getPassword(self, username):
       if username == "admin":
          return self._adminPassword
       else:
-         return self._users[username.encode("utf-8")][0]
+         return self._store.getUser(username)[0]
 
    def getUnjoinedUsers(self):
       return self._unjoinedUsers
 
    def getUserList(self):
-      users = self._users.keys()
-      decoded = [u.decode("utf-8") for u in users]
-      decoded.sort()
-      return decoded
+      users = self._store.getUserNames()
+      users.sort()
+      return users
 
    def hasGame(self, gameName):
-      return self._games.has_key(gameName.encode("utf-8"))
+      return self._store.hasGame(gameName)
+
+   # called by a game to record an event in the journal
+   def journalEvent(self, game, kind, args):
+      if self._journal is not None and self._store.isStored(game):
+         self._journal.append(kind, game.getName(), args)
 
    def purgeBotGames(self):
       # purge any games that have bots
       log.msg(util.printable(_("Purging games involving AI clients")))
-      games = self._games.values()
-      for game in games:
-         for player in game.getPlayers():
-            if player[-5:] == '[bot]':
-               self.purgeGame(game)
-               break
+      for info in self._store.getCatalogue():
+         if info.hasBots():
+            self.purgeGame(self.getGame(info.getName()))
 
    def purgeExpiredGames(self):
       if self._expiration > 0:
          log.msg(util.printable(_("Purging expired games")))
-         games = self._games.values()
-         for game in games:
-            if (time.time() - game._startTime) / 3600 > self._expiration:
-               self.purgeGame(game)
+         for info in self._store.getCatalogue():
+            if (time.time() - info.getStartTime()) / 3600 > self._expiration:
+               self.purgeGame(self.getGame(info.getName()))
 
    def purgeGame(self, game):
-      if self._games.has_key(game.getName().encode("utf-8")):
+      if self._store.hasGame(game.getName()):
          playerList = game.getPlayers()[:]
          playerConnected = False 
          for player in playerList:
@@ -165,8 +313,7 @@ class GameRegistrySingleton:
             for player in playerList:
                game.removePlayer(player, force_remove=True)
             self.removeGame(game)
-            for p in self.getUnjoinedUsers():
-               self.getClient(p).sendUntagged("gameremoved", game.getName())
+            self.updateLobby(game.getName())
 
    def registerUser(self, username, password, address):
       if username == "admin":
@@ -174,26 +321,69 @@ class GameRegistrySingleton:
             raise PasswordError(N_("admin login disabled.  Consult the user manual to enable administrator access."))
          elif password != self._adminPassword:
             raise PasswordError(N_("Incorrect password."))
-      elif not self._users.has_key(username.encode("utf-8")):
-         self._users[username.encode("utf-8")] = (password, address)
+      elif not self._store.hasUser(username):
+         self._store.putUser(username, password, address)
       else:
          if self._clients.has_key(username):
             raise UserError(N_("That username is in use."))
-         elif password != self._users[username.encode("utf-8")][0]:
+         elif password != self._store.getUser(username)[0]:
             raise PasswordError(N_("Incorrect password."))
          else:
-            self._users[username.encode("utf-8")] = (password, address)
+            self._store.putUser(username, password, address)
 
    def removeClient(self, client):
       if self._clients.has_key(client.getUsername()):
          del self._clients[client.getUsername()]
 
    def removeGame(self, game):
-      if self._games.has_key(game.getName().encode("utf-8")):
-         del self._games[game.getName().encode("utf-8")]
+      if self._store.hasGame(game.getName()):
+         self._store.deleteGame(game.getName())
+         if self._journal is not None:
+            self._journal.append("remove", game.getName())
          log.msg(util.printable(_("Removed game \"%(gamename)s\"") % 
             {"gamename": game.getName()}))
 
+   # Bring the games up to date after a crash: replay the journal 'records'
+   # on top of the database, then remove everyone who was connected from
+   # their games, as if they had disconnected when the server went down.
+   # Only the games the journal names, and those written while someone was
+   # listening, are looked at.  The registry is not set up yet, so games
+   # cannot tell the store they changed; their catalogue entries are
+   # brought up to date here instead.
+   def _recover(self, records):
+      serial   = int(self._store.getMeta("journal_serial", 0))
+      replayed = 0
+      names    = sets.Set([info.getName() for info in self._store.getCatalogue()
+                           if info.hasListeners()])
+      for record in records:
+         num, kind, gameName, args = record
+         if num <= serial:
+            continue
+         try:
+            if kind == "add":
+               self._store.putGame(cPickle.loads(args[0]))
+            elif kind == "remove":
+               if self._store.hasGame(gameName):
+                  self._store.deleteGame(gameName)
+            else:
+               self._store.getGame(gameName).replayEvent(kind, args)
+            names.add(gameName)
+            replayed += 1
+         except Exception, e:
+            log.msg(util.printable(_("Unable to replay journal record %(num)d: %(error)s") %
+               {"num": num, "error": str(e)}))
+      log.msg(util.printable(_("Recovering games: replayed %(num)d journal records") %
+         {"num": replayed}))
+
+      for name in names:
+         if not self._store.hasGame(name):
+            continue
+         game = self._store.getGame(name)
+         game.dropListeners()
+         self._store.gameChanged(game)
+         if game.getNumPlayers() == 0 and game.getStatus() in (GAMESTATUS_NEW, GAMESTATUS_COMPLETE):
+            self._store.deleteGame(name)
+
    def removeUnjoinedUser(self, username):
       try:
          self._unjoinedUsers.remove(username)
@@ -201,16 +391,44 @@ class GameRegistrySingleton:
          pass
 
    def removePassword(self, username):
-      (oldPass, oldIP) = self._users[username.encode("utf-8")]
-      self._users[username.encode("utf-8")] = (None, oldIP)
+      (oldPass, oldIP) = self._store.getUser(username)
+      self._store.putUser(username, None, oldIP)
 
    def setPassword(self, username, password):
-      (oldPass, oldIP) = self._users[username.encode("utf-8")]
-      self._users[username.encode("utf-8")] = (password, oldIP)
+      (oldPass, oldIP) = self._store.getUser(username)
+      self._store.putUser(username, password, oldIP)
+
+   # write out every change now, rather than at the next commit
+   def sync(self):
+      self._store.flush()
+      self.syncJournal()
+
+   # write out the journal now, rather than at the next group commit
+   def syncJournal(self):
+      if self._journal is not None:
+         self._journal.sync()
+
+   # Tell the lobby about a change to a game, or its removal.  Changes are
+   # collected and sent together (see Lobby.py).
+   def updateLobby(self, gameName):
+      self._lobby.gameChanged(gameName)
 
    def unRegisterUser(self, username):
-      if self._users.has_key(username.encode("utf-8")):
-         del self._users[username.encode("utf-8")]
+      if self._store.hasUser(username):
+         self._store.deleteUser(username)
+
+
+# Find the shelve files written by older versions in 'dbDir'.  Returns
+# (games shelf, users shelf), with None for any that do not exist.
+def findShelves(dbDir):
+   shelves = []
+   for prefix in ("games_db.", "users_db."):
+      filename = os.path.join(dbDir, prefix + LLAW_VERSION)
+      if whichdb.whichdb(filename):
+         shelves.append(filename)
+      else:
+         shelves.append(None)
+   return tuple(shelves)
 
 def getHandle(dbDir):
    global registry
@@ -0,0 +1,157 @@
+#  London Law -- a networked manhunting board game
+#  Copyright (C) 2003-2004, 2005 Paul Pelzl
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License, Version 2, as
+#  published by the Free Software Foundation.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# Journal.py
+#
+# An append-only journal of game events (moves, joins, leaves, game over...),
+# so that a server that crashes loses at most a few milliseconds of play
+# rather than everything since the registry database was last written.
+#
+# Each record is (serial, kind, game name, args), with a serial number that
+# increases for the lifetime of the journal.  Records are marshalled and
+# framed as
+#
+#   length (4 bytes) | crc32 (4 bytes) | data
+#
+# so that a record torn by a crash can be recognized and thrown away.
+#
+# Appends are group-committed: records are buffered, and written and fsynced
+# together at most every 'syncInterval' seconds (or as soon as the buffer
+# holds MAX_PENDING bytes).  The registry database is the snapshot the
+# journal is replayed against: when the registry commits, it records the
+# serial of the last journaled event along with the games, and then calls
+# checkpoint() to empty the journal.
+
+import marshal, os, struct, zlib
+from twisted.internet import reactor
+from twisted.python import log
+
+
+class JournalError(Exception):
+   pass
+
+
+_HEADER      = struct.Struct("<Ii")
+MAX_PENDING  = 1 << 16
+
+DEFAULT_SYNC_INTERVAL = 0.05
+
+
+
+# 'syncInterval' is in seconds; with None, records are only written by
+# sync(), checkpoint() and close() (or when the buffer fills up).
+class MoveJournal:
+   def __init__(self, filename, syncInterval=DEFAULT_SYNC_INTERVAL):
+      self._filename     = filename
+      self._syncInterval = syncInterval
+      self._pending      = []
+      self._pendingBytes = 0
+      self._syncCall     = None
+      self.syncs         = 0
+      self.records       = 0
+
+      self._file = open(filename, "ab+")
+      self._file.seek(0)
+      self._recovered = []
+      self._serial    = 0
+      validBytes      = 0
+      data = self._file.read()
+      while validBytes + _HEADER.size <= len(data):
+         length, crc = _HEADER.unpack_from(data, validBytes)
+         start = validBytes + _HEADER.size
+         body  = data[start:start + length]
+         if len(body) < length or zlib.crc32(body) != crc:
+            break
+         try:
+            record = marshal.loads(body)
+         except (ValueError, EOFError, TypeError):
+            break
+         self._recovered.append(record)
+         self._serial = record[0]
+         validBytes   = start + length
+      if validBytes < len(data):
+         log.msg("discarding %d bytes of torn records at the end of the journal"
+               % (len(data) - validBytes))
+         self._file.truncate(validBytes)
+      self._file.seek(0, 2)
+
+   def getFilename(self):
+      return self._filename
+
+   # serial number of the last record appended
+   def getSerial(self):
+      return self._serial
+
+   # Start numbering records after 'serial' (the one recorded by a snapshot
+   # may be later than anything left in the journal).
+   def setSerial(self, serial):
+      self._serial = max(self._serial, serial)
+
+   # The records found in the journal when it was opened, oldest first.
+   def getRecoveredRecords(self):
+      return self._recovered
+
+   def append(self, kind, gameName, args=()):
+      self._serial += 1
+      body = marshal.dumps((self._serial, kind, gameName, tuple(args)), 2)
+      self._pending.append(_HEADER.pack(len(body), zlib.crc32(body)))
+      self._pending.append(body)
+      self._pendingBytes += _HEADER.size + len(body)
+      self.records += 1
+      if self._pendingBytes >= MAX_PENDING:
+         self.sync()
+      elif self._syncCall is None and self._syncInterval is not None:
+         self._syncCall = reactor.callLater(self._syncInterval, self._timedSync)
+      return self._serial
+
+   def _timedSync(self):
+      self._syncCall = None
+      try:
+         self.sync()
+      except (IOError, OSError), e:
+         log.msg("failed to write the journal: " + str(e))
+
+   # Write and fsync everything appended so far.
+   def sync(self):
+      if self._syncCall is not None and self._syncCall.active():
+         self._syncCall.cancel()
+      self._syncCall = None
+      if not self._pending:
+         return
+      self._file.write("".join(self._pending))
+      self._pending      = []
+      self._pendingBytes = 0
+      self._file.flush()
+      os.fsync(self._file.fileno())
+      self.syncs += 1
+
+   # Everything appended so far is safely in the snapshot; empty the journal.
+   def checkpoint(self):
+      if self._syncCall is not None and self._syncCall.active():
+         self._syncCall.cancel()
+      self._syncCall     = None
+      self._pending      = []
+      self._pendingBytes = 0
+      self._recovered    = []
+      self._file.seek(0)
+      self._file.truncate(0)
+      self._file.flush()
+
+   def close(self):
+      self.sync()
+      self._file.close()
+
+
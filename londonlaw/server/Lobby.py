@@ -0,0 +1,89 @@
+#  London Law -- a networked manhunting board game
+#  Copyright (C) 2003-2004, 2005 Paul Pelzl
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License, Version 2, as
+#  published by the Free Software Foundation.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# Lobby.py
+#
+# Keeps the players in the lobby (the unjoined users) up to date with the
+# list of games.  Rather than sending a line to everyone in the lobby for
+# every join, leave or new game, changes are collected for 'interval'
+# seconds and then published together: one 'gameinfo' line with the latest
+# state of each game that changed, or one 'gameremoved' line if it is gone.
+# Each line is encoded once, and each lobby client gets all of them in a
+# single write.
+
+from twisted.internet import reactor
+from londonlaw.common import util
+
+
+DEFAULT_INTERVAL = 0.05
+
+
+
+class LobbyPublisher:
+   # 'registry' is the GameRegistrySingleton the games and clients come from
+   def __init__(self, registry, interval=DEFAULT_INTERVAL):
+      self._registry    = registry
+      self._interval    = interval
+      # game name -> order in which the games first changed
+      self._changed     = {}
+      self._publishCall = None
+      self.updates      = 0
+      self.lines        = 0
+
+   # Note a change to the game named 'gameName', or its removal.
+   def gameChanged(self, gameName):
+      if gameName not in self._changed:
+         self._changed[gameName] = len(self._changed)
+      if self._publishCall is None:
+         self._publishCall = reactor.callLater(self._interval, self.publish)
+
+   # Send the collected changes to the lobby now.
+   def publish(self):
+      if self._publishCall is not None and self._publishCall.active():
+         self._publishCall.cancel()
+      self._publishCall = None
+      if not self._changed:
+         return
+      names = self._changed.keys()
+      names.sort(key=self._changed.get)
+      self._changed = {}
+
+      registry = self._registry
+      lines = []
+      for name in names:
+         if registry.hasGame(name):
+            info = registry.getGameInfo(name)
+            lines.append(str(util.join_tokens("*", "gameinfo", name.encode("utf-8"),
+                  info.getStatus(), info.getType(), str(info.getNumPlayers()))))
+         else:
+            lines.append(str(util.join_tokens("*", "gameremoved", name.encode("utf-8"))))
+
+      for username in registry.getUnjoinedUsers():
+         try:
+            client = registry.getClient(username)
+         except KeyError:
+            continue
+         client.sendLines(lines)
+         self.updates += 1
+         self.lines   += len(lines)
+
+   def cancel(self):
+      if self._publishCall is not None and self._publishCall.active():
+         self._publishCall.cancel()
+      self._publishCall = None
+      self._changed     = {}
+
+
@@ -0,0 +1,73 @@
+#  London Law -- a networked manhunting board game
+#  Copyright (C) 2003-2004, 2005 Paul Pelzl
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License, Version 2, as
+#  published by the Free Software Foundation.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# Migrate.py
+#
+# Convert the shelve game and user databases of older servers into the
+# sqlite3 database used by GameRegistry.  The server does this by itself when
+# it starts without a database; this tool does it by hand, e.g. to convert
+# a copy of a database, or to redo a conversion.  The shelve files are left
+# untouched.  Usage:
+#
+#   $ python -m londonlaw.server.Migrate --dbdir ~/.londonlaw/server
+
+import os, sys
+from optparse import OptionParser
+
+from londonlaw.server import GameRegistry, Storage
+
+
+def main(argv=None):
+   parser = OptionParser(usage="%prog [options]")
+   parser.add_option("-D", "--dbdir", dest="dbdir",
+         default=os.path.expanduser("~/.londonlaw/server"),
+         help="directory holding the server databases", metavar="DBDIR")
+   parser.add_option("-o", "--output", dest="output", default=None,
+         help="write the new database to FILE (default: the server's database in DBDIR)",
+         metavar="FILE")
+   parser.add_option("-f", "--force", dest="force", action="store_true", default=False,
+         help="replace the new database if it already exists")
+   (options, args) = parser.parse_args(argv)
+   if args:
+      parser.error("unexpected arguments")
+
+   gamesShelf, usersShelf = GameRegistry.findShelves(options.dbdir)
+   if gamesShelf is None and usersShelf is None:
+      sys.exit("no shelve databases found in %s" % options.dbdir)
+
+   output = options.output
+   if output is None:
+      output = os.path.join(options.dbdir, GameRegistry.DB_FILENAME)
+   if os.path.exists(output):
+      if not options.force:
+         sys.exit("%s already exists; use --force to replace it" % output)
+      os.remove(output)
+
+   storage = Storage.RegistryStorage(output, None)
+   try:
+      numGames, numUsers = Storage.migrateShelves(gamesShelf, usersShelf, storage)
+      storage.close()
+   except:
+      storage.close()
+      os.remove(output)
+      raise
+   print "converted %d games and %d users into %s" % (numGames, numUsers, output)
+
+
+if __name__ == "__main__":
+   main()
+
+
@@ -15,47 +15,55 @@
 #  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 
 
-class PawnError(Exception):
-   pass
+# Server-side pawns.  These hold no position of their own; a Pawn is a named
+# view onto one slot of the game's GameState, so the Pawn objects handed to
+# teams, listeners and the protocol always agree with the compact state.
 
+from londonlaw.common import Pawn as CommonPawn
+from londonlaw.common.GameState import TICKET_INDEX, GameStateError
 
-class Pawn(object):
-   def __init__(self, name):
-      self._loc = None
-      self._name = name
+
+PawnError = CommonPawn.PawnError
+
+
+class Pawn(CommonPawn.Pawn):
+   def __init__(self, name, state, index):
+      self._name   = name
       self._player = None
-      self._tickets = {}
-   
+      self._state  = state
+      self._index  = index
+
+   def getIndex(self):
+      return self._index
+
    def getLocation(self):
-      return self._loc
-   
-   def getName(self):
-      return self._name
-   
-   def getPlayer(self):
-      return self._player
-   
+      return self._state.locations[self._index]
+
    def getTicketAmount(self, ticket):
-      return self._tickets.get(ticket, 0)
-      
+      code = TICKET_INDEX.get(ticket, None)
+      if code is None:
+         return 0
+      return self._state.getTicketAmount(self._index, code)
+
    def hasTicket(self, ticket):
-      return self._tickets.get(ticket, 0) != 0
-   
+      return self.getTicketAmount(ticket) != 0
+
    def removeTicket(self, ticket):
-      amount = self._tickets.get(ticket, 0)
-      if amount == 0:
+      code = TICKET_INDEX.get(ticket, None)
+      if code is None:
          raise PawnError("tried to remove non-existant ticket " + str(ticket))
-      if amount != -1:
-         # amount -1 implies infinite tickets
-         self._tickets[ticket] = amount - 1
-   
+      try:
+         self._state.spendTicket(self._index, code)
+      except GameStateError, e:
+         raise PawnError(str(e))
+
    def setLocation(self, loc):
-      self._loc = loc
-   
-   def setPlayer(self, player):
-      self._player = player
-   
+      self._state.setLocation(self._index, loc)
+
    def setTicketAmount(self, ticket, amount):
-      self._tickets[ticket] = amount
+      code = TICKET_INDEX.get(ticket, None)
+      if code is None:
+         raise PawnError("unknown ticket " + str(ticket))
+      self._state.setTicketAmount(self._index, code, amount)
 
 # arch-tag: 90f1d631-c439-4e68-8d8d-d7bd62f6f7d5
@@ -16,15 +16,115 @@
 
 
 
-from twisted.internet import protocol, reactor
+from twisted.internet import protocol, reactor, interfaces
 from twisted.protocols import basic
 from twisted.python import log
-import re, shlex, sys, gettext, os
-from londonlaw.common import util
+import re, sys, gettext, os, time, collections
+from londonlaw.common import dispatch, frames, util
 from londonlaw.aiclients import ai_list
 from londonlaw.common.protocol import *
 from Game import *
-import GameRegistry
+import GameRegistry, RateLimit
+
+
+# Lines sent to a client are buffered, and everything a client was sent
+# while handling one command or game event goes out in a single
+# transport.writeSequence() at the end of the reactor turn (flushOutput()).
+_pendingClients = []
+_flushCall      = None
+
+def _scheduleFlush():
+   global _flushCall
+   if _flushCall is None:
+      _flushCall = reactor.callLater(0, flushOutput)
+
+# Write the output buffered for every client now.
+def flushOutput():
+   global _flushCall
+   if _flushCall is not None and _flushCall.active():
+      _flushCall.cancel()
+   _flushCall = None
+   clients = _pendingClients[:]
+   del _pendingClients[:]
+   for client in clients:
+      client.flush()
+
+
+# Clients whose transport has stopped taking their output, and the most
+# output that any client has had held back (see LLawServerProtocol.flush()).
+_stalledClients = set()
+_peakHeldBytes  = 0
+
+# (client, bytes of output held back, seconds since its transport stopped
+# taking output) for the stalled client with the most output held back, or
+# None if no client is stalled
+def getSlowestConnection():
+   slowest = None
+   for client in _stalledClients:
+      if slowest is None or client.getHeldBytes() > slowest.getHeldBytes():
+         slowest = client
+   if slowest is None:
+      return None
+   return (slowest, slowest.getHeldBytes(), slowest.getStalledTime())
+
+def getPeakHeldBytes():
+   return _peakHeldBytes
+
+
+# Translations loaded by the "language" command, by language code, shared
+# by every client asking for the same language (None where there is none).
+# Codes come from clients, so the cache is emptied when it fills up.
+_MAX_TRANSLATIONS = 64
+_translations     = {}
+
+def getTranslation(language):
+   try:
+      return _translations[language]
+   except KeyError:
+      pass
+   t = None
+   # first try searching the installed locale dir, then the local one
+   for localedir in (None, "locale"):
+      try:
+         t = gettext.translation("londonlaw", localedir, languages=[language])
+         break
+      except Exception:
+         pass
+   if len(_translations) >= _MAX_TRANSLATIONS:
+      _translations.clear()
+   _translations[language] = t
+   return t
+
+
+# Registered with each client's transport as a streaming producer, which the
+# transport pauses when its write buffer fills up and resumes once it has
+# been written.  (The protocol can not be its own producer, because
+# LineReceiver stops and starts reading with pauseProducing() and
+# resumeProducing().)
+class OutputProducer:
+   __implements__ = (interfaces.IPushProducer,)
+
+   def __init__(self, client):
+      self._client = client
+
+   def pauseProducing(self):
+      self._client.pauseOutput()
+
+   def resumeProducing(self):
+      self._client.resumeOutput()
+
+   def stopProducing(self):
+      pass
+
+
+# A block of output that can be dropped, and sent again by calling
+# resend[0](*resend[1]), if the client falls behind.
+class CatchUp(str):
+   resend = None
+
+# how much held back output is written at a time when a transport resumes
+_RESUME_CHUNK = 16384
+
 
 
 class ServerError(Exception):
@@ -51,13 +151,41 @@ Client states:
    "admin"   : client is an administrator
 """
 
-class LLawServerProtocol(basic.LineOnlyReceiver):
+class LLawServerProtocol(basic.LineReceiver):
    def __init__(self):
       self._game            = None
       self._state           = "init"
       self._username        = None
       self._password        = None
       self._voteStart       = False
+      # buffered output (lines and delimiters, or frames), or None if there
+      # is none
+      self._output          = None
+      # output held back while the transport is not taking it, and the
+      # catch-up replies dropped from it, as (method, args), to be sent
+      # again once the client is back under its low watermark
+      self._held            = collections.deque()
+      self._heldBytes       = 0
+      self._writePaused     = False
+      self._stalledSince    = None
+      self._overSince       = None
+      # the call that disconnects the client if it stays over its high
+      # watermark for the stall timeout
+      self._stallCall       = None
+      self._dropped         = []
+      self._outputLimits    = (GameRegistry.DEFAULT_OUTPUT_HIGH_WATERMARK,
+                               GameRegistry.DEFAULT_OUTPUT_LOW_WATERMARK,
+                               GameRegistry.DEFAULT_OUTPUT_STALL_TIMEOUT)
+      # the client's token bucket (see RateLimit.py), or None if its
+      # commands are not limited, and the call that starts reading from it
+      # again after it has run out
+      self._bucket          = None
+      self._commandCosts    = RateLimit.COMMAND_COSTS
+      self._unthrottleCall  = None
+      # protocol version 3: frames rather than lines (see frames.py), and
+      # the frames received but not yet handled while reading is paused
+      self._frameReader     = None
+      self._frames          = collections.deque()
       # server messages to remote clients are in english by default,
       # unless the client uses the 'language' command
       self.trans = gettext.NullTranslations()
@@ -90,11 +218,8 @@ class LLawServerProtocol(basic.LineOnlyReceiver):
          raise IllegalCommand(self.trans.ugettext("Insufficient arguments."))
       else:
          self.sendOk(tag)
-         for player in self._game.getPlayers():
-            try:
-               GameRegistry.registry.getClient(player).sendUntagged("chatall", self._username.encode("utf-8"), args[0])
-            except KeyError:
-               pass
+         sendToClients(GameRegistry.registry.getClients(self._game.getPlayers()),
+               "chatall", self._username.encode("utf-8"), args[0])
 
 
    def cmd_chatall_playing(self, tag, args):
@@ -110,11 +235,8 @@ class LLawServerProtocol(basic.LineOnlyReceiver):
          raise IllegalCommand(self.trans.ugettext("Insufficient arguments."))
       else:
          self.sendOk(tag)
-         for player in self._game.getTeam(self._username).getPlayers():
-            try:
-               GameRegistry.registry.getClient(player).sendUntagged("chatteam", self._username.encode("utf-8"), args[0])
-            except KeyError:
-               pass
+         sendToClients(GameRegistry.registry.getClients(self._game.getTeam(self._username).getPlayers()),
+               "chatteam", self._username.encode("utf-8"), args[0])
 
 
    def cmd_deletegame_admin(self, tag, args):
@@ -155,7 +277,7 @@ class LLawServerProtocol(basic.LineOnlyReceiver):
          # if this player was connected, boot him out
          try:
             client = GameRegistry.registry.getClient(username)
-            client.transport.loseConnection()
+            client.disconnect()
          except KeyError:
             pass
          self.sendOk(tag)
@@ -169,7 +291,7 @@ class LLawServerProtocol(basic.LineOnlyReceiver):
             client = GameRegistry.registry.getClient(args[0].decode("utf-8"))
          except KeyError:
             raise DeniedCommand(self.trans.ugettext("No such user is connected."))
-         client.transport.loseConnection()
+         client.disconnect()
          self.sendOk(tag)
 
 
@@ -223,19 +345,11 @@ class LLawServerProtocol(basic.LineOnlyReceiver):
       if args == []:
          raise IllegalCommand(self.trans.ugettext("Insufficient arguments."))
       else:
-         try:
-            # first try searching the installed locale dir
-            t = gettext.translation("londonlaw", languages=[args[0]])
-            self.trans = t
-            self.sendOk(tag)
-         except:
-            try:
-               # if that fails, try the local locale dir
-               t = gettext.translation("londonlaw", "locale", languages=[args[0]])
-               self.trans = t
-               self.sendOk(tag)
-            except:
-               raise DeniedCommand(self.trans.ugettext("Unsupported language code."))
+         t = getTranslation(args[0])
+         if t is None:
+            raise DeniedCommand(self.trans.ugettext("Unsupported language code."))
+         self.trans = t
+         self.sendOk(tag)
 
 
    def cmd_profile_admin(self, tag, args):
@@ -254,20 +368,23 @@ class LLawServerProtocol(basic.LineOnlyReceiver):
 
 
    def cmd_history_endgame(self, tag, args):
+      since = self._historyPosition(args)
       self.sendOk(tag)
-      self.sendHistory()
+      self.sendHistory(since)
       
 
    def cmd_history_playing(self, tag, args):
+      since = self._historyPosition(args)
       self.sendOk(tag)
-      self.sendHistory()
+      self.sendHistory(since)
 
 
    def cmd_join_player(self, tag, args):
       if args == []:
          raise IllegalCommand(self.trans.ugettext("Insufficient arguments."))
       else:
-         name = args[0].decode("utf-8")
+         name  = args[0].decode("utf-8")
+         since = self._historyPosition(args[1:])
          try:
             g = GameRegistry.registry.getGame(name)
             g.addPlayer(self._username)
@@ -276,12 +393,10 @@ class LLawServerProtocol(basic.LineOnlyReceiver):
             if g.getStatus() == GAMESTATUS_NEW:
                self._state = "joined"
                # number of players in this game needs to be updated
-               for p in GameRegistry.registry.getUnjoinedUsers():
-                  GameRegistry.registry.getClient(p).sendUntagged("gameinfo", g.getName().encode("utf-8"), 
-                        g.getStatus(), g.getType(), str(g.getNumPlayers()))
+               GameRegistry.registry.updateLobby(g.getName())
             else:
                self._state = "playing"
-               self._game.syncPlayer(self._username)
+               self._game.syncPlayer(self._username, since)
          except KeyError:
             raise DeniedCommand(self.trans.ugettext("Unrecognized game name."))
          except TeamError, e:
@@ -295,9 +410,7 @@ class LLawServerProtocol(basic.LineOnlyReceiver):
       self._state     = "player"
       self._voteStart = False
       # number of players in this game needs to be updated
-      for p in GameRegistry.registry.getUnjoinedUsers():
-         GameRegistry.registry.getClient(p).sendUntagged("gameinfo", self._game.getName().encode("utf-8"), 
-               self._game.getStatus(), self._game.getType(), str(self._game.getNumPlayers()))
+      GameRegistry.registry.updateLobby(self._game.getName())
       GameRegistry.registry.addUnjoinedUser(self._username)
       self.sendOk(tag)
       # kill the game if this was the last player
@@ -325,11 +438,30 @@ class LLawServerProtocol(basic.LineOnlyReceiver):
       self.cmd_listgames_player(tag, args)
 
 
+   # With a version argument, only the changes since that version are sent
+   # if possible (see readme.protocol).
    def cmd_listgames_player(self, tag, args):
-      for g in GameRegistry.registry.getGameList():
+      registry = GameRegistry.registry
+      changes  = None
+      if len(args) > 0:
+         changes = registry.getGameListChanges(args[0])
+      if changes is None:
+         version = registry.getGameListVersion()
+         games   = registry.getGameInfoList()
+         removed = []
+         kind    = "full"
+      else:
+         version, games, removed = changes
+         kind    = "delta"
+      for g in games:
          self.sendUntagged("gameinfo", g.getName().encode("utf-8"), 
                g.getStatus().encode("utf-8"), g.getType().encode("utf-8"), str(g.getNumPlayers()))
-      self.sendOk(tag)
+      for name in removed:
+         self.sendUntagged("gameremoved", name.encode("utf-8"))
+      if len(args) > 0:
+         self.sendOk(tag, version, kind)
+      else:
+         self.sendOk(tag)
 
 
    def cmd_listplayers_default(self, tag, args):
@@ -380,9 +512,7 @@ class LLawServerProtocol(basic.LineOnlyReceiver):
                GameRegistry.registry.removeUnjoinedUser(self._username)
                log.msg(util.printable(_("New game \"%(gamename)s\" created by player \"%(playername)s\"") %
                      {"gamename": name, "playername": self._username}))
-               for p in GameRegistry.registry.getUnjoinedUsers():
-                  GameRegistry.registry.getClient(p).sendUntagged("gameinfo", g.getName().encode("utf-8"), 
-                        g.getStatus(), g.getType(), str(g.getNumPlayers()))
+               GameRegistry.registry.updateLobby(g.getName())
             except GameError, e:
                raise DeniedCommand(self.trans.ugettext(e.ustr()))
 
@@ -435,6 +565,13 @@ class LLawServerProtocol(basic.LineOnlyReceiver):
          if args[0] == PROTOCOL_VERSION:
             self._state = "compat"
             self.sendOk(tag)
+         elif args[0] == BINARY_PROTOCOL_VERSION:
+            self._state = "compat"
+            self.sendOk(tag)
+            # the "ok" is the last line; from here on both sides send frames,
+            # no longer than the lines of the clients they are relayed to
+            self._frameReader = frames.FrameReader(self.MAX_LENGTH)
+            self.setRawMode()
          elif args[0].isdigit():
             raise IllegalCommand(self.trans.ugettext("Incompatible protocol version."))
          else:
@@ -462,6 +599,15 @@ class LLawServerProtocol(basic.LineOnlyReceiver):
          raise IllegalCommand(self.trans.ugettext("Insufficient arguments."))
 
 
+   def cmd_slowest_admin(self, tag, args):
+      slowest = getSlowestConnection()
+      if slowest is not None:
+         client, held, stalled = slowest
+         self.sendUntagged("slowest", client.describe().encode("utf-8"), repr(held),
+               "%.1f" % stalled)
+      self.sendOk(tag)
+
+
    def cmd_setpassword_admin(self, tag, args):
       if len(args) < 2:
          raise IllegalCommand(self.trans.ugettext("Insufficient arguments."))
@@ -507,13 +653,31 @@ class LLawServerProtocol(basic.LineOnlyReceiver):
       self.sendTokens(tag, "turn", self._game.getCurrentPawn().getName())
 
 
+   def connectionMade(self):
+      if GameRegistry.registry is not None:
+         self._outputLimits = GameRegistry.registry.getOutputLimits()
+         self._commandCosts = GameRegistry.registry.getCommandCosts()
+         rateLimit = GameRegistry.registry.getRateLimit()
+         if rateLimit is not None:
+            self._bucket = RateLimit.TokenBucket(*rateLimit)
+      self.transport.registerProducer(OutputProducer(self), True)
+
+
    def connectionLost(self, reason):
+      self._output    = None
+      self._held.clear()
+      self._heldBytes = 0
+      self._dropped   = []
+      self._frames.clear()
+      _stalledClients.discard(self)
+      self._cancelStallCall()
+      if self._unthrottleCall is not None and self._unthrottleCall.active():
+         self._unthrottleCall.cancel()
+      self._unthrottleCall = None
       if self._game is not None:
          self._game.removePlayer(self._username)
          # number of players in this game needs to be updated
-         for p in GameRegistry.registry.getUnjoinedUsers():
-            GameRegistry.registry.getClient(p).sendUntagged("gameinfo", self._game.getName().encode("utf-8"), 
-                  self._game.getStatus(), self._game.getType(), str(self._game.getNumPlayers()))
+         GameRegistry.registry.updateLobby(self._game.getName())
          # kill the game if this was the last player
          self.testRemoveGame(self._game)
       if self._username is not None:
@@ -560,7 +724,38 @@ class LLawServerProtocol(basic.LineOnlyReceiver):
 
    def lineReceived(self, line):
       try:
-         tokens = shlex.split(line)
+         tokens = util.split_tokens(line)
+      except ValueError, e:
+         log.msg("bad message from client: " + str(e))
+         self.sendBad("-", str(e))
+         return
+      self.tokensReceived(tokens)
+
+
+   # Frames, in protocol version 3.  Like lines, they are left unhandled
+   # while reading is paused (see throttle()).
+   def rawDataReceived(self, data):
+      try:
+         self._frames.extend(self._frameReader.feed(data))
+      except frames.FrameError, e:
+         log.msg("bad frame from client: " + str(e))
+         self.disconnect()
+         return
+      while self._frames and not self.paused:
+         if self.transport.disconnecting:
+            return
+         opcode, payload = self._frames.popleft()
+         try:
+            tokens = frames.decode(opcode, payload)
+         except ValueError, e:
+            log.msg("bad message from client: " + str(e))
+            self.sendBad("-", str(e))
+            continue
+         self.tokensReceived(tokens)
+
+
+   def tokensReceived(self, tokens):
+      try:
          if len(tokens) == 0:
             raise ServerError(self.trans.ugettext("Insufficient arguments."))
          if len(tokens[0]) > 0 and tokens[0][0] == "#":
@@ -577,16 +772,20 @@ class LLawServerProtocol(basic.LineOnlyReceiver):
          if not (re.match(r"^#\d+$", tag) or tag == "-"):
             raise ServerError("illegal tag")
 
-         f = getattr(self, "".join(("cmd_", command, "_", self._state)), None)
-         if f is None:
-            # Try a catch-all method for the command
-            f = getattr(self, "".join(("cmd_", command, "_default")), None)
+         if self._bucket is not None and self._state != "admin":
+            cost = self._commandCosts.get(command, RateLimit.DEFAULT_COST)
+            if not self._bucket.take(cost):
+               self.throttle(cost)
+               self.sendNo(tag, self.trans.ugettext("Too many commands; please slow down.").encode("utf-8"))
+               return
+
+         f = dispatch.getTable(self.__class__, "cmd_").lookup(self._state, command)
          if f is None:
             self.sendBad(tag, self.trans.ugettext("Unrecognized command.").encode("utf-8"))
             return
          
          try:
-            f(tag, arguments)
+            f(self, tag, arguments)
          except IllegalCommand, e:
             self.sendBad(tag, e.ustr().encode("utf-8"))
          except DeniedCommand, e:
@@ -599,27 +798,78 @@ class LLawServerProtocol(basic.LineOnlyReceiver):
          self.sendBad("-", str(e))
 
 
+   # Stop reading from a client that has run out of tokens until it has
+   # enough for a command costing 'cost', so that a client sending commands
+   # as fast as it can is not given more of the server's time than one
+   # keeping to its limit.
+   def throttle(self, cost):
+      if self._unthrottleCall is not None:
+         return
+      self.pauseProducing()
+      self._unthrottleCall = reactor.callLater(self._bucket.waitTime(cost), self._unthrottle)
+
+   def _unthrottle(self):
+      self._unthrottleCall = None
+      if not self.transport.disconnecting:
+         self.resumeProducing()
+         # resumeProducing() only goes on with data that has not been
+         # split into frames yet
+         if self._frameReader is not None:
+            self.rawDataReceived("")
+
+
    def sendBad(self, tag, message=None):
       if message:
          self.sendTokens(tag, "bad", message)
       else:
          self.sendTokens(tag, "bad")
 
-   def sendHistory(self):
-      hist = self._game.getHistory()
-      for turn in range(len(hist)):
-         moves = []
-         for move in hist[turn]:
-            # hide Mr. X's location as appropriate
-            if move[0] == "X" and self._state == "playing" \
-            and self._username != self._game.getPawnByName("X").getPlayer() \
-            and not turn in (3, 8, 13, 18, 24):
-               adjustedMove = move[:1] + ("-1",) + move[2:]
-            else:
-               adjustedMove = move
-            moves.append(" ".join(adjustedMove))
-         if moves != []:
-            self.sendUntagged("history", repr(turn), *moves)
+   # The (turn, move) position given as the arguments of "history" or
+   # "join", or None if there are none.
+   def _historyPosition(self, args):
+      if len(args) < 2:
+         return None
+      try:
+         position = (int(args[0]), int(args[1]))
+      except ValueError:
+         raise IllegalCommand(self.trans.ugettext("Invalid history position."))
+      if position[0] < 0 or position[1] < 0:
+         raise IllegalCommand(self.trans.ugettext("Invalid history position."))
+      return position
+
+   # Send the game history.  If 'since' is a (turn, move) position, the
+   # client already has the moves before it, and is sent a "history since"
+   # line and only the moves after it--or, if that position does not fit
+   # the history it would be sent, the whole history from "since 0 0".
+   def sendHistory(self, since=None):
+      self._sendCatchUp(self._writeHistory, since)
+
+   def _writeHistory(self, since):
+      # hide Mr. X's location as appropriate
+      if self._state == "playing" \
+      and self._username != self._game.getPawnByName("X").getPlayer():
+         view = HISTORY_MASKED
+      else:
+         view = HISTORY_VISIBLE
+      lines = self._game.getHistoryLines(view)
+      first, skip = 0, 0
+      if since is not None:
+         first, skip = since
+         # moves seen while the game was on were masked, so once it is
+         # over everything is resent
+         if self._state != "playing" or first >= len(lines) or skip > len(lines[first]):
+            first, skip = 0, 0
+         self.sendUntagged("history", "since", repr(first), repr(skip))
+      if self._frameReader is not None:
+         encode = encodeHistoryFrame
+      else:
+         encode = encodeHistoryLine
+      for turn in range(first, len(lines)):
+         if turn == first and skip > 0:
+            if skip < len(lines[turn]):
+               self.sendUntagged("history", repr(turn), *lines[turn][skip:])
+         elif lines[turn] != []:
+            self._queue(self._game.getEncodedHistory(view, turn, encode))
       self.sendUntagged("history", "end")
 
    def sendNo(self, tag, message=None):
@@ -631,7 +881,170 @@ class LLawServerProtocol(basic.LineOnlyReceiver):
    def sendOk(self, tag, *tokens):
       self.sendTokens(tag, "ok", *tokens)
 
+   # Buffer 'data' to be written at the end of the reactor turn.
+   def _queue(self, data):
+      if self._output is None:
+         self._output = []
+         _pendingClients.append(self)
+         _scheduleFlush()
+      self._output.append(data)
+
+   def sendLine(self, line):
+      if self._frameReader is not None:
+         self._queue(frames.encodeText(line))
+      else:
+         self._queue(line)
+         self._queue(self.delimiter)
+
+   # send several already encoded lines
+   def sendLines(self, lines):
+      for line in lines:
+         self.sendLine(line)
+
+   # Send an untagged message that other clients are sent too, encoding it
+   # only once for all of them.
+   def sendShared(self, *tokens):
+      if self._frameReader is not None:
+         self._queue(encodeUntaggedFrame(*tokens))
+      else:
+         self.sendLine(encodeUntagged(*tokens))
+
+   # whether the client uses protocol version 3 frames
+   def isFramed(self):
+      return self._frameReader is not None
+
+   # send an already encoded frame (to a client using frames)
+   def sendFrame(self, frame):
+      self._queue(frame)
+
+   # Write the buffered output now.  While the transport is not taking it
+   # (its producer is paused), the output is held back instead.  A client
+   # with more held back than its high watermark has the catch-up replies
+   # (history and pawn information) dropped from it, to be sent again when
+   # it is back under its low watermark; if it stays over its high
+   # watermark for longer than the stall timeout, it is disconnected
+   # (_stallTimeout()).
+   def flush(self):
+      output, self._output = self._output, None
+      if not output:
+         return
+      if not self._writePaused and not self._held:
+         self.transport.writeSequence(output)
+         return
+      global _peakHeldBytes
+      for data in output:
+         self._held.append(data)
+         self._heldBytes += len(data)
+      _peakHeldBytes = max(_peakHeldBytes, self._heldBytes)
+      high, low, timeout = self._outputLimits
+      if self._heldBytes > high and self._overSince is None:
+         self._overSince = time.time()
+         self._dropCatchUp()
+         self._stallCall = reactor.callLater(timeout, self._stallTimeout)
+         log.msg(util.printable(_("\"%(client)s\" is not reading its output")
+            % {"client": self.describe()}))
+
+   def _stallTimeout(self):
+      self._stallCall = None
+      log.msg(util.printable(_("Disconnecting \"%(client)s\", which stopped reading its output")
+         % {"client": self.describe()}))
+      self._held.clear()
+      self._heldBytes = 0
+      self.transport.abortConnection()
+
+   def _cancelStallCall(self):
+      if self._stallCall is not None and self._stallCall.active():
+         self._stallCall.cancel()
+      self._stallCall = None
+
+   def _dropCatchUp(self):
+      kept = collections.deque()
+      for data in self._held:
+         if isinstance(data, CatchUp):
+            self._heldBytes -= len(data)
+            if data.resend not in self._dropped:
+               self._dropped.append(data.resend)
+         else:
+            kept.append(data)
+      self._held = kept
+
+   # Send the output of calling 'send' with 'args' as a CatchUp block, or,
+   # while the client is over its high watermark, just remember to.
+   def _sendCatchUp(self, send, *args):
+      if self._overSince is not None:
+         if (send, args) not in self._dropped:
+            self._dropped.append((send, args))
+         return
+      output, self._output = self._output, []
+      try:
+         send(*args)
+      finally:
+         block, self._output = self._output, output
+      if block:
+         data = CatchUp("".join(block))
+         data.resend = (send, args)
+         self._queue(data)
+
+   # called by the OutputProducer
+   def pauseOutput(self):
+      self._writePaused = True
+      if self._stalledSince is None:
+         self._stalledSince = time.time()
+         _stalledClients.add(self)
+
+   # called by the OutputProducer
+   def resumeOutput(self):
+      self._writePaused = False
+      while self._held and not self._writePaused:
+         chunk = []
+         size  = 0
+         while self._held and size < _RESUME_CHUNK:
+            data = self._held.popleft()
+            chunk.append(data)
+            size += len(data)
+         self._heldBytes -= size
+         self.transport.writeSequence(chunk)
+      if not self._writePaused:
+         self._stalledSince = None
+         _stalledClients.discard(self)
+      if self._overSince is not None and self._heldBytes < self._outputLimits[1]:
+         self._overSince = None
+         self._cancelStallCall()
+         dropped, self._dropped = self._dropped, []
+         for send, args in dropped:
+            self._sendCatchUp(send, *args)
+         log.msg(util.printable(_("\"%(client)s\" has caught up with its output")
+            % {"client": self.describe()}))
+
+   def getHeldBytes(self):
+      return self._heldBytes
+
+   # seconds since the transport stopped taking output, or 0
+   def getStalledTime(self):
+      if self._stalledSince is None:
+         return 0.0
+      return time.time() - self._stalledSince
+
+   # the player's name, or else the client's address
+   def describe(self):
+      if self._username is not None:
+         return self._username
+      peer = self.transport.getPeer()
+      return unicode(getattr(peer, "host", peer))
+
+   # Close the connection once the buffered output has been written.
+   def disconnect(self):
+      self.flush()
+      if self._held:
+         self.transport.writeSequence(list(self._held))
+         self._held.clear()
+         self._heldBytes = 0
+      self.transport.loseConnection()
+
    def sendTokens(self, *tokens):
+      if self._frameReader is not None:
+         self._queue(frames.encodeTokens(tokens))
+         return
       s = util.join_tokens(*tokens)
       # convert to ASCII if necessary--all unicode should already be safely encoded as UTF-8
       self.sendLine(str(s)) 
@@ -640,6 +1053,9 @@ class LLawServerProtocol(basic.LineOnlyReceiver):
       self.sendTokens("*", *tokens)
    
    def sendPawnInfo(self):
+      self._sendCatchUp(self._writePawnInfo)
+
+   def _writePawnInfo(self):
       for pawn in self._game.getPawns():
          if pawn == self._game.getPawnByName("X") \
          and self._username != pawn.getPlayer() and not self._game.isSurfacingTurn():
@@ -680,8 +1096,70 @@ class LLawServerProtocol(basic.LineOnlyReceiver):
       if game.getNumPlayers() == 0 and (force_remove or 
       (game.getStatus() == GAMESTATUS_NEW or game.getStatus() == GAMESTATUS_COMPLETE)):
          GameRegistry.registry.removeGame(game)
-         for p in GameRegistry.registry.getUnjoinedUsers():
-            GameRegistry.registry.getClient(p).sendUntagged("gameremoved", game.getName())
+         GameRegistry.registry.updateLobby(game.getName())
+
+
+
+# Game events are announced to every listener in turn, mostly with identical
+# tokens (all listeners in one audience see the same move, turn number, etc.).
+# Cache the encoded wire lines (and protocol version 3 frames) so each
+# distinct announcement is encoded once and the same bytes are written to
+# every client that receives it.
+_MAX_ENCODED_LINES = 64
+_encodedLines      = {}
+_encodedFrames     = {}
+
+def encodeUntagged(*tokens):
+   line = _encodedLines.get(tokens)
+   if line is None:
+      if len(_encodedLines) >= _MAX_ENCODED_LINES:
+         _encodedLines.clear()
+      line = str(util.join_tokens("*", *tokens))
+      _encodedLines[tokens] = line
+   return line
+
+def encodeUntaggedFrame(*tokens):
+   frame = _encodedFrames.get(tokens)
+   if frame is None:
+      if len(_encodedFrames) >= _MAX_ENCODED_LINES:
+         _encodedFrames.clear()
+      frame = frames.encodeTokens(("*",) + tokens)
+      _encodedFrames[tokens] = frame
+   return frame
+
+# Send the untagged message with 'tokens' to each of 'clients', encoding it
+# at most once as a line and once as a frame, for whichever they use.
+def sendToClients(clients, *tokens):
+   line  = None
+   frame = None
+   for client in clients:
+      if client.isFramed():
+         if frame is None:
+            frame = frames.encodeTokens(("*",) + tokens)
+         client.sendFrame(frame)
+      else:
+         if line is None:
+            line = str(util.join_tokens("*", *tokens))
+         client.sendLine(line)
+
+# the tokens announcing the moves (one or two (dest, ticket) pairs) of 'pawn'
+def moveTokens(pawn, moves):
+   if len(moves) == 1:
+      (dest, transport) = moves[0]
+      return ("move", pawn.getName(), repr(dest), transport)
+   elif len(moves) == 2:
+      (dest1, transport1) = moves[0]
+      (dest2, transport2) = moves[1]
+      return ("doublemove", pawn.getName(), repr(dest1), transport1, repr(dest2), transport2)
+   else:
+      raise ServerError("Invalid number of moves.")
+
+# encoders for Game.getEncodedHistory()
+def encodeHistoryLine(*tokens):
+   return str(util.join_tokens("*", *tokens)) + LLawServerProtocol.delimiter
+
+def encodeHistoryFrame(*tokens):
+   return frames.encodeTokens(("*",) + tokens)
 
 
 
@@ -690,18 +1168,21 @@ class ProtocolGameListener:
    
    def __init__(self, username):
       self._username = username
+
+   def getUsername(self):
+      return self._username
    
-   def announceHistory(self, history):
-      GameRegistry.registry.getClient(self._username).sendHistory()
+   def announceHistory(self, history, since=None):
+      GameRegistry.registry.getClient(self._username).sendHistory(since)
 
    def announcePawnInfo(self):
       GameRegistry.registry.getClient(self._username).sendPawnInfo()
 
    def announceTurnNum(self, num):
-      GameRegistry.registry.getClient(self._username).sendUntagged("turnnum", repr(num))
+      GameRegistry.registry.getClient(self._username).sendShared("turnnum", repr(num))
 
    def announceTurn(self, pawn):
-      GameRegistry.registry.getClient(self._username).sendUntagged("turn", pawn.getName())
+      GameRegistry.registry.getClient(self._username).sendShared("turn", pawn.getName())
 
    def gameOverEvade(self, winningTeam):
       client = GameRegistry.registry.getClient(self._username)
@@ -727,22 +1208,7 @@ class ProtocolGameListener:
       GameRegistry.registry.getClient(self._username).sendUntagged("gamestart")
    
    def pawnMove(self, game, pawn, *moves):
-      if len(moves) == 1:
-         (dest, transport) = moves[0]
-         GameRegistry.registry.getClient(self._username).sendUntagged("move", 
-               pawn.getName(), repr(dest), transport)
-      elif len(moves) == 2:
-         (dest1, transport1) = moves[0]
-         (dest2, transport2) = moves[1]
-         GameRegistry.registry.getClient(self._username).sendUntagged(
-            "doublemove",
-            pawn.getName(),
-            repr(dest1), 
-            transport1,
-            repr(dest2),
-            transport2)
-      else:
-         raise ServerError(self.trans.ugettext("Invalid number of moves."))
+      GameRegistry.registry.getClient(self._username).sendShared(*moveTokens(pawn, moves))
    
    def pawnStuck(self, pawn):
       GameRegistry.registry.getClient(self._username).sendUntagged("stuck", pawn.getName())
@@ -773,5 +1239,26 @@ class ProtocolGameListener:
 
 
 
+# The listeners of a game that all see the same view of a move (see
+# Game.makeMove()).  The clients of the protocol listeners are looked up
+# once, and each announcement is encoded once and the same line or frame
+# written to all of them; any other listeners are told one by one.
+class Audience:
+   def __init__(self, listeners):
+      self._clients = []
+      self._others  = []
+      for listener in listeners:
+         if isinstance(listener, ProtocolGameListener):
+            self._clients.append(GameRegistry.registry.getClient(listener.getUsername()))
+         else:
+            self._others.append(listener)
 
+   def announceTurnNum(self, num):
+      sendToClients(self._clients, "turnnum", repr(num))
+      for listener in self._others:
+         listener.announceTurnNum(num)
 
+   def pawnMove(self, game, pawn, *moves):
+      sendToClients(self._clients, *moveTokens(pawn, moves))
+      for listener in self._others:
+         listener.pawnMove(game, pawn, *moves)
@@ -0,0 +1,85 @@
+#  London Law -- a networked manhunting board game
+#  Copyright (C) 2003-2004, 2005 Paul Pelzl
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License, Version 2, as
+#  published by the Free Software Foundation.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# RateLimit.py
+#
+# Limits how fast a client may send commands.  Each connection has a token
+# bucket holding up to 'burst' tokens, refilled at 'rate' tokens a second;
+# each command takes the tokens that its verb costs (see COMMAND_COSTS), and
+# a command that finds too few is refused.  Commands that make the server
+# scan every game or send to every player in a game cost more than ones
+# that touch only the client's own state.
+
+import time
+
+
+# tokens a second, and the most a client may save up
+DEFAULT_RATE  = 20
+DEFAULT_BURST = 60
+
+# the cost of a verb not listed in COMMAND_COSTS
+DEFAULT_COST  = 1
+
+# The default cost of each verb.  Moves are free: only the pawn whose turn
+# it is can move, and a move out of turn is refused at once, while the AI
+# clients make the detectives' moves as fast as they can.
+COMMAND_COSTS = {
+   "chatall"     : 4,
+   "chatteam"    : 2,
+   "doublemove"  : 0,
+   "history"     : 4,
+   "join"        : 2,
+   "listgames"   : 4,
+   "listplayers" : 2,
+   "move"        : 0,
+   "newgame"     : 4,
+   "requestai"   : 8}
+
+
+
+class TokenBucket:
+   def __init__(self, rate=DEFAULT_RATE, burst=DEFAULT_BURST, clock=time.time):
+      self._rate   = float(rate)
+      self._burst  = float(burst)
+      self._tokens = float(burst)
+      self._clock  = clock
+      self._last   = clock()
+
+   def _refill(self):
+      now = self._clock()
+      if now > self._last:
+         self._tokens = min(self._burst, self._tokens + (now - self._last) * self._rate)
+      self._last = now
+
+   # Take 'cost' tokens if there are that many, returning whether there were.
+   def take(self, cost):
+      self._refill()
+      if self._tokens >= cost:
+         self._tokens -= cost
+         return True
+      return False
+
+   # seconds until there will be 'cost' tokens (or the bucket is full)
+   def waitTime(self, cost):
+      self._refill()
+      return max(min(cost, self._burst) - self._tokens, 0.0) / self._rate
+
+   def getTokens(self):
+      self._refill()
+      return self._tokens
+
+
+
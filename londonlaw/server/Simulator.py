@@ -0,0 +1,213 @@
+#  London Law -- a networked manhunting board game
+#  Copyright (C) 2003-2004, 2005 Paul Pelzl
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License, Version 2, as
+#  published by the Free Software Foundation.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# Simulator.py
+#
+# Headless game runner for bot-vs-bot play.  Games are driven directly
+# through Game.makeMove(), with no network connections and no GameRegistry;
+# each pawn is moved by a policy from aiclients/policies.py.  The pawns are
+# given to two players, "Mr. X" and "Detectives", so that the network AI
+# clients (the "simple" policies, see headless.py) can play as them and see
+# only what that player would see.
+#
+# Every game is started from its own seed, which fixes the starting positions
+# and all policy decisions, so any result can be reproduced by replaying that
+# seed.  Usage:
+#
+#   $ python -m londonlaw.server.Simulator -n 1000 -x evasive -d chaser
+#   $ python -m londonlaw.server.Simulator -n 100 -x simple -d simple
+
+import random, time
+from optparse import OptionParser
+
+from londonlaw.common.protocol import *
+from londonlaw.aiclients import policies
+from Game import Game, IGameListener
+
+
+class SimulatorError(Exception):
+   pass
+
+
+
+# The outcome of one simulated game.
+#   winner      : "Mr. X" or "Detectives"
+#   reason      : "evade", "stuck" or "caught"
+#   turns       : turn number when the game ended
+#   captureTurn : turn on which Mr. X was caught, or None
+#   moves       : number of moves made by all pawns
+class GameResult(object):
+   def __init__(self, seed, winner, reason, turns, captureTurn, moves):
+      self.seed        = seed
+      self.winner      = winner
+      self.reason      = reason
+      self.turns       = turns
+      self.captureTurn = captureTurn
+      self.moves       = moves
+
+   def toDict(self):
+      return {"seed" : self.seed, "winner" : self.winner, "reason" : self.reason,
+              "turns" : self.turns, "capture_turn" : self.captureTurn,
+              "moves" : self.moves}
+
+
+
+# Game listener that just records how the game ended.
+class _ResultListener:
+   __implements__ = (IGameListener,)
+
+   def __init__(self, game):
+      self._game       = game
+      self.winner      = None
+      self.reason      = None
+      self.captureTurn = None
+
+   def gameOverEvade(self, winningTeam):
+      self.winner = winningTeam.getName()
+      self.reason = "evade"
+
+   def gameOverStuck(self, winningTeam):
+      self.winner = winningTeam.getName()
+      self.reason = "stuck"
+
+   def gameOverCaught(self, winningTeam, detective):
+      self.winner      = winningTeam.getName()
+      self.reason      = "caught"
+      self.captureTurn = self._game.getTurnNum()
+
+   def announceHistory(self, history, since=None):
+      pass
+
+   def announceTurnNum(self, num):
+      pass
+
+   def announceTurn(self, pawn):
+      pass
+
+   def announcePawnInfo(self):
+      pass
+
+   def pawnMove(self, game, pawn, *moves):
+      pass
+
+   def pawnStuck(self, pawn):
+      pass
+
+
+
+# Play one game to completion.  Mr. X is moved by 'xPolicy' and every
+# detective by 'detectivePolicy'.
+def playGame(seed, xPolicy, detectivePolicy):
+   rng  = random.Random(seed)
+   game = Game(u"simulation %d" % seed, GAMETYPE_STANDARD, rng)
+   for pawn in game.getPawns():
+      if pawn.getName() == "X":
+         pawn.setPlayer(u"Mr. X")
+      else:
+         pawn.setPlayer(u"Detectives")
+   recorder = _ResultListener(game)
+   game.addListener(recorder)
+   game.setStatus(GAMESTATUS_INPROGRESS)
+
+   numMoves = 0
+   while game.getStatus() == GAMESTATUS_INPROGRESS:
+      pawn = game.getCurrentPawn()
+      if pawn.getName() == "X":
+         move = xPolicy.chooseMove(game, pawn, rng)
+      else:
+         move = detectivePolicy.chooseMove(game, pawn, rng)
+      if not game.isLegalMove(pawn, *move):
+         raise SimulatorError("policy chose an illegal move for %s: %s" %
+               (pawn.getName(), str(move)))
+      game.makeMove(pawn, *move)
+      numMoves += 1
+
+   return GameResult(seed, recorder.winner, recorder.reason, game.getTurnNum(),
+         recorder.captureTurn, numMoves)
+
+
+# Play one game per seed, yielding each GameResult as it completes.
+def runGames(seeds, xPolicy, detectivePolicy):
+   for seed in seeds:
+      yield playGame(seed, xPolicy, detectivePolicy)
+
+
+# Reduce a list of GameResults to win counts, mean game length and a
+# histogram of capture turns.
+def summarize(results):
+   summary = {"games" : 0, "wins" : {"Mr. X" : 0, "Detectives" : 0},
+              "reasons" : {}, "mean_turns" : 0.0, "capture_turns" : {}}
+   totalTurns = 0
+   for r in results:
+      summary["games"] += 1
+      summary["wins"][r.winner] += 1
+      summary["reasons"][r.reason] = summary["reasons"].get(r.reason, 0) + 1
+      totalTurns += r.turns
+      if r.captureTurn is not None:
+         summary["capture_turns"][r.captureTurn] = \
+               summary["capture_turns"].get(r.captureTurn, 0) + 1
+   if summary["games"] > 0:
+      summary["mean_turns"] = float(totalTurns) / summary["games"]
+   return summary
+
+
+
+def main(argv=None):
+   parser = OptionParser()
+   parser.add_option("-n", "--games", dest="games", type="int", default=100,
+         help="number of games to play", metavar="NUM")
+   parser.add_option("-s", "--seed", dest="seed", type="int", default=0,
+         help="seed of the first game; game i uses seed SEED+i", metavar="SEED")
+   parser.add_option("-x", "--x-policy", dest="xPolicy", default="evasive",
+         help="Mr. X policy: " + ", ".join(sorted(policies.X_POLICIES.keys())))
+   parser.add_option("-d", "--detective-policy", dest="detectivePolicy", default="chaser",
+         help="detective policy: " + ", ".join(sorted(policies.DETECTIVE_POLICIES.keys())))
+   parser.add_option("-q", "--quiet", dest="quiet", action="store_true", default=False,
+         help="print only the summary")
+   (options, args) = parser.parse_args(argv)
+
+   try:
+      xPolicy         = policies.X_POLICIES[options.xPolicy]()
+      detectivePolicy = policies.DETECTIVE_POLICIES[options.detectivePolicy]()
+   except KeyError, e:
+      parser.error("unknown policy %s" % str(e))
+
+   start   = time.time()
+   results = []
+   for r in runGames(range(options.seed, options.seed + options.games), xPolicy, detectivePolicy):
+      results.append(r)
+      if not options.quiet:
+         print "seed %d: %s wins (%s) after %d turns, capture turn %s" % \
+               (r.seed, r.winner, r.reason, r.turns, r.captureTurn)
+   elapsed = time.time() - start
+
+   summary = summarize(results)
+   print "%d games in %.2f s (%.0f games/s)" % (summary["games"], elapsed,
+         summary["games"] / max(elapsed, 1e-9))
+   for team in ("Mr. X", "Detectives"):
+      print "  %-10s %6d wins" % (team, summary["wins"][team])
+   for reason in sorted(summary["reasons"].keys()):
+      print "  %-10s %6d games" % (reason, summary["reasons"][reason])
+   print "  mean game length %.2f turns" % summary["mean_turns"]
+   if summary["capture_turns"]:
+      print "  capture turns: " + ", ".join(["%d:%d" % (t, summary["capture_turns"][t])
+            for t in sorted(summary["capture_turns"].keys())])
+
+
+if __name__ == "__main__":
+   main()
+
+
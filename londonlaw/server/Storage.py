@@ -0,0 +1,500 @@
+#  London Law -- a networked manhunting board game
+#  Copyright (C) 2003-2004, 2005 Paul Pelzl
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License, Version 2, as
+#  published by the Free Software Foundation.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# Storage.py
+#
+# Persistent storage for the game registry, in an sqlite3 database with one
+# row per game and one row per user.
+#
+# Games are live objects that change in place as they are played, so the
+# store keeps the loaded ones in memory and writes a game back only when its
+# revision (Game.getRevision(), bumped by every change) differs from the
+# revision last written.  At most 'cacheSize' games are kept loaded: after
+# each commit, the least recently used games that nobody is listening to
+# (completed games, and games in progress whose players are all gone) are
+# dropped, to be loaded again when they are next needed.  Users are plain
+# (password, address) records and are marked dirty when they are set.
+#
+# The store also keeps a catalogue of every game (see GameInfo below), in
+# memory and in the games table alongside each pickled game, so that games
+# can be listed and purged without unpickling them.  The catalogue has a
+# version, an opaque string that changes whenever a game is added, removed,
+# or changes in a way the lobby can see, so that clients can ask for just
+# the changes since the version they last saw (getCatalogueChanges()).
+#
+# Writes are batched: changes are collected and committed in one transaction
+# at most every 'commitInterval' seconds (scheduled with the reactor), and
+# whenever flush() or close() is called.  A crash loses at most that
+# interval's worth of changes, unless a journal (see Journal.py) is attached:
+# then each commit also records the serial number of the last journaled
+# event, and empties the journal once the commit is safely on disk.
+
+import cPickle, sqlite3, time
+from collections import OrderedDict
+from twisted.internet import reactor
+from twisted.python import log
+
+
+class StorageError(Exception):
+   pass
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS games (
+   name     TEXT PRIMARY KEY,
+   data     BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS users (
+   name     TEXT PRIMARY KEY,
+   password TEXT,
+   address  TEXT
+);
+CREATE TABLE IF NOT EXISTS meta (
+   key      TEXT PRIMARY KEY,
+   value    TEXT
+);
+"""
+
+# catalogue columns of the games table, added to the ones in _SCHEMA
+_CATALOGUE_COLUMNS = (
+   ("status",     "TEXT"),
+   ("type",       "TEXT"),
+   ("players",    "INTEGER"),
+   ("start_time", "REAL"),
+   ("bots",       "INTEGER"),
+   ("listeners",  "INTEGER"))
+
+DEFAULT_COMMIT_INTERVAL = 0.5
+DEFAULT_CACHE_SIZE      = 1000
+
+# number of removed games remembered for catalogue deltas
+MAX_REMOVED_GAMES       = 1000
+
+
+
+# What the lobby and the purges need to know about a game, kept up to date
+# as the game changes.
+class GameInfo(object):
+   __slots__ = ("_name", "_status", "_type", "_numPlayers", "_startTime", "_hasBots",
+                "_hasListeners", "_version")
+
+   def __init__(self, name, status, gameType, numPlayers, startTime, hasBots,
+         hasListeners):
+      self._name         = name
+      self._status       = status
+      self._type         = gameType
+      self._numPlayers   = numPlayers
+      self._startTime    = startTime
+      self._hasBots      = hasBots
+      self._hasListeners = hasListeners
+      self._version      = 0
+
+   # Returns True if anything shown in the lobby changed.
+   def update(self, game):
+      old = (self._status, self._type, self._numPlayers)
+      self._status       = game.getStatus()
+      self._type         = game.getType()
+      self._numPlayers   = game.getNumPlayers()
+      self._startTime    = game.getStartTime()
+      self._hasBots      = game.hasBots()
+      self._hasListeners = len(game.getListeners()) > 0
+      return old != (self._status, self._type, self._numPlayers)
+
+   def getName(self):
+      return self._name
+
+   def getNumPlayers(self):
+      return self._numPlayers
+
+   def getStartTime(self):
+      return self._startTime
+
+   def getStatus(self):
+      return self._status
+
+   def getType(self):
+      return self._type
+
+   # the catalogue version at which the entry last changed
+   def getVersion(self):
+      return self._version
+
+   def setVersion(self, version):
+      self._version = version
+
+   def hasBots(self):
+      return self._hasBots
+
+   # whether anyone was listening to the game, so that after a crash the
+   # registry knows which games had players connected
+   def hasListeners(self):
+      return self._hasListeners
+
+   def row(self):
+      return (self._status, self._type, self._numPlayers, self._startTime, int(self._hasBots),
+            int(self._hasListeners))
+
+
+def makeGameInfo(game):
+   info = GameInfo(game.getName(), None, None, 0, 0, False, False)
+   info.update(game)
+   return info
+
+
+
+# 'commitInterval' is in seconds; with None, changes are only written by
+# flush() and close().  With a 'cacheSize' of None, loaded games are never
+# dropped.
+class RegistryStorage:
+   def __init__(self, filename, commitInterval=DEFAULT_COMMIT_INTERVAL,
+         cacheSize=DEFAULT_CACHE_SIZE):
+      self._filename       = filename
+      self._commitInterval = commitInterval
+      self._cacheSize      = cacheSize
+      self.evictions       = 0
+      self._db = sqlite3.connect(filename)
+      self._db.text_factory = unicode
+      self._db.executescript(_SCHEMA)
+      columns = [row[1] for row in self._db.execute("PRAGMA table_info(games)")]
+      for column, columnType in _CATALOGUE_COLUMNS:
+         if column not in columns:
+            self._db.execute("ALTER TABLE games ADD COLUMN %s %s" % (column, columnType))
+      self._db.commit()
+
+      # name -> Game for every game loaded, least recently used first
+      self._games          = OrderedDict()
+      # name -> revision of each game as last written
+      self._written        = {}
+      self._deletedGames   = {}
+      self._dirtyUsers     = {}
+      self._deletedUsers   = {}
+      self._dirtyMeta      = {}
+      self._journal        = None
+      self._flushCall      = None
+
+      # name -> GameInfo for every game in the store; rows written before
+      # the catalogue existed are filled in from the games themselves
+      self._catalogue      = {}
+      self._epoch          = "%x" % int(time.time() * 1000)
+      self._version        = 0
+      # name -> catalogue version at which the game was removed, oldest
+      # first; deltas can be sent from versions no older than _removedFloor
+      self._removed        = OrderedDict()
+      self._removedFloor   = 0
+      # (rows written before the listeners column existed may have listeners)
+      for row in self._db.execute("SELECT name, status, type, players, start_time, bots, "
+            "listeners FROM games"):
+         self._catalogue[row[0]] = GameInfo(row[0], row[1], row[2], row[3], row[4], bool(row[5]),
+               row[6] != 0)
+      for name, info in self._catalogue.items():
+         if info.getStatus() is None:
+            info.update(self.getGame(name))
+            self._written[name] = None
+
+   def getFilename(self):
+      return self._filename
+
+
+   # ---- games ----
+
+   def hasGame(self, name):
+      return name in self._catalogue
+
+   def getGame(self, name):
+      game = self._games.pop(name, None)
+      if game is not None:
+         self._games[name] = game
+      else:
+         if name not in self._catalogue:
+            raise KeyError(name)
+         row = self._db.execute("SELECT data FROM games WHERE name = ?", (name,)).fetchone()
+         if row is None:
+            raise KeyError(name)
+         game = cPickle.loads(str(row[0]))
+         self._games[name]   = game
+         self._written[name] = game.getRevision()
+         if self._cacheSize is not None and len(self._games) > self._cacheSize:
+            self.scheduleFlush()
+      return game
+
+   def getNumLoaded(self):
+      return len(self._games)
+
+   def getGameNames(self):
+      return self._catalogue.keys()
+
+   # the GameInfo of every game, without loading any of them
+   def getCatalogue(self):
+      return self._catalogue.values()
+
+   def getGameInfo(self, name):
+      return self._catalogue[name]
+
+   def getCatalogueVersion(self):
+      return "%s.%d" % (self._epoch, self._version)
+
+   # The changes to the catalogue since 'version', as (current version,
+   # GameInfos of the games added or changed, names of the games removed),
+   # or None if the changes since 'version' are not known.
+   def getCatalogueChanges(self, version):
+      try:
+         epoch, number = version.split(".")
+         number = int(number)
+      except ValueError:
+         return None
+      if epoch != self._epoch or number < self._removedFloor or number > self._version:
+         return None
+      changed = [info for info in self._catalogue.itervalues() if info.getVersion() > number]
+      removed = [name for name, removedAt in self._removed.iteritems() if removedAt > number]
+      return (self.getCatalogueVersion(), changed, removed)
+
+   def _catalogueChanged(self, info):
+      self._version += 1
+      info.setVersion(self._version)
+
+   def _catalogueRemoved(self, name):
+      self._version += 1
+      self._removed.pop(name, None)
+      self._removed[name] = self._version
+      if len(self._removed) > MAX_REMOVED_GAMES:
+         oldName, self._removedFloor = self._removed.popitem(last=False)
+
+   def getGames(self):
+      return [self.getGame(name) for name in self.getGameNames()]
+
+   # Is this very game object the one stored under its name?
+   def isStored(self, game):
+      return self._games.get(game.getName()) is game
+
+   def putGame(self, game):
+      name = game.getName()
+      self._games.pop(name, None)
+      self._games[name] = game
+      self._written[name] = None
+      self._catalogue[name] = makeGameInfo(game)
+      self._catalogueChanged(self._catalogue[name])
+      self._removed.pop(name, None)
+      if name in self._deletedGames:
+         del self._deletedGames[name]
+      self.scheduleFlush()
+
+   def deleteGame(self, name):
+      if name in self._games:
+         del self._games[name]
+         del self._written[name]
+      if name in self._catalogue:
+         del self._catalogue[name]
+         self._catalogueRemoved(name)
+      self._deletedGames[name] = True
+      self.scheduleFlush()
+
+   # Note that a game has changed, updating its catalogue entry.  Changes
+   # are written by comparing revisions at flush time; this just makes sure
+   # a flush happens.
+   def gameChanged(self, game):
+      if self.isStored(game):
+         info = self._catalogue[game.getName()]
+         if info.update(game):
+            self._catalogueChanged(info)
+         self.scheduleFlush()
+
+
+   # ---- users ----
+
+   def hasUser(self, name):
+      if name in self._dirtyUsers:
+         return True
+      if name in self._deletedUsers:
+         return False
+      row = self._db.execute("SELECT 1 FROM users WHERE name = ?", (name,)).fetchone()
+      return row is not None
+
+   # Returns (password, address); raises KeyError for unknown users.
+   def getUser(self, name):
+      if name in self._dirtyUsers:
+         return self._dirtyUsers[name]
+      if name in self._deletedUsers:
+         raise KeyError(name)
+      row = self._db.execute("SELECT password, address FROM users WHERE name = ?",
+            (name,)).fetchone()
+      if row is None:
+         raise KeyError(name)
+      return (row[0], row[1])
+
+   def getUserNames(self):
+      names = {}
+      for (name,) in self._db.execute("SELECT name FROM users"):
+         names[name] = True
+      for name in self._deletedUsers:
+         if name in names:
+            del names[name]
+      for name in self._dirtyUsers:
+         names[name] = True
+      return names.keys()
+
+   def putUser(self, name, password, address):
+      self._dirtyUsers[name] = (password, address)
+      if name in self._deletedUsers:
+         del self._deletedUsers[name]
+      self.scheduleFlush()
+
+   def deleteUser(self, name):
+      if name in self._dirtyUsers:
+         del self._dirtyUsers[name]
+      self._deletedUsers[name] = True
+      self.scheduleFlush()
+
+
+   # ---- other settings ----
+
+   def getMeta(self, key, default=None):
+      if key in self._dirtyMeta:
+         return self._dirtyMeta[key]
+      row = self._db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+      if row is None:
+         return default
+      return row[0]
+
+   def setMeta(self, key, value):
+      self._dirtyMeta[key] = unicode(value)
+      self.scheduleFlush()
+
+   # Attach a MoveJournal, to be checkpointed by every commit.
+   def setJournal(self, journal):
+      self._journal = journal
+      if journal is not None:
+         journal.setSerial(int(self.getMeta("journal_serial", 0)))
+
+
+   # ---- writing ----
+
+   def scheduleFlush(self):
+      if self._flushCall is None and self._commitInterval is not None:
+         self._flushCall = reactor.callLater(self._commitInterval, self._timedFlush)
+
+   def _timedFlush(self):
+      self._flushCall = None
+      try:
+         self.flush()
+      except sqlite3.Error, e:
+         log.msg("failed to write the game registry: " + str(e))
+         self.scheduleFlush()
+
+   # Write every changed game and user in one transaction.  Returns the
+   # number of records written or deleted.
+   def flush(self):
+      if self._flushCall is not None and self._flushCall.active():
+         self._flushCall.cancel()
+      self._flushCall = None
+
+      gameRows = []
+      for name, game in self._games.items():
+         revision = game.getRevision()
+         if self._written.get(name) != revision:
+            gameRows.append((name, sqlite3.Binary(cPickle.dumps(game, 2)))
+                  + self._catalogue[name].row() + (revision,))
+      userRows = [(name, record[0], record[1]) for name, record in self._dirtyUsers.items()]
+      deletedGames = self._deletedGames.keys()
+      deletedUsers = self._deletedUsers.keys()
+      if self._journal is not None:
+         serial = unicode(self._journal.getSerial())
+         if serial != self.getMeta("journal_serial"):
+            self._dirtyMeta["journal_serial"] = serial
+      metaRows = self._dirtyMeta.items()
+      count = len(gameRows) + len(userRows) + len(deletedGames) + len(deletedUsers) \
+            + len(metaRows)
+      if count == 0:
+         self._evict()
+         return 0
+
+      db = self._db
+      try:
+         db.executemany("DELETE FROM games WHERE name = ?", [(n,) for n in deletedGames])
+         db.executemany("DELETE FROM users WHERE name = ?", [(n,) for n in deletedUsers])
+         db.executemany("INSERT OR REPLACE INTO games "
+               "(name, data, status, type, players, start_time, bots, listeners) "
+               "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", [row[:-1] for row in gameRows])
+         db.executemany("INSERT OR REPLACE INTO users (name, password, address) VALUES (?, ?, ?)",
+               userRows)
+         db.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", metaRows)
+         db.commit()
+      except:
+         db.rollback()
+         raise
+
+      for row in gameRows:
+         self._written[row[0]] = row[-1]
+      for name in deletedGames:
+         del self._deletedGames[name]
+      for name in deletedUsers:
+         del self._deletedUsers[name]
+      self._dirtyUsers.clear()
+      self._dirtyMeta.clear()
+      if self._journal is not None:
+         self._journal.checkpoint()
+      self._evict()
+      return count
+
+   # Drop least recently used games until no more than 'cacheSize' are
+   # loaded, skipping games with listeners and games not yet written.
+   def _evict(self):
+      if self._cacheSize is None:
+         return
+      excess = len(self._games) - self._cacheSize
+      if excess <= 0:
+         return
+      for name, game in self._games.items():
+         if not game.getListeners() and self._written[name] == game.getRevision():
+            del self._games[name]
+            del self._written[name]
+            self.evictions += 1
+            excess -= 1
+            if excess == 0:
+               break
+
+   def close(self):
+      self.flush()
+      self._db.close()
+
+
+
+# Copy the contents of the old shelve-based databases into 'storage'.
+# Returns (number of games, number of users) copied.
+def migrateShelves(gamesShelf, usersShelf, storage):
+   import shelve
+   numGames = 0
+   numUsers = 0
+   if gamesShelf is not None:
+      games = shelve.open(gamesShelf, "r")
+      try:
+         for key in games.keys():
+            storage.putGame(games[key])
+            numGames += 1
+      finally:
+         games.close()
+   if usersShelf is not None:
+      users = shelve.open(usersShelf, "r")
+      try:
+         for key in users.keys():
+            password, address = users[key]
+            storage.putUser(key.decode("utf-8"), password, address)
+            numUsers += 1
+      finally:
+         users.close()
+   storage.flush()
+   return (numGames, numUsers)
+
+
@@ -0,0 +1,267 @@
+#  London Law -- a networked manhunting board game
+#  Copyright (C) 2003-2004, 2005 Paul Pelzl
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License, Version 2, as
+#  published by the Free Software Foundation.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# Tournament.py
+#
+# Round-robin tournament between Mr. X and detective policies, spread over a
+# pool of worker processes.  Every pairing of an X entrant with a detective
+# entrant plays the same N seeds, so the pairings are compared on identical
+# starting positions.
+#
+# Each game result is written as one JSON object per line as soon as the game
+# finishes in a worker (in completion order, not seed order), and a table of
+# Mr. X win rates with Wilson score confidence intervals is printed at the
+# end.  Entrants are named either by an algorithm name from ai_list.py or by
+# a policy name from policies.py.  Usage:
+#
+#   $ python -m londonlaw.server.Tournament -n 100000 -j 32 -o results.jsonl
+
+import json, math, multiprocessing, Queue, sys, time
+from optparse import OptionParser
+
+from londonlaw.aiclients import ai_list, policies
+from londonlaw.common import distances
+import Simulator
+
+
+class TournamentError(Exception):
+   pass
+
+
+# z values for the supported confidence levels
+_Z_VALUES = {0.90 : 1.6449, 0.95 : 1.9600, 0.99 : 2.5758}
+
+
+
+# Map an entrant name to a policy name, accepting either an algorithm from
+# ai_list.py or a policy name directly.
+def resolvePolicy(name, policyTable):
+   name = ai_list.ALGORITHM_POLICIES.get(name, name)
+   if name not in policyTable:
+      raise TournamentError("unknown entrant \"%s\"" % name)
+   return name
+
+
+# Default entrants: every algorithm listed in ai_list.py.
+def defaultEntrants():
+   xs   = [algorithm for algorithm, launcher in ai_list.X_ALGORITHMS]
+   dets = [algorithm for algorithm, launcher in ai_list.DETECTIVE_ALGORITHMS]
+   return xs, dets
+
+
+# Wilson score interval for 'wins' successes out of 'games' trials.
+# Returns (low, high); (0.0, 1.0) if there were no games.
+def wilsonInterval(wins, games, confidence=0.95):
+   if games == 0:
+      return (0.0, 1.0)
+   z      = _Z_VALUES[confidence]
+   p      = float(wins) / games
+   denom  = 1.0 + z * z / games
+   centre = (p + z * z / (2.0 * games)) / denom
+   spread = z * math.sqrt(p * (1.0 - p) / games + z * z / (4.0 * games * games)) / denom
+   return (max(0.0, centre - spread), min(1.0, centre + spread))
+
+
+
+# Worker side.  Policy objects are created once per worker process and
+# reused for every game it plays.  Results are put on a queue shared with
+# the parent as each game finishes.
+_workerPolicies = {}
+_resultQueue    = None
+
+def _initWorker(resultQueue):
+   global _resultQueue
+   _resultQueue = resultQueue
+   # make sure each worker has the distance tables mapped before it starts
+   distances.get_tables()
+
+
+def _getPolicy(table, name):
+   key = (id(table), name)
+   if key not in _workerPolicies:
+      _workerPolicies[key] = table[name]()
+   return _workerPolicies[key]
+
+
+# Play a batch of games for one pairing; 'task' is (xEntrant, xPolicy,
+# detEntrant, detPolicy, seeds).  Calls 'report' with each result dict.
+def _playBatch(task, report):
+   xEntrant, xName, detEntrant, detName, seeds = task
+   xPolicy   = _getPolicy(policies.X_POLICIES, xName)
+   detPolicy = _getPolicy(policies.DETECTIVE_POLICIES, detName)
+   for seed in seeds:
+      d = Simulator.playGame(seed, xPolicy, detPolicy).toDict()
+      d["x"]          = xEntrant
+      d["detectives"] = detEntrant
+      report(d)
+
+
+def _playWorkerBatch(task):
+   _playBatch(task, _resultQueue.put)
+
+
+# Split the seeds for every pairing into batches of at most 'batchSize'
+# games.  Batches are interleaved across pairings so that partial results
+# cover every pairing.
+def makeTasks(xEntrants, detEntrants, seeds, batchSize):
+   tasks = []
+   for start in range(0, len(seeds), batchSize):
+      batch = seeds[start:start + batchSize]
+      for x in xEntrants:
+         for det in detEntrants:
+            tasks.append((x, resolvePolicy(x, policies.X_POLICIES),
+                          det, resolvePolicy(det, policies.DETECTIVE_POLICIES), batch))
+   return tasks
+
+
+# Run the tournament, calling 'callback' with each result dict as soon as
+# its game finishes.  With workers <= 1 the games are played in this
+# process.
+def runTournament(xEntrants, detEntrants, seeds, workers, callback, batchSize=None):
+   if batchSize is None:
+      # a few batches per worker and pairing keeps every worker busy until
+      # the end, while keeping the number of tasks handed out low
+      batchSize = max(1, min(200, len(seeds) // (max(workers, 1) * 4)))
+   tasks = makeTasks(xEntrants, detEntrants, seeds, batchSize)
+
+   if workers <= 1:
+      for task in tasks:
+         _playBatch(task, callback)
+      return
+
+   resultQueue = multiprocessing.Queue()
+   pool = multiprocessing.Pool(workers, _initWorker, (resultQueue,))
+   try:
+      batches   = pool.map_async(_playWorkerBatch, tasks, chunksize=1)
+      remaining = len(seeds) * len(xEntrants) * len(detEntrants)
+      while remaining > 0:
+         try:
+            result = resultQueue.get(timeout=0.5)
+         except Queue.Empty:
+            # a worker that raised would leave results missing for good
+            if batches.ready() and not batches.successful():
+               batches.get()
+            continue
+         callback(result)
+         remaining -= 1
+      batches.get()
+      pool.close()
+   except:
+      pool.terminate()
+      raise
+   pool.join()
+
+
+
+# Accumulates results into per-pairing tallies.
+class Standings(object):
+   def __init__(self):
+      self._tallies = {}
+
+   def add(self, result):
+      key = (result["x"], result["detectives"])
+      if key not in self._tallies:
+         self._tallies[key] = {"games" : 0, "xWins" : 0, "turns" : 0}
+      tally = self._tallies[key]
+      tally["games"] += 1
+      tally["turns"] += result["turns"]
+      if result["winner"] == "Mr. X":
+         tally["xWins"] += 1
+
+   def getTallies(self):
+      return self._tallies
+
+   # Format the table of Mr. X win rates, one line per pairing.
+   def format(self, confidence=0.95):
+      lines = ["%-24s %-24s %8s %8s %19s %7s" % ("Mr. X", "Detectives", "games",
+            "X wins", "%d%% interval" % int(confidence * 100 + 0.5), "turns")]
+      keys = self._tallies.keys()
+      keys.sort()
+      for key in keys:
+         tally = self._tallies[key]
+         games = tally["games"]
+         low, high = wilsonInterval(tally["xWins"], games, confidence)
+         lines.append("%-24s %-24s %8d %7.2f%% [%6.2f%%, %6.2f%%] %7.2f" % (key[0], key[1],
+               games, 100.0 * tally["xWins"] / games, 100.0 * low, 100.0 * high,
+               float(tally["turns"]) / games))
+      return "\n".join(lines)
+
+
+
+def main(argv=None):
+   xDefault, detDefault = defaultEntrants()
+   parser = OptionParser()
+   parser.add_option("-n", "--games", dest="games", type="int", default=1000,
+         help="number of games per pairing", metavar="NUM")
+   parser.add_option("-s", "--seed", dest="seed", type="int", default=0,
+         help="seed of the first game; game i uses seed SEED+i", metavar="SEED")
+   parser.add_option("-j", "--jobs", dest="jobs", type="int",
+         default=multiprocessing.cpu_count(),
+         help="number of worker processes (default: one per CPU)", metavar="NUM")
+   parser.add_option("-x", "--x", dest="xEntrants", action="append",
+         help="Mr. X entrant (may be repeated; default: every X algorithm)", metavar="NAME")
+   parser.add_option("-d", "--detectives", dest="detEntrants", action="append",
+         help="detective entrant (may be repeated; default: every detective algorithm)",
+         metavar="NAME")
+   parser.add_option("-o", "--output", dest="output", default="-",
+         help="file to write per-game JSON lines to (default: standard output)",
+         metavar="FILE")
+   parser.add_option("-c", "--confidence", dest="confidence", type="float", default=0.95,
+         help="confidence level for win-rate intervals: 0.90, 0.95 or 0.99")
+   (options, args) = parser.parse_args(argv)
+
+   if options.confidence not in _Z_VALUES:
+      parser.error("unsupported confidence level %s" % options.confidence)
+   xEntrants   = options.xEntrants or xDefault
+   detEntrants = options.detEntrants or detDefault
+   try:
+      for x in xEntrants:
+         resolvePolicy(x, policies.X_POLICIES)
+      for det in detEntrants:
+         resolvePolicy(det, policies.DETECTIVE_POLICIES)
+   except TournamentError, e:
+      parser.error(str(e))
+
+   if options.output == "-":
+      out = sys.stdout
+   else:
+      out = open(options.output, "w")
+
+   standings = Standings()
+   def record(result):
+      out.write(json.dumps(result, sort_keys=True) + "\n")
+      out.flush()
+      standings.add(result)
+
+   start = time.time()
+   try:
+      runTournament(xEntrants, detEntrants,
+            range(options.seed, options.seed + options.games), options.jobs, record)
+   finally:
+      if out is not sys.stdout:
+         out.close()
+   elapsed = time.time() - start
+
+   totalGames = options.games * len(xEntrants) * len(detEntrants)
+   sys.stderr.write("%d games in %.2f s (%.0f games/s) with %d workers\n" %
+         (totalGames, elapsed, totalGames / max(elapsed, 1e-9), options.jobs))
+   sys.stderr.write(standings.format(options.confidence) + "\n")
+
+
+if __name__ == "__main__":
+   main()
+
+
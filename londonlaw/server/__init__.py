@@ -18,7 +18,8 @@
 from twisted.internet import protocol, reactor, task
 from twisted.python import log
 from londonlaw.common.protocol import *
-from Protocol import LLawServerProtocol
+from londonlaw.common import dispatch
+from Protocol import LLawServerProtocol, getPeakHeldBytes
 from optparse import OptionParser
 import GameRegistry
 import sys, gettext, os
@@ -52,5 +53,10 @@ def init():
    reactor.run()
 
    registry.close()
+   commands = dispatch.getTable(LLawServerProtocol, "cmd_").getCounts()
+   if commands:
+      log.msg("commands handled: " + ", ".join(["%s %d" % item for item in commands]))
+   if getPeakHeldBytes() > 0:
+      log.msg("most output held back for a client: %d bytes" % getPeakHeldBytes())
 
 
@@ -0,0 +1,102 @@
+#  London Law -- a networked manhunting board game
+#  Copyright (C) 2003-2004, 2005 Paul Pelzl
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License, Version 2, as
+#  published by the Free Software Foundation.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# test_codec.py
+#
+# Randomized checks of the protocol codec: codec.split_tokens() must agree
+# with shlex.split() (errors included), codec.join_tokens() must give lines
+# that both split back into the same tokens, and the messages protocol
+# version 3 packs must survive framing.
+
+import random, shlex, unittest
+from londonlaw.common import codec, frames
+from londonlaw.common.GameState import PAWN_NAMES
+from londonlaw.common.graph import TICKET_NAMES
+
+
+# number of random cases each check tries
+CASES = 20000
+
+# characters the random lines and tokens are built from
+_FUZZ_CHARS = " \t\r\n\x0b\x0c\"'\\#*ab\xc3\xa9"
+
+
+def _fuzzString(rng, maxLength):
+   return "".join([rng.choice(_FUZZ_CHARS) for i in range(rng.randint(0, maxLength))])
+
+def _shlexSplit(line):
+   try:
+      return shlex.split(line)
+   except ValueError, e:
+      return "ValueError: " + str(e)
+
+def _codecSplit(line):
+   try:
+      return codec.split_tokens(line)
+   except ValueError, e:
+      return "ValueError: " + str(e)
+
+
+# A random message of one of the kinds protocol version 3 packs.
+def _randomMessage(rng):
+   pawn   = lambda: rng.choice(PAWN_NAMES)
+   loc    = lambda: str(rng.choice((-1, rng.randint(1, 199))))
+   ticket = lambda: rng.choice(TICKET_NAMES)
+   kind   = rng.randint(0, 6)
+   if kind == 0:
+      return ["*", "move", pawn(), loc(), ticket()]
+   elif kind == 1:
+      return ["*", "doublemove", pawn(), loc(), ticket(), loc(), ticket()]
+   elif kind == 2:
+      return ["*", "turn", pawn()]
+   elif kind == 3:
+      return ["*", "turnnum", str(rng.randint(0, 24))]
+   elif kind == 4:
+      return ["*", "pawninfo", pawn(), _fuzzString(rng, 8), loc()] + \
+            [str(rng.randint(-1, 20)) for i in range(5)]
+   elif kind == 5:
+      return ["*", "history", str(rng.randint(0, 24))] + \
+            [" ".join((pawn(), loc(), ticket())) for i in range(rng.randint(0, 6))]
+   else:
+      return ["*", "history", "end"]
+
+
+class CodecTestCase(unittest.TestCase):
+   def testSplitMatchesShlex(self):
+      rng = random.Random(0)
+      for i in xrange(CASES):
+         line = _fuzzString(rng, 24)
+         self.assertEqual(_codecSplit(line), _shlexSplit(line), "splitting %r" % line)
+
+   def testJoinSplits(self):
+      rng = random.Random(1)
+      for i in xrange(CASES):
+         tokens = [_fuzzString(rng, 8) for j in range(rng.randint(0, 6))]
+         line   = codec.join_tokens(*tokens)
+         self.assertEqual(codec.split_tokens(line), tokens, "joined as %r" % line)
+         self.assertEqual(shlex.split(line), tokens, "joined as %r" % line)
+
+   def testFramesDecode(self):
+      rng = random.Random(2)
+      for i in xrange(CASES):
+         tokens = _randomMessage(rng)
+         frame  = frames.encodeTokens(tokens)
+         self.assertEqual(frames.decode(ord(frame[2]), frame[3:]), tokens)
+
+
+
+if __name__ == "__main__":
+   unittest.main()
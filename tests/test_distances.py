@@ -0,0 +1,61 @@
+#  London Law -- a networked manhunting board game
+#  Copyright (C) 2003-2004, 2005 Paul Pelzl
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License, Version 2, as
+#  published by the Free Software Foundation.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# test_distances.py
+#
+# Checks for the precomputed distance tables.  The tables are built in
+# memory, so running these never touches the on-disk cache.
+
+import unittest
+from londonlaw.common import distances
+
+
+class DistanceTablesTestCase(unittest.TestCase):
+   def setUp(self):
+      self.tables = distances.DistanceTables(distances.build_tables())
+
+   def testMaxDistance(self):
+      self.assertEqual(distances.MAX_DISTANCE,
+            self.tables.max_distance(distances.NO_BLACK))
+
+   def testRowMatchesBfs(self):
+      for ticket_set in distances.TICKET_SETS:
+         for source in (1, 67, 199):
+            expected = []
+            for d in distances._bfs(source, ticket_set):
+               if d == distances.UNREACHABLE:
+                  expected.append(None)
+               else:
+                  expected.append(d)
+            self.assertEqual(self.tables.row(source, ticket_set), expected)
+
+   def testNearest(self):
+      for ticket_set in distances.TICKET_SETS:
+         for targets in ((5,), (13, 67, 140), range(1, distances.SIZE, 7)):
+            for source in range(1, distances.SIZE):
+               expected = [self.tables.distance(source, target, ticket_set)
+                     for target in targets]
+               expected = [d for d in expected if d is not None]
+               if expected:
+                  expected = min(expected)
+               else:
+                  expected = None
+               self.assertEqual(self.tables.nearest(source, targets, ticket_set), expected)
+
+
+
+if __name__ == "__main__":
+   unittest.main()
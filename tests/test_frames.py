@@ -0,0 +1,71 @@
+#  London Law -- a networked manhunting board game
+#  Copyright (C) 2003-2004, 2005 Paul Pelzl
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License, Version 2, as
+#  published by the Free Software Foundation.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# test_frames.py
+#
+# Checks that the server holds protocol version 3 clients to the same
+# message length as line clients: a frame longer than a line may be gets
+# the client disconnected, as an over-long line does.
+
+import gettext, unittest
+gettext.install("londonlaw", unicode=True)
+
+from twisted.test import proto_helpers
+from londonlaw.common import frames
+from londonlaw.common.protocol import *
+from londonlaw.server import GameRegistry
+from londonlaw.server.Game import Game
+from londonlaw.server import Protocol
+
+
+class FrameReaderTestCase(unittest.TestCase):
+   def testTooLong(self):
+      reader = frames.FrameReader(10)
+      self.assertEqual(reader.feed(frames.encodeText("x" * 10)), [(frames.OP_TEXT, "x" * 10)])
+      # refused as soon as the length is in, before the payload arrives
+      self.assertRaises(frames.FrameError, reader.feed, frames.encodeText("x" * 11)[:3])
+
+
+class FrameLengthTestCase(unittest.TestCase):
+   def setUp(self):
+      self.client = Protocol.LLawServerProtocol()
+      self.client.makeConnection(proto_helpers.StringTransport())
+
+   def tearDown(self):
+      Protocol.flushOutput()
+
+   def startFrames(self):
+      self.client.dataReceived("#1 protocol %s\r\n" % BINARY_PROTOCOL_VERSION)
+      self.assertTrue(self.client.isFramed())
+
+   def testLongestFrame(self):
+      self.startFrames()
+      self.client.dataReceived(frames.encodeText("#2 noop " + "x" * (self.client.MAX_LENGTH - 8)))
+      self.assertFalse(self.client.transport.disconnecting)
+
+   def testFrameTooLong(self):
+      self.startFrames()
+      self.client.dataReceived(frames.encodeText("#2 noop " + "x" * (self.client.MAX_LENGTH - 7)))
+      self.assertTrue(self.client.transport.disconnecting)
+
+   def testLineTooLong(self):
+      self.client.dataReceived("#1 noop " + "x" * self.client.MAX_LENGTH + "\r\n")
+      self.assertTrue(self.client.transport.disconnecting)
+
+
+
+if __name__ == "__main__":
+   unittest.main()
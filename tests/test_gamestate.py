@@ -0,0 +1,72 @@
+#  London Law -- a networked manhunting board game
+#  Copyright (C) 2003-2004, 2005 Paul Pelzl
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License, Version 2, as
+#  published by the Free Software Foundation.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# test_gamestate.py
+#
+# Checks that GameState.apply() and undo() keep the position and its
+# Zobrist hash consistent, on random play from the standard start.
+
+import random, unittest
+from londonlaw.common import zobrist
+from londonlaw.common.GameState import *
+
+
+# the standard starting tickets
+def startingState(rng):
+   tickets = [0] * (NUM_PAWNS * NUM_TICKETS)
+   for name, amount in (("taxi", -1), ("bus", -1), ("underground", -1),
+         ("black", 5), ("double", 2)):
+      tickets[X_INDEX * NUM_TICKETS + TICKET_INDEX[name]] = amount
+   for det in DETECTIVES:
+      for name, amount in (("taxi", 10), ("bus", 8), ("underground", 4)):
+         tickets[det * NUM_TICKETS + TICKET_INDEX[name]] = amount
+   return GameState(rng.sample(range(1, 200), NUM_PAWNS), tickets)
+
+
+class ApplyUndoTestCase(unittest.TestCase):
+   def assertHashed(self, state):
+      self.assertEqual(state.hash, zobrist.hashPosition(state.locations, state.tickets,
+            state.turnNum, state.current))
+
+   def testRandomPlay(self):
+      rng = random.Random(0)
+      for game in range(50):
+         state = startingState(rng)
+         keys  = []
+         for ply in range(60):
+            moves = state.legalMoves(state.current)
+            if not moves:
+               break
+            keys.append((state.key(), state.hash))
+            state.apply(rng.choice(moves))
+            self.assertHashed(state)
+         while keys:
+            state.undo()
+            self.assertEqual((state.key(), state.hash), keys.pop())
+
+   def testSpendingMissingTicket(self):
+      state = startingState(random.Random(1))
+      dest, ticket = state.legalMoves(1, False)[0][1:]
+      state.setCurrent(1)
+      state.setTicketAmount(1, ticket, 0)
+      before = (state.key(), state.hash)
+      self.assertRaises(GameStateError, state.apply, (1, dest, ticket))
+      self.assertEqual((state.key(), state.hash), before)
+
+
+
+if __name__ == "__main__":
+   unittest.main()
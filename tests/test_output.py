@@ -0,0 +1,105 @@
+#  London Law -- a networked manhunting board game
+#  Copyright (C) 2003-2004, 2005 Paul Pelzl
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License, Version 2, as
+#  published by the Free Software Foundation.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# test_output.py
+#
+# Checks that a client whose transport stops taking output is disconnected
+# once it has been over its high watermark for the stall timeout, whether
+# or not any more output comes for it.  The server's reactor is replaced
+# with a twisted.internet.task.Clock.
+
+import gettext, unittest
+gettext.install("londonlaw", unicode=True)
+
+from twisted.internet import task
+from londonlaw.server import GameRegistry
+from londonlaw.server.Game import Game
+from londonlaw.server import Protocol
+
+
+# A transport whose write buffer is always full.
+class _StalledTransport(object):
+   def __init__(self):
+      self.aborted       = False
+      self.disconnecting = False
+      self.producer      = None
+
+   def registerProducer(self, producer, streaming):
+      self.producer = producer
+      producer.pauseProducing()
+
+   def write(self, data):
+      pass
+
+   def writeSequence(self, seq):
+      pass
+
+   def abortConnection(self):
+      self.aborted = True
+
+   def getPeer(self):
+      return "slow client"
+
+
+class StallTimeoutTestCase(unittest.TestCase):
+   def setUp(self):
+      self.reactor = Protocol.reactor
+      self.clock   = task.Clock()
+      Protocol.reactor = self.clock
+      self.client = Protocol.LLawServerProtocol()
+      self.client.makeConnection(_StalledTransport())
+      self.high, low, self.timeout = self.client._outputLimits
+
+   def tearDown(self):
+      Protocol.flushOutput()
+      Protocol.reactor = self.reactor
+
+   # fill the client's output past its high watermark
+   def overflow(self):
+      line = "x" * 1000
+      for i in range(self.high / len(line) + 1):
+         self.client.sendLine(line)
+      self.client.flush()
+
+   def stallCalls(self):
+      return [call for call in self.clock.getDelayedCalls()
+              if call.active() and call.func == self.client._stallTimeout]
+
+   def testDisconnectedWithoutMoreOutput(self):
+      self.overflow()
+      self.clock.advance(self.timeout - 1)
+      self.assertFalse(self.client.transport.aborted)
+      self.clock.advance(2)
+      self.assertTrue(self.client.transport.aborted)
+      self.assertEqual(self.client.getHeldBytes(), 0)
+
+   def testTimeoutCancelledOnConnectionLost(self):
+      self.overflow()
+      self.assertEqual(len(self.stallCalls()), 1)
+      self.client.connectionLost(None)
+      self.assertEqual(self.stallCalls(), [])
+
+   def testTimeoutCancelledOnCatchingUp(self):
+      self.overflow()
+      self.client.transport.producer.resumeProducing()
+      self.assertEqual(self.stallCalls(), [])
+      self.clock.advance(self.timeout + 1)
+      self.assertFalse(self.client.transport.aborted)
+
+
+
+if __name__ == "__main__":
+   unittest.main()
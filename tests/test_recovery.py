@@ -0,0 +1,87 @@
+#  London Law -- a networked manhunting board game
+#  Copyright (C) 2003-2004, 2005 Paul Pelzl
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License, Version 2, as
+#  published by the Free Software Foundation.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# test_recovery.py
+#
+# Checks that the game registry recovers from a crash: the journal is
+# replayed, the catalogue matches the recovered games, and only the games
+# that need it are loaded.  A crash is simulated by dropping the registry
+# without closing it.
+
+import gettext, random, shutil, tempfile, unittest
+gettext.install("londonlaw", unicode=True)
+
+from londonlaw.common.protocol import *
+from londonlaw.server import GameRegistry
+from londonlaw.server.Game import Game
+
+
+# stands in for a connected player's listener
+class _Listener:
+   pass
+
+
+class RecoveryTestCase(unittest.TestCase):
+   def setUp(self):
+      self.dbDir = tempfile.mkdtemp(prefix="llaw-test-")
+      self.registry = GameRegistry.getHandle(self.dbDir)
+
+   def tearDown(self):
+      GameRegistry.registry.close()
+      GameRegistry.registry = None
+      shutil.rmtree(self.dbDir, ignore_errors=True)
+
+   def startGame(self, name):
+      game = Game(name, GAMETYPE_STANDARD, random.Random(0))
+      self.registry.addGame(game)
+      game.setStatus(GAMESTATUS_INPROGRESS)
+      return game
+
+   def crash(self):
+      self.registry.syncJournal()
+      GameRegistry.registry = None
+      self.registry = GameRegistry.getHandle(self.dbDir)
+
+   def testCatalogueRefreshed(self):
+      self.startGame(u"journaled")
+      self.crash()
+      self.assertEqual(self.registry.getGameInfo(u"journaled").getStatus(),
+            GAMESTATUS_INPROGRESS)
+      self.assertEqual(self.registry.getGame(u"journaled").getStatus(),
+            GAMESTATUS_INPROGRESS)
+
+   def testOnlyJournaledGamesLoaded(self):
+      self.startGame(u"written")
+      self.registry.sync()
+      self.startGame(u"journaled")
+      self.crash()
+      self.assertEqual(self.registry.getNumLoadedGames(), 1)
+      self.assertTrue(self.registry.hasGame(u"written"))
+      self.assertTrue(self.registry.hasGame(u"journaled"))
+
+   def testListenersDropped(self):
+      game = self.startGame(u"listened")
+      game.addListener(_Listener())
+      self.registry.sync()
+      self.crash()
+      self.assertEqual(self.registry.getNumLoadedGames(), 1)
+      self.assertEqual(self.registry.getGame(u"listened").getListeners(), {})
+      self.assertFalse(self.registry.getGameInfo(u"listened").hasListeners())
+
+
+
+if __name__ == "__main__":
+   unittest.main()
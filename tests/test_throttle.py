@@ -0,0 +1,79 @@
+#  London Law -- a networked manhunting board game
+#  Copyright (C) 2003-2004, 2005 Paul Pelzl
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License, Version 2, as
+#  published by the Free Software Foundation.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# test_throttle.py
+#
+# Checks that a client out of tokens stops being read until it has enough
+# again, in line mode and with protocol version 3 frames alike: commands
+# that arrived in the same chunk of data wait rather than being refused.
+# The server's reactor is replaced with a twisted.internet.task.Clock.
+
+import gettext, unittest
+gettext.install("londonlaw", unicode=True)
+
+from twisted.internet import task
+from twisted.test import proto_helpers
+from londonlaw.common import codec, frames
+from londonlaw.server import GameRegistry
+from londonlaw.server.Game import Game
+from londonlaw.server import Protocol, RateLimit
+
+
+class ThrottleTestCase(unittest.TestCase):
+   def setUp(self):
+      self.reactor = Protocol.reactor
+      self.clock   = task.Clock()
+      Protocol.reactor = self.clock
+      self.client = Protocol.LLawServerProtocol()
+      self.client.makeConnection(proto_helpers.StringTransport())
+      # room for two commands, then one a second
+      self.client._bucket = RateLimit.TokenBucket(1, 2, self.clock.seconds)
+
+   def tearDown(self):
+      Protocol.flushOutput()
+      Protocol.reactor = self.reactor
+
+   # the (tag, reply) of every reply sent so far
+   def replies(self):
+      Protocol.flushOutput()
+      data = self.client.transport.value()
+      if self.client.isFramed():
+         tokens = [frames.decode(opcode, payload)
+                   for opcode, payload in frames.FrameReader().feed(data)]
+      else:
+         tokens = [codec.split_tokens(line) for line in data.split("\r\n") if line]
+      return [tuple(t[:2]) for t in tokens]
+
+   def check(self, encode):
+      self.client.dataReceived("".join([encode("#%d noop" % i) for i in range(1, 6)]))
+      self.assertEqual(self.replies(), [("#1", "ok"), ("#2", "ok"), ("#3", "no")])
+      self.clock.advance(1)
+      self.assertEqual(self.replies()[3:], [("#4", "ok"), ("#5", "no")])
+      self.clock.advance(1)
+      self.assertEqual(len(self.replies()), 5)
+
+   def testLines(self):
+      self.check(lambda line: line + "\r\n")
+
+   def testFrames(self):
+      self.client._frameReader = frames.FrameReader()
+      self.client.setRawMode()
+      self.check(frames.encodeText)
+
+
+
+if __name__ == "__main__":
+   unittest.main()